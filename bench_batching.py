@@ -0,0 +1,113 @@
+"""Per-call search vs cross-session micro-batching (retrieval.BatchingEngine).
+
+    python bench_batching.py --synthetic 69000 --dim 1536 --concurrency 1,10,100
+    python bench_batching.py --store embs_full.store --window-ms 2
+
+Each of C threads stands in for one session's ``call_top``: it searches one
+query (``--parts`` rows) at a time, back to back, for ``--seconds``. The
+per-call path sends every search straight to the exact engine. The batched
+path goes through BatchingEngine, which stacks the searches from a
+``--window-ms`` window into one matmul + top-k. Reports queries/sec and
+p50/p99 latency per search.
+
+Exits 1 unless the batched path returns the same rows as the per-call path
+(within float rounding) for searches issued from many threads at once, and groups them into batches
+of more than one search when sessions overlap.
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import retrieval
+from bench_retrieval import load_matrix, make_queries
+
+
+def drive(engine, queries: np.ndarray, concurrency: int, seconds: float, parts: int, k: int):
+    latencies = [[] for _ in range(concurrency)]
+    stop = time.perf_counter() + seconds
+
+    def session(i):
+        rng = np.random.default_rng(i)
+        while time.perf_counter() < stop:
+            q = queries[rng.integers(0, len(queries), parts)]
+            t0 = time.perf_counter()
+            engine.search(q, k)
+            latencies[i].append((time.perf_counter() - t0) * 1000)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    lat = np.concatenate([np.array(l) for l in latencies])
+    return len(lat) * parts / elapsed, np.percentile(lat, 50), np.percentile(lat, 99)
+
+
+def same_results(exact, batching, queries: np.ndarray, concurrency: int, parts: int, k: int) -> bool:
+    """Whether concurrent batched searches return what each search returns on its own"""
+    mismatches = []
+
+    def session(i):
+        rng = np.random.default_rng(1000 + i)
+        for _ in range(20):
+            q = queries[rng.integers(0, len(queries), parts)]
+            (ids, scores), (want_ids, want_scores) = batching.search(q, k), exact.search(q, k)
+            # A batched matmul may round differently, reordering near-ties
+            if not (np.allclose(scores, want_scores, atol=1e-4) and (ids[:, 0] == want_ids[:, 0]).all()):
+                mismatches.append(i)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return not mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', help='embedding store directory (default: synthetic)')
+    parser.add_argument('--synthetic', type=int, default=69000, help='rows of the synthetic catalog')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--concurrency', default='1,10,100')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--parts', type=int, default=1, help='query rows per search')
+    parser.add_argument('--k', type=int, default=30)
+    parser.add_argument('--window-ms', type=float, default=2.0)
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args(argv)
+
+    matrix = np.ascontiguousarray(load_matrix(args), dtype=np.float32)
+    queries = make_queries(matrix, 512, noise=0.3)
+    exact = retrieval.ExactEngine(matrix)
+    batching = retrieval.BatchingEngine(exact, window_ms=args.window_ms, max_batch=args.max_batch)
+    print(f'catalog {matrix.shape[0]} x {matrix.shape[1]} float32 ({matrix.nbytes / 2**20:.0f} MiB), '
+          f'{args.parts} query row(s) per search, k={args.k}')
+    concurrency = [int(x) for x in args.concurrency.split(',')]
+    checks = {}
+    for c in concurrency:
+        for label, engine in [('per-call', exact), (f'batched {args.window_ms:g} ms', batching)]:
+            batches_before, queries_before = batching.batches, batching.queries
+            qps, p50, p99 = drive(engine, queries, c, args.seconds, args.parts, args.k)
+            extra = ''
+            if engine is batching and batching.batches > batches_before:
+                extra = f'  mean batch={(batching.queries - queries_before) / (batching.batches - batches_before):6.1f}'
+            print(f'sessions={c:4d}  {label:16s} {qps:9.1f} queries/s  p50={p50:8.2f} ms  p99={p99:8.2f} ms{extra}')
+            if engine is batching and c > 1:
+                checks[f'batches of more than one search at {c} sessions'] = \
+                    batching.queries - queries_before > batching.batches - batches_before
+    checks[f'batched rows match per-call at {max(concurrency)} sessions'] = same_results(
+        exact, batching, queries, max(concurrency), args.parts, args.k)
+
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,217 @@
+"""Incremental catalog updates: rows embedded, build time, and a live swap under load.
+
+    python bench_catalog_update.py --added 300 --changed 150 --removed 200
+    python bench_catalog_update.py --store embs_full.store --catalog df_full.csv --skip-live
+
+The script derives a "next day" CSV from ``--catalog``:
+
+- ``--removed`` rows dropped
+- ``--changed`` descriptions edited
+- ``--added`` new SKUs
+- ``--relabeled`` manufacturer names changed (these need no embedding)
+
+Offline: ``catalog_update.build_version`` diffs the new CSV against a
+synthetic (or ``--store``) float32 store using a counting fake embedder.
+It reports rows embedded against a full re-embed and the build time. It
+then checks that unchanged rows kept their exact vectors.
+
+Live: emb_server runs on a small synthetic catalog with fake realtime and
+OpenAI servers. One browser session streams audio and threads call
+``/top`` in a loop. Midway, the new CSV is POSTed to ``/catalog/update``.
+The report shows /top errors and p50/p99 latency before and after the swap,
+whether the session kept receiving transcript deltas across the swap, and
+whether an added SKU resolves afterwards.
+
+Exits 1 in these cases:
+- an unchanged row lost its vector
+- more rows were embedded than were added or changed
+- the update was refused
+- a /top call failed
+- the session stopped receiving deltas
+- the added SKU does not resolve
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import catalog
+import catalog_update
+import emb_store
+from bench_realtime import HERE, browser_session, running_stack
+from bench_workers import synthetic_store
+
+
+def next_day(df: pd.DataFrame, args, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = df.drop(index=rng.choice(len(df), args.removed, replace=False)).reset_index(drop=True)
+    changed = rng.choice(len(df), args.changed + args.relabeled, replace=False)
+    df.loc[changed[:args.changed], 'description'] = df.loc[changed[:args.changed], 'description'].astype(str) + ' REV B'
+    df.loc[changed[args.changed:], 'manufacturer_name'] = 'RELABELED MFG'
+    added = df.iloc[rng.choice(len(df), args.added, replace=False)].copy()
+    added['item_id'] = [f'NEWSKU{i:05d}' for i in range(args.added)]
+    added['description'] = [f'NEW PART {i} ' + d for i, d in enumerate(added['description'].astype(str))]
+    return pd.concat([df, added], ignore_index=True)
+
+
+def offline(args, tmp: str, checks: dict):
+    catalog_csv = os.path.abspath(args.catalog)
+    store_dir = os.path.join(tmp, 'base')
+    if args.store:
+        shutil.copytree(args.store, store_dir, copy_function=lambda src, dst: os.symlink(os.path.abspath(src), dst),
+                        ignore=shutil.ignore_patterns(catalog.CATALOG_DIR))
+    else:
+        os.makedirs(store_dir)
+        synthetic_store(store_dir, catalog_csv, emb_store.count_csv_rows(catalog_csv), args.dim)
+    catalog.build(store_dir, catalog_csv)
+    new_csv = os.path.join(tmp, 'next_day.csv')
+    next_day(pd.read_csv(catalog_csv), args).to_csv(new_csv, index=False)
+
+    embeddings = emb_store.open_store(store_dir, catalog_csv)
+    calls, embedded = [], []
+
+    def fake_embed(texts):
+        calls.append(len(texts))
+        embedded.extend(texts)
+        time.sleep(args.embed_ms_per_row * len(texts) / 1000)
+        v = np.random.default_rng(len(calls)).standard_normal((len(texts), embeddings.shape[1])).astype(np.float32)
+        return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+    rows = catalog.RowStore.open(os.path.join(store_dir, catalog.CATALOG_DIR, 'rows'))
+    versions = os.path.join(tmp, 'versions')
+    os.makedirs(versions)
+    start = time.perf_counter()
+    out, report = catalog_update.build_version(rows, embeddings, catalog_update.row_hashes(rows), new_csv, versions,
+                                               fake_embed, base_store=store_dir, log=lambda *a: None)
+    elapsed = time.perf_counter() - start
+    full_s = report['rows'] * args.embed_ms_per_row / 1000
+    print(f'offline: {report["rows"]} rows; added={report["added"]} changed={report["changed"]} '
+          f'removed={report["removed"]} unchanged={report["unchanged"]}')
+    print(f'    embedded {len(embedded)} rows in {len(calls)} request(s) instead of {report["rows"]} '
+          f'({len(embedded) / report["rows"]:.2%}); build {elapsed:.1f} s '
+          f'(full re-embed at {args.embed_ms_per_row} ms/row would spend {full_s:.0f} s embedding alone)')
+
+    # Unchanged rows must carry their old vectors bit for bit
+    new = emb_store.open_store(out)
+    old_row = {rows.value(i, 'item_id'): i for i in range(len(rows))}
+    new_rows = catalog.RowStore.open(os.path.join(out, catalog.CATALOG_DIR, 'rows'))
+    kept = [(i, old_row[new_rows.value(i, 'item_id')]) for i in range(len(new_rows))
+            if new_rows.value(i, 'item_id') in old_row
+            and new_rows.value(i, 'description') == rows.value(old_row[new_rows.value(i, 'item_id')], 'description')]
+    same = all(np.array_equal(new[i], embeddings[j]) for i, j in kept)
+    print(f'    {len(kept)} unchanged rows {"kept their vectors" if same else "DIFFER"}; '
+          f'indexes rebuilt: {report.get("indexes") or "none"}; new sidecar rows={len(new_rows)}')
+    checks['unchanged rows kept their vectors'] = bool(kept) and same
+    checks['embedded only added or changed rows'] = len(embedded) <= report['added'] + report['changed']
+    checks['sidecar has every row'] = len(new_rows) == report['rows']
+    return new_csv
+
+
+def post(port: int, path: str, data: bytes, content_type: str = 'application/json'):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data, headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def live(args, tmp: str, checks: dict):
+    base = pd.read_csv(os.path.join(HERE, 'df_full.csv')).iloc[:200]  # the running_stack catalog
+    new_csv = os.path.join(tmp, 'live_next_day.csv')
+    small = argparse.Namespace(removed=10, changed=10, added=20, relabeled=5)
+    next_day(base, small, seed=1).to_csv(new_csv, index=False)
+
+    with running_stack(delta_every=5) as (app, port):
+        stop, swapped_at = threading.Event(), []
+        samples = []  # (finished at, latency ms, status)
+
+        def top_loop(i):
+            n = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                status, _ = post(port, '/top', json.dumps([f'bench widget {i} {n}']).encode())
+                samples.append((time.monotonic(), (time.perf_counter() - start) * 1000, status))
+                n += 1
+
+        async def session_and_update():
+            latencies, ready, connected = [], [], asyncio.Event()
+            session = asyncio.create_task(browser_session(port, args.seconds, 20, latencies, connected, ready))
+            while not ready:
+                await asyncio.sleep(0.05)
+            connected.set()
+            await asyncio.sleep(args.seconds / 3)
+            before = len(latencies)
+            with open(new_csv, 'rb') as f:
+                status, report = await asyncio.to_thread(post, port, '/catalog/update', f.read(), 'text/csv')
+            swapped_at.append(time.monotonic())
+            await session
+            return status, report, before, len(latencies) - before
+
+        threads = [threading.Thread(target=top_loop, args=(i,)) for i in range(args.top_threads)]
+        for t in threads:
+            t.start()
+        status, report, deltas_before, deltas_after = asyncio.run(session_and_update())
+        stop.set()
+        for t in threads:
+            t.join()
+        _, added = post(port, '/top', json.dumps(['NEWSKU00003']).encode())
+
+    print(f'live: /catalog/update -> {status}: {report}')
+    for label, part in (('before swap', [s for s in samples if s[0] < swapped_at[0]]),
+                        ('after swap', [s for s in samples if s[0] >= swapped_at[0]])):
+        lat = np.array([s[1] for s in part]) if part else np.zeros(1)
+        errors = sum(1 for s in part if s[2] != 200)
+        print(f'    /top {label:12s} calls={len(part):5d} errors={errors}  '
+              f'p50={np.percentile(lat, 50):6.1f} ms  p99={np.percentile(lat, 99):6.1f} ms')
+    print(f'    browser session: {deltas_before} transcript deltas before the update, {deltas_after} after '
+          f'(same connection)')
+    resolved = added[0]['item_id'] if isinstance(added, list) and added[0] else added
+    print(f'    added SKU NEWSKU00003 after swap: {resolved}')
+    checks['update accepted'] = status == 200
+    checks['no /top errors'] = bool(samples) and all(s[2] == 200 for s in samples)
+    checks['deltas after the swap'] = deltas_after > 0
+    checks['added SKU resolves'] = resolved == 'NEWSKU00003'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', default=os.path.join(HERE, 'df_full.csv'))
+    parser.add_argument('--store', help='existing embedding store for --catalog (default: synthetic)')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--added', type=int, default=300)
+    parser.add_argument('--changed', type=int, default=150)
+    parser.add_argument('--removed', type=int, default=200)
+    parser.add_argument('--relabeled', type=int, default=50)
+    parser.add_argument('--embed-ms-per-row', type=float, default=2.0, help='fake embedding API cost')
+    parser.add_argument('--seconds', type=float, default=9.0, help='live phase duration')
+    parser.add_argument('--top-threads', type=int, default=4)
+    parser.add_argument('--skip-live', action='store_true')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as cleanup:
+        tmp = tempfile.mkdtemp(prefix='bench_catalog_update_')
+        cleanup.callback(shutil.rmtree, tmp, ignore_errors=True)
+        checks = {}
+        offline(args, tmp, checks)
+        if not args.skip_live:
+            live(args, tmp, checks)
+
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
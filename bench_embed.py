@@ -0,0 +1,238 @@
+"""Catalog embedding: serial 1024-row requests vs embed_catalog, against a flaky fake endpoint.
+
+    python bench_embed.py --rows 20000 --dim 256
+    python bench_embed.py --fail-rate 0.1 --drop-rate 0.05 --rate-limit 4
+
+The fake /v1/embeddings returns a deterministic vector per text, so every
+stored row can be checked. Each request takes ``--latency-ms`` plus
+``--ms-per-row``. The endpoint also misbehaves on purpose:
+
+- More than ``--rate-limit`` requests in flight get 429 with Retry-After.
+- ``--fail-rate`` of requests get a 500.
+- ``--drop-rate`` of requests have the connection closed with no response.
+
+Runs, each into a fresh store:
+
+1. serial: one 1024-row request at a time, as the notebook did.
+2. concurrent: ``--concurrency`` requests of ``--batch`` rows.
+3. crash: ``python embed_catalog.py`` is killed with SIGKILL partway, then
+   rerun. Reports how many rows were sent twice.
+4. next day: a CSV with a few hundred edited or new descriptions, embedded
+   with ``--reuse`` of the finished store.
+
+The run fails (exit 1) unless:
+- every store matches the expected vectors row by row
+- the crash run sent at most one checkpoint interval plus the requests in
+  flight twice
+- the next-day run sent exactly the descriptions the finished store lacks
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import emb_store
+import embed_catalog
+from bench_catalog_update import next_day
+from bench_realtime import HERE
+from catalog_update import read_catalog_csv
+
+
+def expected_vector(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def fake_embeddings_server(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        wbufsize = -1
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status: int, out: dict, headers: dict | None = None):
+            payload = json.dumps(out).encode()
+            self.send_response(status)
+            for name, value in {'Content-Type': 'application/json', **(headers or {})}.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            stats = self.server.stats
+            with self.server.lock:
+                stats['requests'] += 1
+                self.server.inflight += 1
+                over = self.server.inflight > args.rate_limit
+            try:
+                if over:
+                    stats['429'] += 1
+                    return self.reply(429, {'error': {'message': 'Rate limit reached'}}, {'Retry-After': '0.5'})
+                texts = body['input']
+                time.sleep((args.latency_ms + args.ms_per_row * len(texts)) / 1000)
+                roll = random.random()
+                if roll < args.drop_rate:
+                    stats['dropped'] += 1
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                if roll < args.drop_rate + args.fail_rate:
+                    stats['500'] += 1
+                    return self.reply(500, {'error': {'message': 'The server had an error'}})
+                encode = ((lambda v: base64.b64encode(v.astype('<f4').tobytes()).decode())
+                          if body.get('encoding_format') == 'base64' else (lambda v: v.tolist()))
+                data = [{'object': 'embedding', 'index': i, 'embedding': encode(expected_vector(t, args.dim))}
+                        for i, t in enumerate(texts)]
+                random.shuffle(data)  # the API does not promise order; index does
+                stats['rows'] += len(texts)
+                self.reply(200, {'object': 'list', 'data': data, 'model': body.get('model')})
+            finally:
+                with self.server.lock:
+                    self.server.inflight -= 1
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            pass  # clients killed mid-request (the crash run)
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.inflight = 0
+    server.stats = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset(server) -> dict:
+    server.stats = {'requests': 0, 'rows': 0, '429': 0, '500': 0, 'dropped': 0}
+    return server.stats
+
+
+def wrong_rows(store_dir: str, catalog_csv: str, dim: int) -> int:
+    matrix = emb_store.open_store(store_dir, catalog_csv)
+    _, _, texts, _ = read_catalog_csv(catalog_csv)
+    return sum(not np.array_equal(matrix[i], expected_vector(t or '', dim)) for i, t in enumerate(texts))
+
+
+def describe(wrong: int) -> str:
+    return 'all rows correct' if not wrong else f'{wrong} WRONG rows'
+
+
+def run_in_process(label: str, args, server, catalog_csv: str, store_dir: str, concurrency: int, batch: int,
+                   checks: dict, reuse: tuple = ()) -> dict:
+    stats = reset(server)
+    embedder = embed_catalog.Embedder(f'http://127.0.0.1:{server.server_port}/v1', 'sk-bench', concurrency=concurrency,
+                                      batch_size=batch, backoff=0.2)
+    try:
+        report = embed_catalog.embed_catalog(catalog_csv, store_dir, embedder, args.dim, reuse, log=lambda *a: None)
+    finally:
+        embedder.close()
+    wrong = wrong_rows(store_dir, catalog_csv, args.dim)
+    checks[f'{label} rows correct'] = not wrong
+    print(f'{label:11s} {report["seconds"]:6.1f} s  {report["embedded"] / report["seconds"]:7.0f} rows/s  '
+          f'sent {stats["rows"]} rows in {stats["requests"]} requests '
+          f'(429={stats["429"]} 500={stats["500"]} dropped={stats["dropped"]}, {report["retries"]} retries, '
+          f'cap ended at {embedder.limiter.limit:.1f}); {describe(wrong)}')
+    return stats
+
+
+def crash_and_resume(args, server, catalog_csv: str, store_dir: str, distinct: int, checks: dict):
+    checkpoint_every = 4
+    cmd = [sys.executable, os.path.join(HERE, 'embed_catalog.py'), catalog_csv, store_dir, '--dim', str(args.dim),
+           '--concurrency', str(args.concurrency), '--batch', str(args.batch),
+           '--checkpoint-every', str(checkpoint_every)]
+    env = dict(os.environ, OPENAI_BASE_URL=f'http://127.0.0.1:{server.server_port}/v1', OPENAI_API_KEY='sk-bench')
+    hashes_file = os.path.join(store_dir, embed_catalog.CHECKPOINT_DIR, 'hashes.u64')
+    stats = reset(server)
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+    while proc.poll() is None:
+        if os.path.exists(hashes_file) and os.path.getsize(hashes_file) // 8 >= distinct * args.kill_at:
+            proc.send_signal(signal.SIGKILL)
+            break
+        time.sleep(0.01)
+    proc.wait()
+    first = stats['rows']
+    kept = embed_catalog.Checkpoint(os.path.dirname(hashes_file), embed_catalog.EMBED_MODEL, args.dim).rows
+    stats = reset(server)
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+    twice = first + stats['rows'] - distinct
+    # Lost on SIGKILL: batches appended since the last fsync, and answers still in flight
+    bound = (checkpoint_every + args.concurrency) * args.batch
+    wrong = wrong_rows(store_dir, catalog_csv, args.dim)
+    checks['crash rows correct'] = not wrong
+    checks[f'crash sent <= {bound} rows twice'] = 0 <= twice <= bound
+    print(f'crash       killed after {first} rows were sent, {kept} were in the checkpoint; rerun sent '
+          f'{stats["rows"]} more in {time.perf_counter() - start:.1f} s. Sent twice: {twice} rows; {describe(wrong)}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', default=os.path.join(HERE, 'df_full.csv'))
+    parser.add_argument('--rows', type=int, default=0, help='use only the first N catalog rows (0: all)')
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=100.0)
+    parser.add_argument('--ms-per-row', type=float, default=0.2)
+    parser.add_argument('--rate-limit', type=int, default=5, help='requests in flight before the endpoint sends 429')
+    parser.add_argument('--fail-rate', type=float, default=0.05)
+    parser.add_argument('--drop-rate', type=float, default=0.02)
+    parser.add_argument('--kill-at', type=float, default=0.4, help='fraction checkpointed before SIGKILL')
+    parser.add_argument('--skip-serial', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = fake_embeddings_server(args)
+    with contextlib.ExitStack() as cleanup:
+        cleanup.callback(server.shutdown)
+        tmp = tempfile.mkdtemp(prefix='bench_embed_')
+        cleanup.callback(shutil.rmtree, tmp, ignore_errors=True)
+        df = pd.read_csv(args.catalog)
+        if args.rows:
+            df = df.iloc[:args.rows]
+        catalog_csv = os.path.join(tmp, 'catalog.csv')
+        df.to_csv(catalog_csv, index=False)
+        distinct = len(set(read_catalog_csv(catalog_csv)[3].tolist()))
+        print(f'{len(df)} rows, {distinct} distinct descriptions, dim {args.dim}')
+
+        checks = {}
+        if not args.skip_serial:
+            run_in_process('serial', args, server, catalog_csv, os.path.join(tmp, 'serial'), 1, 1024, checks)
+        done = os.path.join(tmp, 'concurrent')
+        run_in_process('concurrent', args, server, catalog_csv, done, args.concurrency, args.batch, checks)
+        crash_and_resume(args, server, catalog_csv, os.path.join(tmp, 'crash'), distinct, checks)
+
+        new_csv = os.path.join(tmp, 'next_day.csv')
+        changes = argparse.Namespace(removed=200, changed=150, added=300, relabeled=50)
+        next_day(df, changes).to_csv(new_csv, index=False)
+        stats = run_in_process('next day', args, server, new_csv, os.path.join(tmp, 'next_day'), args.concurrency,
+                               args.batch, checks, reuse=(done,))
+        missing = set(read_catalog_csv(new_csv)[3].tolist()) - set(read_catalog_csv(catalog_csv)[3].tolist())
+        checks[f'next day sent only the {len(missing)} new descriptions'] = stats['rows'] == len(missing)
+
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+"""Replay a long synthetic call through full-transcript and incremental extraction.
+
+    python bench_extraction.py --turns 300 --report-every 50
+
+A local fake LLM stands in for the chat API: its latency is ``--base`` plus
+``--per-1k`` seconds per 1000 input tokens, and it "extracts" items with a
+regex over the text it is sent. The full mode re-sends the whole transcript
+each turn (the old receiver behaviour), so its per-turn input grows with the
+call; the incremental mode should stay flat. Some utterances cancel a part
+the customer asked for earlier.
+
+Exits 1 unless the incremental order ends up as the call's last quantity per
+part (cancelled parts removed), it sends fewer input tokens in total, and its
+per-turn input in the second half of the call stays within 25% of the first
+half.
+"""
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+
+from extraction import INCREMENTAL_PROMPT, IncrementalExtractor
+
+PARTS = ['2 FIRELOCK 90 ELBOW', '2 1/2 FIRELOCK TEE', 'OIL BREATHER', '8 FIRELOCK 45 ELBOW',
+         '2 FLEX GRV COUPLING', 'POP-SAFETY VALVE 1/4 NPT', 'ANGLE WALL POST KIT FIG 551']
+FILLER = ['Yeah, let me check with the warehouse real quick.', 'Okay, hold on one second.',
+          'Sure, that works for us, and the delivery window is fine.', 'Can you hear me okay?',
+          'Right, we had the same problem on the last job site.']
+MENTION = re.compile(r'get (\d+) of the ([A-Z0-9 /-]+[A-Z0-9])')
+CANCEL = re.compile(r'cancel the ([A-Z0-9 /-]+[A-Z0-9])')
+
+
+def synthetic_call(turns: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    utterances = ["Hi, this is Reed from ABC Supply, PO 1920219052190."]
+    for _ in range(turns - 1):
+        roll = rng.random()
+        if roll < 0.3:
+            utterances.append(f'Can I get {rng.integers(1, 9)} of the {PARTS[rng.integers(len(PARTS))]}.')
+        elif roll < 0.35:
+            utterances.append(f'Actually, cancel the {PARTS[rng.integers(len(PARTS))]}.')
+        else:
+            utterances.append(FILLER[rng.integers(len(FILLER))])
+    return utterances
+
+
+def expected_order(utterances) -> list:
+    """The last quantity asked for per part, in order of first mention since it was last cancelled"""
+    order = {}
+    for utterance in utterances:
+        for qty, name in MENTION.findall(utterance):
+            order[name] = int(qty)
+        for name in CANCEL.findall(utterance):
+            order.pop(name, None)
+    return [{'item_name': name, 'quantity': qty} for name, qty in order.items()]
+
+
+class FakeLLM:
+    def __init__(self, base: float, per_1k: float):
+        self.base = base
+        self.per_1k = per_1k
+        self.last_tokens = 0
+
+    def complete(self, messages) -> str:
+        text = '\n'.join(m['content'] for m in messages)
+        self.last_tokens = len(text) // 4
+        time.sleep(self.base + self.per_1k * self.last_tokens / 1000)
+        # Only the newest utterance counts for the incremental prompt
+        source = text.rsplit('New utterance: ', 1)[-1]
+        items = {name: int(qty) for qty, name in MENTION.findall(source)}
+        items.update({name: 0 for name in CANCEL.findall(source)})
+        return json.dumps({'company_name': 'ABC Supply' if 'ABC Supply' in source else None,
+                           'item_names': [{'item_name': n, 'quantity': q} for n, q in items.items()]})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=300)
+    parser.add_argument('--report-every', type=int, default=50)
+    parser.add_argument('--base', type=float, default=0.0, help='fixed fake latency per call (s)')
+    parser.add_argument('--per-1k', type=float, default=0.002, help='fake latency per 1000 input tokens (s)')
+    args = parser.parse_args(argv)
+
+    utterances = synthetic_call(args.turns)
+    full_llm = FakeLLM(args.base, args.per_1k)
+    inc_llm = FakeLLM(args.base, args.per_1k)
+    extractor = IncrementalExtractor(inc_llm.complete)
+    full_tokens = inc_tokens = 0
+    per_turn = []
+
+    print(f'{"turn":>5}  {"full tok":>9}  {"full ms":>8}  {"incr tok":>9}  {"incr ms":>8}')
+    for turn, utterance in enumerate(utterances, 1):
+        transcript = '\n'.join(utterances[:turn])
+        t0 = time.perf_counter()
+        # Same-size system prompt as the incremental mode, so only the transcript differs
+        full_llm.complete([{'role': 'system', 'content': INCREMENTAL_PROMPT}, {'role': 'user', 'content': transcript}])
+        full_ms = (time.perf_counter() - t0) * 1000
+        full_tokens += full_llm.last_tokens
+
+        t0 = time.perf_counter()
+        extractor.update(utterance)
+        inc_ms = (time.perf_counter() - t0) * 1000
+        inc_tokens += inc_llm.last_tokens
+        per_turn.append(inc_llm.last_tokens)
+
+        if turn % args.report_every == 0 or turn == len(utterances):
+            print(f'{turn:5d}  {full_llm.last_tokens:9d}  {full_ms:8.1f}  {inc_llm.last_tokens:9d}  {inc_ms:8.1f}')
+    print(f'total input tokens: full {full_tokens}, incremental {inc_tokens}')
+    print(f'final order: {extractor.summary()}')
+
+    half = len(per_turn) // 2
+    checks = {
+        'final order': extractor.items == expected_order(utterances),
+        'incremental sends fewer tokens': inc_tokens < full_tokens,
+        'incremental input stays flat': max(per_turn[half:], default=0) <= 1.25 * max(per_turn[:half], default=0),
+    }
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,119 @@
+"""Per-request urlopen vs the keep-alive HTTPPool, against a local stand-in server.
+
+    python bench_http.py --requests 50 --handshake-ms 60 --server-ms 20
+
+The stand-in server waits ``--handshake-ms`` on every new TCP connection
+before reading the request, standing in for the TCP+TLS handshake to
+api.openai.com. It then takes ``--server-ms`` per request. With
+``--fail-rate`` it answers that fraction of requests with 503 to exercise
+retries. The old path (one ``urllib.request.urlopen`` per call, as
+realtime.py did) and ``http_pool.HTTPPool`` send the same sequential POSTs.
+Reported: connections opened and p50/p99 request time.
+
+Exits 1 unless the pool answers every request (retrying the 503s), opens a
+single connection when no request fails, and beats urlopen's p50.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from http_pool import HTTPPool
+
+
+def stand_in_server(handshake_ms: float, server_ms: float, fail_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        wbufsize = -1  # one write per response, like real servers (avoids Nagle/delayed-ACK stalls)
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            time.sleep(handshake_ms / 1000)
+            self.server.connections += 1
+            super().setup()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(server_ms / 1000)
+            status = 503 if random.random() < fail_rate else 200
+            payload = json.dumps({'ok': status == 200}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def old_post(url: str, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        return e.read()  # the old client had no retries
+
+
+def run(name: str, post, server, requests: int):
+    """(connections opened, p50 ms, requests answered ok)"""
+    before = server.connections
+    times, answered = [], 0
+    for i in range(requests):
+        start = time.perf_counter()
+        try:
+            answered += json.loads(post({'i': i}))['ok']
+        except Exception:
+            pass
+        times.append((time.perf_counter() - start) * 1000)
+    t = np.array(times)
+    connections = server.connections - before
+    print(f'{name:24s} connections={connections:4d}  p50={np.percentile(t, 50):7.1f} ms  '
+          f'p99={np.percentile(t, 99):7.1f} ms  total={t.sum() / 1000:6.2f} s  ok={answered}/{requests}')
+    return connections, np.percentile(t, 50), answered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--handshake-ms', type=float, default=60)
+    parser.add_argument('--server-ms', type=float, default=20)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--verbose', action='store_true', help='print the pool\'s per-request timing log')
+    args = parser.parse_args(argv)
+
+    server = stand_in_server(args.handshake_ms, args.server_ms, args.fail_rate)
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    _, old_p50, _ = run('urlopen per request', lambda p: old_post(base + '/top', p), server, args.requests)
+    pool = HTTPPool(base, retries=3, backoff=0.05, log=args.verbose)
+    connections, pool_p50, answered = run('HTTPPool keep-alive', lambda p: pool.post_json('/top', p), server,
+                                          args.requests)
+    pool.close()
+    server.shutdown()
+
+    checks = {
+        'pool answered every request': answered == args.requests,
+        'pool p50 below urlopen p50': pool_p50 < old_p50,
+    }
+    if not args.fail_rate:
+        checks['pool opened one connection'] = connections == 1
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+"""Build time, query latency and hit rate of the character n-gram index.
+
+    python bench_lexical.py --catalog df_full.csv --queries 500
+
+Queries are catalog descriptions with spoken-style noise: lower-cased, with
+a few characters dropped and tokens shuffled. A hit means the source row is
+in the top ``k``. Exits 1 if hit@k falls below ``--min-hit-rate``.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from lexical import LexicalIndex
+
+
+def noisy(text: str, rng) -> str:
+    tokens = text.casefold().split()
+    if len(tokens) > 2:
+        i = rng.integers(0, len(tokens) - 1)
+        tokens[i], tokens[i + 1] = tokens[i + 1], tokens[i]
+    text = ' '.join(tokens)
+    drop = set(rng.choice(len(text), size=min(2, len(text)), replace=False).tolist()) if text else set()
+    return ''.join(ch for i, ch in enumerate(text) if i not in drop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', default='df_full.csv')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--ngram', type=int, default=3)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--min-hit-rate', type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    texts = pd.read_csv(args.catalog)['description'].astype(str).tolist()
+    t0 = time.perf_counter()
+    index = LexicalIndex.build(texts, n=args.ngram)
+    print(f'built {args.ngram}-gram index over {len(texts)} rows in {time.perf_counter() - t0:.2f}s '
+          f'({len(index.vocab)} n-grams, {(index.docs.nbytes + index.weights.nbytes) / 2**20:.1f} MiB postings)')
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+    latencies, hits = [], 0
+    for row in rows:
+        query = noisy(texts[row], rng)
+        t0 = time.perf_counter()
+        found, _ = index.search(query, args.k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        # Duplicate descriptions count as a hit
+        hits += any(texts[ix] == texts[row] for ix in found)
+    latencies = np.array(latencies)
+    print(f'{len(rows)} queries  hit@{args.k}={hits / len(rows):.3f}  '
+          f'p50={np.percentile(latencies, 50):.3f} ms  p99={np.percentile(latencies, 99):.3f} ms')
+    if hits / len(rows) < args.min_hit_rate:
+        print(f'FAIL: hit@{args.k} below {args.min_hit_rate:.3f}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
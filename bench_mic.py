@@ -0,0 +1,114 @@
+"""Compare realtime.py's old busy-spin mic sender with the blocking batched one.
+
+    python bench_mic.py --seconds 3 --batch-ms 100
+
+A feeder thread stands in for the PyAudio callback. During the idle phase
+it sends nothing (mic muted / no callbacks); during the active phase it
+sends 1024-sample PCM16 chunks at 24 kHz, real-time paced. The sender
+thread's CPU time (``time.thread_time``) and the number of appends it sends
+are reported per phase.
+
+Exits 1 unless the blocking sender stays under ``--max-idle-cpu`` while
+idle, sends at most one append per ``--batch-ms`` (plus one) while active,
+and delivers every byte fed to it.
+"""
+import argparse
+import queue
+import threading
+import time
+
+from mic import MicBuffer
+
+RATE = 24000
+CHUNK_SIZE = 1024
+
+
+class CountingWS:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def send(self, payload: bytes):
+        self.messages += 1
+        self.bytes += len(payload)
+
+
+def spin_sender(source: queue.Queue, ws: CountingWS, stop: threading.Event, cpu: list):
+    """The old loop: polls ``empty()`` without blocking, one append per chunk."""
+    start = time.thread_time()
+    while not stop.is_set():
+        if not source.empty():
+            ws.send(source.get())
+    cpu.append(time.thread_time() - start)
+
+
+def batched_sender(source: MicBuffer, ws: CountingWS, stop: threading.Event, cpu: list, batch_ms: int):
+    """The new loop from realtime.send_mic_audio."""
+    start = time.thread_time()
+    batch_bytes = RATE * 2 * batch_ms // 1000
+    while not stop.is_set():
+        chunk = source.get_batch(batch_bytes, batch_ms / 1000)
+        if chunk is not None:
+            ws.send(chunk)
+    cpu.append(time.thread_time() - start)
+
+
+def feed(put, seconds: float):
+    chunk = bytes(CHUNK_SIZE * 2)
+    period = CHUNK_SIZE / RATE
+    start = time.monotonic()
+    n = 0
+    while time.monotonic() - start < seconds:
+        put(chunk)
+        n += 1
+        time.sleep(max(0.0, start + n * period - time.monotonic()))
+    return n * len(chunk)
+
+
+def run(kind: str, seconds: float, active: bool, batch_ms: int):
+    ws, stop, cpu = CountingWS(), threading.Event(), []
+    if kind == 'spin':
+        source = queue.Queue()
+        sender = threading.Thread(target=spin_sender, args=(source, ws, stop, cpu))
+    else:
+        source = MicBuffer()
+        sender = threading.Thread(target=batched_sender, args=(source, ws, stop, cpu, batch_ms))
+    sender.start()
+    fed = 0
+    if active:
+        fed = feed(source.put, seconds)
+    else:
+        time.sleep(seconds)
+    stop.set()
+    sender.join()
+    return cpu[0] / seconds, ws.messages / seconds, ws.bytes == fed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--batch-ms', type=int, default=100)
+    parser.add_argument('--max-idle-cpu', type=float, default=0.02, help='fraction of one core')
+    args = parser.parse_args(argv)
+
+    print(f'{"sender":28s} {"phase":7s} {"CPU":>7s} {"appends/s":>10s}')
+    checks = {}
+    for kind, label in [('spin', 'busy-spin (old)'), ('batched', f'blocking, {args.batch_ms} ms batches')]:
+        for active in (False, True):
+            cpu, rate, delivered = run(kind, args.seconds, active, args.batch_ms)
+            print(f'{label:28s} {"active" if active else "idle":7s} {cpu:7.1%} {rate:10.1f}')
+            if kind != 'batched':
+                continue
+            if active:
+                checks[f'at most {1000 / args.batch_ms:g} appends/s'] = rate <= 1000 / args.batch_ms + 1 / args.seconds
+                checks['every byte sent'] = delivered
+            else:
+                checks[f'idle CPU below {args.max_idle_cpu:.0%}'] = cpu < args.max_idle_cpu
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,465 @@
+"""Load tests for the /ws realtime path against a local fake realtime server.
+
+    python bench_realtime.py load --sessions 1,50,200 --seconds 10
+    python bench_realtime.py load --sessions 100 --chunk-ms 20 --binary --coalesce-ms 100
+    python bench_realtime.py slow-top --embed-delay 2 --requests 8
+    python bench_realtime.py ttft --connect-delay 0.3 --pool-size 2
+    python bench_realtime.py slow-llm --chat-delay 2
+
+``load`` starts a fake OpenAI realtime server and emb_server (uvicorn) on a
+tiny synthetic catalog. It then opens N browser sessions that stream base64
+PCM16 at real-time rate. The fake server emits a transcription delta
+stamped with its wall-clock send time every ``--delta-every`` appends. The
+report shows the server's OS thread count with all sessions connected, the
+server CPU time per second of streamed audio, and the delta latency (fake
+server send -> browser receive) percentiles. ``--binary`` sends raw PCM16
+frames instead of base64 text. ``--coalesce-ms`` sets the server's
+AUDIO_COALESCE_MS.
+
+``slow-top`` streams one session while other clients call ``/top``, whose
+embedding requests go to a fake OpenAI HTTP API that takes
+``--embed-delay`` seconds. It prints the session's delta latency with and
+without the ``/top`` load. If blocking work ran on the event loop, every
+delta would wait behind the embedding call. The run fails (exit 1) unless:
+- deltas kept arriving
+- every ``/top`` answered 200 and took at least the embedding delay, so
+  they overlapped the session
+- the session's p99 delta latency under that load stayed within
+  ``--max-p99-ms``
+
+``ttft`` opens sessions one after another against a fake upstream that takes
+``--connect-delay`` seconds to set up a session. It prints the time from
+opening /ws to the first transcript delta, with the upstream session pool
+disabled (UPSTREAM_POOL_SIZE=0) and enabled.
+
+``slow-llm`` streams one session whose fake upstream also closes an
+utterance (``conversation.item.input_audio_transcription.completed``) every
+``--complete-every`` deltas. Each utterance names a part, so it runs
+extraction, search and resolution on the session's CoalescingWorker. The run
+is done twice: with an instant fake LLM, then with every chat call taking
+``--chat-delay`` seconds. The run fails (exit 1) unless both runs received
+deltas and matched parts, and the slow run's p99 delta latency stayed within
+``--max-extra-ms`` of the fast run's.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RATE = 24000
+
+
+# ============== FAKE REALTIME SERVER ==============
+
+UTTERANCE = 'Can I get two of the bench widget.'
+
+
+async def fake_realtime_handler(ws, delta_every: int, connect_delay: float = 0.0, complete_every: int = 0):
+    from websockets.exceptions import ConnectionClosed
+    with contextlib.suppress(ConnectionClosed):
+        await fake_realtime_session(ws, delta_every, connect_delay, complete_every)
+
+
+async def fake_realtime_session(ws, delta_every: int, connect_delay: float, complete_every: int = 0):
+    """Deltas stamped with their send time; with ``complete_every``, a completed utterance after that many."""
+    await asyncio.sleep(connect_delay)  # stands in for TLS + session setup
+    await ws.send(json.dumps({'type': 'session.created', 'session': {}}))
+    appends = deltas = 0
+    async for message in ws:
+        data = json.loads(message)
+        if data.get('type') == 'session.update':
+            await ws.send(json.dumps({'type': 'session.updated', 'session': data.get('session', {})}))
+        elif data.get('type') == 'input_audio_buffer.append':
+            appends += 1
+            if appends % delta_every == 0:
+                await ws.send(json.dumps({'type': 'conversation.item.input_audio_transcription.delta',
+                                          'delta': f'{time.time():.6f} '}))
+                deltas += 1
+                if complete_every and deltas % complete_every == 0:
+                    await ws.send(json.dumps({'type': 'conversation.item.input_audio_transcription.completed',
+                                              'transcript': UTTERANCE}))
+
+
+async def serve_fake_realtime(port: int, delta_every: int, connect_delay: float = 0.0, complete_every: int = 0):
+    from websockets.asyncio.server import serve
+    async with serve(lambda ws: fake_realtime_handler(ws, delta_every, connect_delay, complete_every), '127.0.0.1',
+                     port, max_size=None):
+        await asyncio.Future()
+
+
+def fake_openai_http(port: int, embed_delay: float, chat_delay: float, dim: int) -> ThreadingHTTPServer:
+    """Minimal /v1/embeddings and /v1/chat/completions with fixed delays.
+
+    Extraction of ``UTTERANCE`` finds its part; every other extraction finds none.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path.endswith('/embeddings'):
+                time.sleep(embed_delay)
+                texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+                rng = np.random.default_rng(len(texts))
+                data = [{'object': 'embedding', 'index': i, 'embedding': rng.standard_normal(dim).tolist()}
+                        for i in range(len(texts))]
+                out = {'object': 'list', 'data': data, 'model': body.get('model'),
+                       'usage': {'prompt_tokens': 0, 'total_tokens': 0}}
+            else:
+                time.sleep(chat_delay)
+                prompt = json.dumps(body.get('messages'))
+                item_names = ([{'item_name': 'bench widget', 'quantity': 2}]
+                              if UTTERANCE in prompt and 'item_names' in prompt else [])
+                content = (json.dumps({'item_names': item_names}) if 'item_names' in prompt
+                           else '{"answers": []}' if body.get('response_format') else '0')
+                out = {'id': 'fake', 'object': 'chat.completion', 'created': 0, 'model': body.get('model'),
+                       'choices': [{'index': 0, 'finish_reason': 'stop',
+                                    'message': {'role': 'assistant', 'content': content}}],
+                       'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}}
+            payload = json.dumps(out).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ============== HARNESS ==============
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', port), timeout=0.5):
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f'nothing listening on port {port}')
+
+
+def wait_for_ready(port: int, timeout: float = 600.0, workers: int = 1):
+    """Block until emb_server's /readyz answers 200 (catalog loaded) from ``workers`` distinct processes.
+
+    Each request reaches whichever worker accepts it, so one 200 only says
+    that worker is ready; the pid in the body tells them apart.
+    """
+    deadline = time.monotonic() + timeout
+    ready = set()
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/readyz', timeout=5) as response:
+                if response.status == 200:
+                    ready.add(json.loads(response.read()).get('pid'))
+                    if len(ready) >= workers:
+                        return
+        time.sleep(0.05)
+    raise TimeoutError(f'emb_server on port {port}: {len(ready)} of {workers} worker(s) ready')
+
+
+def synthetic_catalog_dir(rows: int = 200, dim: int = 64) -> str:
+    """Temp dir with df_subset.csv + embs_subset.json, enough for emb_server to import."""
+    import pandas as pd
+    out = tempfile.mkdtemp(prefix='bench_realtime_')
+    pd.read_csv(os.path.join(HERE, 'df_full.csv')).iloc[:rows].to_csv(os.path.join(out, 'df_subset.csv'), index=False)
+    embs = np.random.default_rng(0).standard_normal((rows, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    with open(os.path.join(out, 'embs_subset.json'), 'w') as f:
+        json.dump(embs.tolist(), f)
+    return out
+
+
+@contextlib.contextmanager
+def running_stack(delta_every: int = 5, embed_delay: float = 0.0, chat_delay: float = 0.0,
+                  connect_delay: float = 0.0, extra_env: dict | None = None, complete_every: int = 0):
+    """Fake realtime/OpenAI servers + emb_server subprocesses; yields (server process, server port)."""
+    fake_port, http_port, app_port = free_port(), free_port(), free_port()
+    workdir = synthetic_catalog_dir()
+    fake = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'fake-server',
+                             '--port', str(fake_port), '--delta-every', str(delta_every),
+                             '--http-port', str(http_port), '--embed-delay', str(embed_delay),
+                             '--chat-delay', str(chat_delay), '--connect-delay', str(connect_delay),
+                             '--complete-every', str(complete_every)])
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'sk-bench'),
+               REALTIME_WS_URL=f'ws://127.0.0.1:{fake_port}', OPENAI_BASE_URL=f'http://127.0.0.1:{http_port}/v1',
+               EMBED_CACHE_PATH='', PYTHONPATH=HERE + os.pathsep + os.getenv('PYTHONPATH', ''),
+               **(extra_env or {}))
+    app = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'emb_server:app', '--port', str(app_port),
+                            '--log-level', 'warning', '--ws-max-size', str(1 << 24)], cwd=workdir, env=env)
+    try:
+        wait_for_port(fake_port)
+        wait_for_port(http_port)
+        wait_for_ready(app_port)
+        yield app, app_port
+    finally:
+        for proc in (app, fake):
+            proc.terminate()
+            proc.wait()
+
+
+def thread_count(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                return int(line.split()[1])
+    return -1
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def audio_chunk(ms: int, binary: bool = False) -> str | bytes:
+    """PCM16 of ``ms`` milliseconds of low-level noise: raw bytes, or base64 like older browsers sent."""
+    pcm = (np.random.default_rng(0).standard_normal(RATE * ms // 1000) * 300).astype('<i2').tobytes()
+    return pcm if binary else base64.b64encode(pcm).decode()
+
+
+async def browser_session(port: int, seconds: float, chunk_ms: int, latencies: list, connected: asyncio.Event,
+                          ready: list, binary: bool = False, parts: list | None = None):
+    from websockets.asyncio.client import connect
+    chunk = audio_chunk(chunk_ms, binary)
+    async with connect(f'ws://127.0.0.1:{port}/ws', max_size=None) as ws:
+        ready.append(1)
+
+        async def reader():
+            async for message in ws:
+                data = json.loads(message)
+                if data.get('type') == 'transcript':
+                    latencies.append((time.time() - float(data['text'])) * 1000)
+                elif data.get('type') == 'parts' and parts is not None:
+                    parts.extend(data['items'])
+
+        read_task = asyncio.create_task(reader())
+        await connected.wait()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            await ws.send(chunk)
+            await asyncio.sleep(chunk_ms / 1000)
+        read_task.cancel()
+
+
+async def load_once(app, port: int, sessions: int, seconds: float, chunk_ms: int, binary: bool):
+    latencies, ready, connected = [], [], asyncio.Event()
+    tasks = [asyncio.create_task(browser_session(port, seconds, chunk_ms, latencies, connected, ready, binary))
+             for _ in range(sessions)]
+    while len(ready) < sessions:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)  # let every upstream session connect
+    threads = thread_count(app.pid)
+    cpu = cpu_seconds(app.pid)
+    connected.set()
+    await asyncio.gather(*tasks)
+    cpu = cpu_seconds(app.pid) - cpu
+    print(f'sessions={sessions:4d}  server threads={threads:4d}  '
+          f'server CPU={cpu / (sessions * seconds) * 1000:6.2f} ms per session-second  {percentiles(latencies)}')
+
+
+def load(args):
+    env = {'AUDIO_COALESCE_MS': str(args.coalesce_ms)} if args.coalesce_ms is not None else None
+    with running_stack(args.delta_every, extra_env=env) as (app, port):
+        print(f'idle server threads={thread_count(app.pid)}  frames={"binary" if args.binary else "base64 text"} '
+              f'of {args.chunk_ms} ms')
+        for n in [int(x) for x in args.sessions.split(',')]:
+            asyncio.run(load_once(app, port, n, args.seconds, args.chunk_ms, args.binary))
+
+
+def percentiles(latencies: list) -> str:
+    lat = np.array(latencies) if latencies else np.array([np.nan])
+    return (f'deltas={len(latencies):5d}  p50={np.nanpercentile(lat, 50):8.2f} ms  '
+            f'p99={np.nanpercentile(lat, 99):8.2f} ms  max={np.nanmax(lat):8.2f} ms')
+
+
+def post_top(port: int, names: list) -> tuple:
+    """(seconds, HTTP status) of one /top call."""
+    start = time.perf_counter()
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/top', data=json.dumps(names).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        print(f'/top returned {e.code}')
+        status = e.code
+    return time.perf_counter() - start, status
+
+
+async def slow_top_once(port: int, seconds: float, chunk_ms: int, requests: int):
+    latencies, ready, connected = [], [], asyncio.Event()
+    session = asyncio.create_task(browser_session(port, seconds, chunk_ms, latencies, connected, ready))
+    while not ready:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    connected.set()
+    calls = []
+    if requests:
+        await asyncio.sleep(0.5)
+        # distinct nonsense names so neither the exact index nor the embedding cache answers
+        calls = await asyncio.gather(*(asyncio.to_thread(post_top, port, [f'bench widget {i} {time.time()}'])
+                                           for i in range(requests)))
+    await session
+    return latencies, calls
+
+
+def slow_top(args):
+    with running_stack(args.delta_every, embed_delay=args.embed_delay) as (app, port):
+        latencies, _ = asyncio.run(slow_top_once(port, args.seconds, args.chunk_ms, 0))
+        print(f'audio only              {percentiles(latencies)}')
+        latencies, calls = asyncio.run(slow_top_once(port, args.seconds, args.chunk_ms, args.requests))
+        print(f'audio + {args.requests:2d} slow /top    {percentiles(latencies)}')
+        durations = [seconds for seconds, _ in calls]
+        print(f'/top durations: min={min(durations):.2f} s  max={max(durations):.2f} s '
+              f'(embedding delay {args.embed_delay:.2f} s)')
+    checks = {
+        'deltas received': len(latencies) > 0,
+        '/top all 200': all(status == 200 for _, status in calls),
+        '/top overlapped the session': min(durations) >= args.embed_delay,
+        f'p99 <= {args.max_p99_ms:.0f} ms': bool(latencies) and np.percentile(latencies, 99) <= args.max_p99_ms,
+    }
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+async def slow_llm_once(port: int, seconds: float, chunk_ms: int):
+    latencies, ready, connected, parts = [], [], asyncio.Event(), []
+    session = asyncio.create_task(browser_session(port, seconds, chunk_ms, latencies, connected, ready, parts=parts))
+    while not ready:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    connected.set()
+    await session
+    return latencies, parts
+
+
+def slow_llm(args):
+    checks, p99 = {}, {}
+    for label, delay in (('fast', 0.0), ('slow', args.chat_delay)):
+        with running_stack(args.delta_every, chat_delay=delay, complete_every=args.complete_every) as (app, port):
+            latencies, parts = asyncio.run(slow_llm_once(port, args.seconds, args.chunk_ms))
+        print(f'LLM {label} ({delay:.1f} s per chat call)  {percentiles(latencies)}  parts matched={len(parts)}')
+        checks[f'{label}: deltas received'] = len(latencies) > 0
+        checks[f'{label}: parts matched'] = len(parts) > 0
+        p99[label] = np.percentile(latencies, 99) if latencies else np.inf
+    checks[f'slow p99 within {args.max_extra_ms:.0f} ms of fast'] = p99['slow'] <= p99['fast'] + args.max_extra_ms
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+async def first_transcript(port: int, chunk_ms: int) -> float:
+    """Seconds from opening /ws to the first transcript delta, streaming audio from the start."""
+    from websockets.asyncio.client import connect
+    chunk = audio_chunk(chunk_ms, binary=True)
+    start = time.perf_counter()
+    async with connect(f'ws://127.0.0.1:{port}/ws', max_size=None) as ws:
+        async def stream():
+            while True:
+                await ws.send(chunk)
+                await asyncio.sleep(chunk_ms / 1000)
+
+        sender = asyncio.create_task(stream())
+        try:
+            async for message in ws:
+                if json.loads(message).get('type') == 'transcript':
+                    return time.perf_counter() - start
+        finally:
+            sender.cancel()
+
+
+def ttft(args):
+    for size in (0, args.pool_size):
+        env = {'UPSTREAM_POOL_SIZE': str(size), 'AUDIO_COALESCE_MS': '0'}
+        with running_stack(delta_every=1, connect_delay=args.connect_delay, extra_env=env) as (app, port):
+            time.sleep(args.connect_delay + 0.5)  # let the pool fill
+            times = []
+            for _ in range(args.calls):
+                times.append(asyncio.run(first_transcript(port, args.chunk_ms)) * 1000)
+                time.sleep(args.gap)
+            t = np.array(times)
+            label = f'pool of {size}' if size else 'connect on demand'
+            print(f'{label:18s} time to first transcript p50={np.percentile(t, 50):7.1f} ms  '
+                  f'max={t.max():7.1f} ms  (upstream setup {args.connect_delay * 1000:.0f} ms)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('load', help='many concurrent sessions: thread count and delta latency')
+    p.add_argument('--sessions', default='1,50,200')
+    p.add_argument('--seconds', type=float, default=10)
+    p.add_argument('--chunk-ms', type=int, default=170, help='audio per browser frame (4096 samples at 24 kHz)')
+    p.add_argument('--delta-every', type=int, default=5)
+    p.add_argument('--binary', action='store_true', help='send raw PCM16 binary frames instead of base64 text')
+    p.add_argument('--coalesce-ms', type=int, help='server AUDIO_COALESCE_MS (default: server default)')
+    p = sub.add_parser('slow-top', help='one session\'s delta latency while /top calls are slow')
+    p.add_argument('--seconds', type=float, default=6)
+    p.add_argument('--chunk-ms', type=int, default=170)
+    p.add_argument('--delta-every', type=int, default=2)
+    p.add_argument('--embed-delay', type=float, default=2.0)
+    p.add_argument('--requests', type=int, default=8)
+    p.add_argument('--max-p99-ms', type=float, default=100.0,
+                   help='fail if the session p99 delta latency under /top load is above this')
+    p = sub.add_parser('ttft', help='time to first transcript with and without the upstream session pool')
+    p.add_argument('--calls', type=int, default=10)
+    p.add_argument('--pool-size', type=int, default=2)
+    p.add_argument('--connect-delay', type=float, default=0.3, help='fake upstream handshake + setup seconds')
+    p.add_argument('--gap', type=float, default=0.5, help='seconds between calls')
+    p.add_argument('--chunk-ms', type=int, default=20)
+    p = sub.add_parser('slow-llm', help='one session\'s delta latency while its own extraction is slow')
+    p.add_argument('--seconds', type=float, default=10)
+    p.add_argument('--chunk-ms', type=int, default=170)
+    p.add_argument('--delta-every', type=int, default=2)
+    p.add_argument('--complete-every', type=int, default=5, help='deltas per completed utterance')
+    p.add_argument('--chat-delay', type=float, default=2.0, help='seconds per fake chat call in the slow run')
+    p.add_argument('--max-extra-ms', type=float, default=50.0,
+                   help='fail if the slow run\'s p99 delta latency exceeds the fast run\'s by more than this')
+    p = sub.add_parser('fake-server', help='run only the fake realtime and OpenAI HTTP servers')
+    p.add_argument('--port', type=int, required=True)
+    p.add_argument('--delta-every', type=int, default=5)
+    p.add_argument('--http-port', type=int)
+    p.add_argument('--embed-delay', type=float, default=0.0)
+    p.add_argument('--chat-delay', type=float, default=0.0)
+    p.add_argument('--dim', type=int, default=64)
+    p.add_argument('--connect-delay', type=float, default=0.0)
+    p.add_argument('--complete-every', type=int, default=0, help='deltas per completed utterance (0: never)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'fake-server':
+        if args.http_port:
+            fake_openai_http(args.http_port, args.embed_delay, args.chat_delay, args.dim)
+        asyncio.run(serve_fake_realtime(args.port, args.delta_every, args.connect_delay, args.complete_every))
+    else:
+        return {'load': load, 'slow-top': slow_top, 'ttft': ttft, 'slow-llm': slow_llm}[args.command](args) or 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,179 @@
+"""Resolution benchmarks against a local fake chat-completions stand-in.
+
+    python bench_resolver.py fanout --latencies 0.2,0.5,1.0,0.3 --fail 1 --timeout 0.8
+    python bench_resolver.py modes --parts 10
+
+``fanout``: each fake call sleeps for its injected latency and answers with
+its part index. Compares sequential calls (the old list comprehension) with
+``resolver.resolve_all``. Checks that every part gets its own answer, or
+None when it failed or timed out. Also checks that the concurrent wall-clock
+time stays within 10% + 100 ms of the expected schedule, rather than
+tracking the sum. With a worker per part, that is the slowest call capped at
+the timeout.
+
+``modes``: builds real per-part and batched prompts from catalog rows and
+sends them to a fake whose latency grows with prompt size
+(``--base`` + ``--per-1k`` per 1000 input tokens). Reports input tokens and
+wall-clock time for per-part (concurrent and sequential) and batched mode.
+Checks that batched mode makes one call with fewer input tokens and returns
+one answer per part, and that concurrent per-part beats sequential.
+
+Exits 1 if a check fails.
+"""
+import argparse
+import heapq
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import resolver
+
+
+def count_tokens(text: str) -> int:
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4  # rough average for English/JSON
+    return len(tiktoken.get_encoding('o200k_base').encode(text))
+
+
+class FakeChat:
+    """Stand-in for ``client.chat.completions.create(...).choices[0].message.content``."""
+
+    def __init__(self, latencies=(), fail=(), base: float = 0.0, per_1k: float = 0.0):
+        self.latencies = latencies
+        self.fail = set(fail)
+        self.base = base
+        self.per_1k = per_1k
+        self.input_tokens = 0
+        self.calls = 0
+
+    def complete(self, prompt: str) -> str:
+        i = int(prompt.split(':', 1)[0])
+        time.sleep(self.latencies[i])
+        if i in self.fail:
+            raise RuntimeError('injected upstream error')
+        return str(i)
+
+    def complete_sized(self, prompt: str, json_object: bool = False) -> str:
+        tokens = count_tokens(prompt)
+        self.input_tokens += tokens
+        self.calls += 1
+        time.sleep(self.base + self.per_1k * tokens / 1000)
+        if prompt.count('Part ') > 1 and '"answers"' in prompt:
+            n = prompt.count('Candidates:')
+            return json.dumps({'answers': [0] * n})
+        return '0'
+
+
+def fanout(args):
+    latencies = [float(x) for x in args.latencies.split(',')]
+    fake = FakeChat(latencies, [int(x) for x in args.fail.split(',') if x])
+    prompts = [f'{i}: resolve part {i}' for i in range(len(latencies))]
+
+    t0 = time.perf_counter()
+    sequential = []
+    for prompt in prompts:
+        try:
+            sequential.append(fake.complete(prompt))
+        except Exception:
+            sequential.append(None)
+    t_seq = time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        t0 = time.perf_counter()
+        concurrent = resolver.resolve_all(prompts, fake.complete, executor, args.timeout)
+        t_conc = time.perf_counter() - t0
+
+    print(f'{len(prompts)} parts, sum of latencies {sum(latencies):.2f}s, slowest {max(latencies):.2f}s, '
+          f'concurrency {args.concurrency}, timeout {args.timeout:.2f}s')
+    print(f'sequential  {t_seq:6.2f}s  {sequential}')
+    print(f'concurrent  {t_conc:6.2f}s  {concurrent}')
+
+    # Expected wall time: calls start in order on the first free worker and
+    # count until they answer or time out (a timed-out call still holds its worker)
+    free, expected_wall = [0.0] * args.concurrency, 0.0
+    for latency in latencies:
+        start = heapq.heappop(free)
+        heapq.heappush(free, start + latency)
+        expected_wall = max(expected_wall, start + min(latency, args.timeout))
+    answers = [None if i in fake.fail else str(i) for i in range(len(latencies))]
+    checks = {
+        'sequential answers': sequential == answers,
+        'concurrent answers': concurrent == [None if latency >= args.timeout else a
+                                             for a, latency in zip(answers, latencies)],
+        f'concurrent wall <= {expected_wall:.2f}s + 10% + 0.1s': t_conc <= expected_wall * 1.1 + 0.1,
+    }
+    return report(checks)
+
+
+def modes(args):
+    df = pd.read_csv(args.catalog)
+    names = df['description'].sample(args.parts, random_state=0).tolist()
+    candidates = [df.sample(10, random_state=i).reset_index(drop=True).reset_index().to_json(orient='records', indent=4)
+                  for i in range(args.parts)]
+    per_part = [resolver.resolution_prompt(c, name) for c, name in zip(candidates, names)]
+    batched = resolver.batched_resolution_prompt(candidates, names)
+
+    print(f'{args.parts} parts, fake latency {args.base:.2f}s + {args.per_1k:.2f}s per 1k input tokens')
+    fake = FakeChat(base=args.base, per_1k=args.per_1k)
+    t0 = time.perf_counter()
+    for prompt in per_part:
+        fake.complete_sized(prompt)
+    t_seq = time.perf_counter() - t0
+    per_part_tokens = fake.input_tokens
+    print(f'per_part sequential  calls={fake.calls:3d}  input_tokens={fake.input_tokens:7d}  '
+          f'wall={t_seq:6.2f}s')
+
+    fake = FakeChat(base=args.base, per_1k=args.per_1k)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        t0 = time.perf_counter()
+        resolver.resolve_all(per_part, fake.complete_sized, executor, timeout=60)
+        t_conc = time.perf_counter() - t0
+        print(f'per_part concurrent  calls={fake.calls:3d}  input_tokens={fake.input_tokens:7d}  '
+              f'wall={t_conc:6.2f}s')
+
+    fake = FakeChat(base=args.base, per_1k=args.per_1k)
+    t0 = time.perf_counter()
+    answers = resolver.parse_batched(fake.complete_sized(batched, json_object=True), args.parts)
+    print(f'batched              calls={fake.calls:3d}  input_tokens={fake.input_tokens:7d}  '
+          f'wall={time.perf_counter() - t0:6.2f}s  answers={len(answers)}')
+    checks = {
+        'batched is one call': fake.calls == 1,
+        'batched answers every part': len(answers) == args.parts,
+        'batched sends fewer input tokens': fake.input_tokens < per_part_tokens,
+    }
+    if args.concurrency > 1 and args.parts > 1:
+        checks['concurrent per_part beats sequential'] = t_conc < t_seq
+    return report(checks)
+
+
+def report(checks: dict) -> int:
+    failures = [name for name, ok in checks.items() if not ok]
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    print('all checks passed' if not failures else f'{len(failures)} check(s) failed')
+    return len(failures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('fanout')
+    p.add_argument('--latencies', default='0.2,0.5,1.0,0.3,0.4,0.6,0.2,0.8', help='seconds per fake call')
+    p.add_argument('--fail', default='', help='comma-separated part indices that raise')
+    p.add_argument('--timeout', type=float, default=5.0)
+    p.add_argument('--concurrency', type=int, default=8)
+    p = sub.add_parser('modes')
+    p.add_argument('--catalog', default='df_full.csv')
+    p.add_argument('--parts', type=int, default=10)
+    p.add_argument('--base', type=float, default=0.3, help='fixed seconds per fake call')
+    p.add_argument('--per-1k', type=float, default=0.05, help='extra seconds per 1000 input tokens')
+    p.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+    return 1 if {'fanout': fanout, 'modes': modes}[args.command](args) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
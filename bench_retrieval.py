@@ -0,0 +1,178 @@
+"""Recall@k, latency and memory report for the retrieval engines.
+
+    python bench_retrieval.py --store embs_full.store --nprobe 1,4,8,16,32
+    python bench_retrieval.py --synthetic 69000 --dim 1536 --engines exact,int8
+    python bench_retrieval.py --store embs_full.store --engines matryoshka --dims 256,512
+
+Ground truth is the original float64 brute-force path; every engine reports
+its top-k overlap with it (recall@k), search latency per call, and the bytes
+it keeps resident for the first-pass scan. Synthetic catalogs have no
+Matryoshka structure, so only real embeddings say how well truncation works.
+
+Queries are perturbed catalog rows (``--noise``), or real query embeddings
+saved as a (q, dim) .npy file with ``--queries``.
+
+Exits 1 if exact float32 or a rescored int8 pass falls below
+``--min-recall``, if IVF recall drops as ``nprobe`` grows, or if rescoring
+a Matryoshka shortlist loses recall.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import emb_store
+import retrieval
+
+
+def synthetic_catalog(n: int, dim: int, clusters: int = 512, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    matrix = centers[rng.integers(0, clusters, n)] + 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return retrieval.normalize(matrix)
+
+
+def make_queries(matrix: np.ndarray, n: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(matrix[rng.choice(len(matrix), n, replace=False)], dtype=np.float32)
+    return retrieval.normalize(rows + noise * rng.standard_normal(rows.shape).astype(np.float32) / np.sqrt(rows.shape[1]))
+
+
+def run(engine, queries: np.ndarray, k: int, batch: int):
+    """Search ``queries`` in batches of ``batch`` (call_top sends one batch per utterance)."""
+    results, latencies = [], []
+    for start in range(0, len(queries), batch):
+        t0 = time.perf_counter()
+        ix, _ = engine.search(queries[start:start + batch], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(ix)
+    return np.concatenate(results), np.array(latencies)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f.tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def report_row(label: str, rec: float, lat: np.ndarray, nbytes: int):
+    print(f'{label:<28} recall={rec:6.3f}  p50={np.percentile(lat, 50):8.3f} ms  '
+          f'p99={np.percentile(lat, 99):8.3f} ms  scan={nbytes / 2**20:8.1f} MiB')
+
+
+def load_matrix(args) -> np.ndarray:
+    if args.store:
+        return emb_store.open_store(args.store)
+    return synthetic_catalog(args.synthetic, args.dim)
+
+
+def ivf_engine(args, matrix: np.ndarray):
+    if args.store and args.nlist is None:
+        try:
+            return retrieval.load_ivf(args.store)
+        except FileNotFoundError:
+            pass
+    nlist = args.nlist or max(1, int(4 * np.sqrt(len(matrix))))
+    t0 = time.perf_counter()
+    ivf = retrieval.build_ivf(matrix, nlist)
+    print(f'built ivf nlist={nlist} in {time.perf_counter() - t0:.1f} s')
+    return ivf
+
+
+def quantized_engine(args, matrix: np.ndarray, dtype: str, scales: str):
+    if args.store:
+        try:
+            return retrieval.load_quantized(args.store, matrix, dtype, scales, rescore=args.rescore)
+        except FileNotFoundError:
+            pass
+    codes, factors = retrieval.quantize(matrix, dtype, scales)
+    return retrieval.QuantizedEngine(codes, factors, scales if factors is not None else None, matrix,
+                                     rescore=args.rescore)
+
+
+def truncated_engine(args, matrix: np.ndarray, dim: int, rescore: int):
+    if args.store:
+        try:
+            return retrieval.load_truncated(args.store, matrix, dim, rescore=rescore)
+        except FileNotFoundError:
+            pass
+    return retrieval.TruncatedEngine(retrieval.truncate(matrix, dim), matrix, rescore=rescore)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--store', help='embedding store directory')
+    source.add_argument('--synthetic', type=int, help='number of synthetic catalog rows')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', help='.npy file of real query embeddings')
+    parser.add_argument('--n-queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.8)
+    parser.add_argument('--batch', type=int, default=4, help='queries per search call')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--engines', default='exact,ivf,int8,matryoshka')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', default='1,4,8,16,32')
+    parser.add_argument('--rescore', type=int, default=200, help='shortlist size for quantized/matryoshka engines')
+    parser.add_argument('--dims', default='256,512', help='prefix dimensions for the matryoshka engine')
+    parser.add_argument('--min-recall', type=float, default=0.95, help='for exact float32 and rescored quantized engines')
+    args = parser.parse_args(argv)
+
+    matrix = load_matrix(args)
+    queries = np.load(args.queries).astype(np.float32) if args.queries else make_queries(matrix, args.n_queries, args.noise)
+    print(f'catalog {matrix.shape[0]} x {matrix.shape[1]}, {len(queries)} queries, batch {args.batch}, k={args.k}')
+
+    reference = retrieval.ExactEngine(np.asarray(matrix, dtype=np.float64))
+    truth, lat = run(reference, queries.astype(np.float64), args.k, args.batch)
+    report_row('exact float64 (reference)', 1.0, lat, reference.matrix.nbytes)
+
+    checks = {}
+    for name in args.engines.split(','):
+        if name == 'exact':
+            engine = retrieval.ExactEngine(np.asarray(matrix, dtype=np.float32))
+            found, lat = run(engine, queries, args.k, args.batch)
+            rec = recall(found, truth)
+            report_row('exact float32', rec, lat, engine.matrix.nbytes)
+            checks[f'exact float32 recall >= {args.min_recall}'] = rec >= args.min_recall
+        elif name == 'ivf':
+            ivf = ivf_engine(args, matrix)
+            recalls = []
+            for nprobe in sorted(int(p) for p in args.nprobe.split(',')):
+                ivf.nprobe = nprobe
+                found, lat = run(ivf, queries, args.k, args.batch)
+                recalls.append(recall(found, truth))
+                report_row(f'ivf nprobe={nprobe}', recalls[-1], lat, ivf.centroids.nbytes + ivf.vectors.nbytes)
+            # More lists probed scan a superset of rows; allow for float32 ties
+            checks['ivf recall grows with nprobe'] = all(b >= a - 0.005 for a, b in zip(recalls, recalls[1:]))
+        elif name == 'int8':
+            for scales in ('row', 'dim'):
+                engine = quantized_engine(args, matrix, 'int8', scales)
+                found, lat = run(engine, queries, args.k, args.batch)
+                rec = recall(found, truth)
+                report_row(f'int8-{scales} rescore={args.rescore}', rec, lat, engine.nbytes)
+                if args.rescore:
+                    checks[f'int8-{scales} recall >= {args.min_recall}'] = rec >= args.min_recall
+        elif name == 'matryoshka':
+            for dim in [int(d) for d in args.dims.split(',')]:
+                if dim > matrix.shape[1]:
+                    print(f'matryoshka {dim}: skipped, wider than the {matrix.shape[1]}-dim catalog')
+                    continue
+                recalls = []
+                for rescore in (0, args.rescore):
+                    engine = truncated_engine(args, matrix, dim, rescore)
+                    found, lat = run(engine, queries, args.k, args.batch)
+                    recalls.append(recall(found, truth))
+                    label = f'matryoshka {dim}' + (f' rescore={rescore}' if rescore else '')
+                    report_row(label, recalls[-1], lat, engine.prefix.nbytes)
+                if args.rescore:
+                    checks[f'matryoshka {dim} rescoring keeps recall'] = recalls[1] >= recalls[0] - 0.005
+        else:
+            parser.error(f'unknown engine {name!r}')
+
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+"""Cold start of emb_server: time until the port listens and until the catalog is ready.
+
+    python bench_startup.py --dim 1536
+    python bench_startup.py --store embs_full.store --catalog df_full.csv
+
+This builds a synthetic float32 store for ``--catalog`` (or uses ``--store``).
+It then starts ``uvicorn emb_server:app`` and polls it every 10 ms. It
+records when ``/healthz`` first answers (listening), when ``/readyz``
+turns 200 (catalog, embeddings and indexes loaded), and what a ``/top``
+call sent during warm-up gets back and how fast. There are two runs: one
+builds rows and indexes from the CSV, the other maps the ``catalog.py``
+sidecar. The server's own ``[STARTUP]`` stage timings are printed as
+reported by ``/readyz``.
+
+Exits 1 unless both runs become ready, ``/healthz`` answers no later than
+``/readyz``, and the warm-up ``/top`` answers 200 or 503 within
+``--max-top-ms`` instead of waiting for the catalog.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import catalog
+import emb_store
+from bench_realtime import HERE, free_port
+from bench_workers import synthetic_store
+
+
+def get(port: int, path: str, data: bytes | None = None):
+    """(status, parsed JSON body), or (None, None) while nothing is listening."""
+    headers = {'Content-Type': 'application/json'} if data is not None else {}
+    request = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+    except OSError:
+        return None, None
+
+
+def run(label: str, store_dir: str, catalog_csv: str, timeout: float, max_top_ms: float, checks: dict):
+    port = free_port()
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'sk-bench'), EMB_STORE=store_dir,
+               CATALOG_CSV=catalog_csv, EMBED_CACHE_PATH='', UPSTREAM_POOL_SIZE='0',
+               PYTHONPATH=HERE + os.pathsep + os.getenv('PYTHONPATH', ''))
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'emb_server:app', '--port', str(port),
+                               '--log-level', 'warning'], cwd=HERE, env=env, stdout=subprocess.DEVNULL)
+    listening = ready = None
+    early_top = None
+    try:
+        while time.monotonic() - start < timeout:
+            if listening is None:
+                status, _ = get(port, '/healthz')
+                if status == 200:
+                    listening = time.monotonic() - start
+                    sent = time.monotonic()
+                    status, body = get(port, '/top', json.dumps(['bench widget']).encode())
+                    early_top = (status, (time.monotonic() - sent) * 1000, body)
+            else:
+                status, body = get(port, '/readyz')
+                if status == 200:
+                    ready = time.monotonic() - start
+                    break
+                if body and body.get('state') == 'failed':
+                    print(f'{label}: catalog load failed: {body["error"]}')
+                    break
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    checks[f'{label} ready'] = listening is not None and ready is not None
+    if not checks[f'{label} ready']:
+        print(f'{label}: not ready within {timeout:.0f} s')
+        return
+    checks[f'{label} listening before ready'] = listening <= ready
+    print(f'{label:7s} listening after {listening:6.2f} s   ready after {ready:6.2f} s')
+    status, ms, payload = early_top
+    checks[f'{label} warm-up /top answered'] = status in (200, 503) and ms <= max_top_ms
+    print(f'        /top during warm-up -> {status} in {ms:.1f} ms: {payload}')
+    print(f'        stages: {body["stages"]}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', default=os.path.join(HERE, 'df_full.csv'))
+    parser.add_argument('--store', help='existing embedding store for --catalog (default: synthetic)')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--max-top-ms', type=float, default=1000, help='bound on the warm-up /top answer')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as cleanup:
+        tmp = tempfile.mkdtemp(prefix='bench_startup_')
+        cleanup.callback(shutil.rmtree, tmp, ignore_errors=True)
+        catalog_csv = os.path.abspath(args.catalog)
+        store_dir = os.path.join(tmp, 'store')
+        if args.store:
+            shutil.copytree(args.store, store_dir, copy_function=lambda src, dst: os.symlink(os.path.abspath(src), dst),
+                            ignore=shutil.ignore_patterns(catalog.CATALOG_DIR))
+        else:
+            os.makedirs(store_dir)
+            synthetic_store(store_dir, catalog_csv, emb_store.count_csv_rows(catalog_csv), args.dim)
+
+        checks = {}
+        run('csv', store_dir, catalog_csv, args.timeout, args.max_top_ms, checks)
+        catalog.build(store_dir, catalog_csv)
+        run('shared', store_dir, catalog_csv, args.timeout, args.max_top_ms, checks)
+
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
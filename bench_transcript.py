@@ -0,0 +1,116 @@
+"""Transcript persistence and extraction input in realtime.py, before and after.
+
+    python bench_transcript.py --utterances 300 --deltas 12 --delta-ms 5
+
+Replays a synthetic call as transcription deltas. Old path: open/append/close
+``transcript.txt`` per delta and newline, and re-read the whole file for each
+extraction. New path: ``transcript.TranscriptBuffer`` with its background
+writer, and an extractor that takes only the utterances after its cursor.
+Reports file writes per utterance, fsyncs, wall time, and extraction input
+size at a few points in the call.
+
+Exits 1 unless both paths write the same file, the new path writes at most
+once per utterance plus once per ``--flush-ms``, and its extractor is handed
+each utterance once (total input no longer than the transcript).
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from transcript import TranscriptBuffer
+
+WORDS = ('I need two of the 2 inch firelock 90 elbows and one half inch liquid relief valve '
+         'plus a flex groove coupling, the PO number is 4471 and ship it to the usual address').split()
+
+
+def deltas_for(i: int, n: int):
+    words = WORDS[i % len(WORDS):] + WORDS[:i % len(WORDS)]
+    per = max(1, len(words) // n)
+    return [' '.join(words[j:j + per]) + ' ' for j in range(0, per * n, per)]
+
+
+def old_path(path: str, args, checkpoints):
+    opens = 0
+    sizes = {}
+    start = time.perf_counter()
+    for u in range(args.utterances):
+        for delta in deltas_for(u, args.deltas):
+            with open(path, 'a') as f:
+                f.write(delta)
+            opens += 1
+            time.sleep(args.delta_ms / 1000)
+        with open(path, 'a') as f:
+            f.write('\n')
+        opens += 1
+        with open(path) as f:  # extractor re-reads everything
+            sizes[u + 1] = len(f.read())
+    elapsed = time.perf_counter() - start
+    return opens, 0, elapsed, {c: sizes[c] for c in checkpoints}, sum(sizes.values())
+
+
+def new_path(path: str, args, checkpoints):
+    buffer = TranscriptBuffer(path, flush_interval=args.flush_ms / 1000, fsync_interval=args.fsync_s).start()
+    sizes, cursor = {}, 0
+    done = threading.Event()
+
+    def extractor():
+        nonlocal cursor
+        while not done.is_set() or len(buffer.utterances) > cursor:
+            if not buffer.wait_for(cursor, timeout=0.1):
+                continue
+            new, cursor = buffer.since(cursor)
+            sizes[cursor] = len('\n'.join(new))
+            sizes['total'] = sizes.get('total', 0) + sizes[cursor]
+
+    consumer = threading.Thread(target=extractor)
+    consumer.start()
+    start = time.perf_counter()
+    for u in range(args.utterances):
+        for delta in deltas_for(u, args.deltas):
+            buffer.add_delta(delta)
+            time.sleep(args.delta_ms / 1000)
+        buffer.complete()
+    done.set()
+    consumer.join()
+    buffer.close()
+    elapsed = time.perf_counter() - start
+    return buffer.writes, buffer.fsyncs, elapsed, {c: sizes.get(c, '-') for c in checkpoints}, sizes.get('total', 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--utterances', type=int, default=300)
+    parser.add_argument('--deltas', type=int, default=12, help='deltas per utterance')
+    parser.add_argument('--delta-ms', type=float, default=5, help='pause between deltas')
+    parser.add_argument('--flush-ms', type=int, default=1000)
+    parser.add_argument('--fsync-s', type=float, default=5)
+    args = parser.parse_args(argv)
+    checkpoints = sorted({1, 10, args.utterances // 2, args.utterances})
+
+    print(f'{args.utterances} utterances x {args.deltas} deltas, {args.delta_ms} ms apart')
+    print('extraction input chars at utterance ' + ', '.join(map(str, checkpoints)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, run in [('old: write per delta, full re-read', old_path), ('new: TranscriptBuffer', new_path)]:
+            path = os.path.join(tmp, name.split(':')[0] + '.txt')
+            writes, fsyncs, elapsed, sizes, total = run(path, args, checkpoints)
+            print(f'{name:36s} writes={writes:6d} ({writes / args.utterances:5.2f}/utterance)  fsyncs={fsyncs:3d}  '
+                  f'{elapsed:6.2f} s  input chars: ' + ', '.join(str(sizes[c]) for c in checkpoints))
+        with open(os.path.join(tmp, 'old.txt')) as a, open(os.path.join(tmp, 'new.txt')) as b:
+            old_text, new_text = a.read(), b.read()
+    print(f'new extractor input {total} chars in total, transcript {len(new_text)} chars')
+
+    checks = {
+        'files identical': old_text == new_text,
+        'one write per utterance or flush': writes <= args.utterances + elapsed * 1000 / args.flush_ms + 1,
+        'each utterance extracted once': 0 < total <= len(new_text),
+    }
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+"""Check and measure vad.VoiceGate on synthetic PCM16 fixtures.
+
+    python bench_vad.py
+    python bench_vad.py --chunk-ms 170 --hangover-ms 700 --preroll-ms 300
+
+The fixture is a 24 kHz phone-order stand-in. "Speech" segments are
+harmonic tones with syllable-rate amplitude modulation and soft onsets. They
+are separated by digital silence, line hiss and short quiet noise bursts,
+and one segment is a loud unvoiced (fricative-like) noise burst that must get
+through. The fixture is fed in browser-sized chunks. The script reports the
+fraction of audio suppressed and bytes saved, and checks for each speech
+segment that:
+
+- its onset is kept (first frame plus the pre-roll before it);
+- it is forwarded in full;
+- at least --min-trailing-ms of trailing audio follows it, so the upstream
+  server VAD can close the turn.
+
+A burst of quiet broadband noise between segments must be dropped.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from vad import VoiceGate
+
+RATE = 24000
+
+
+def silence(seconds: float, rng) -> np.ndarray:
+    return np.zeros(int(RATE * seconds))
+
+
+def hiss(seconds: float, dbfs: float, rng) -> np.ndarray:
+    return rng.standard_normal(int(RATE * seconds)) * 10 ** (dbfs / 20)
+
+
+def voiced(seconds: float, dbfs: float, f0: float, rng) -> np.ndarray:
+    t = np.arange(int(RATE * seconds)) / RATE
+    tone = sum(np.sin(2 * np.pi * f0 * h * t) / h for h in range(1, 6))
+    syllables = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t - np.pi / 2)  # ~4 syllables/s, starts quiet
+    x = tone * syllables
+    x *= 10 ** (dbfs / 20) / np.sqrt(np.mean(x * x))
+    return x + hiss(seconds, -60, rng)
+
+
+def fixture(seed: int = 0):
+    """(pcm16 bytes, [(start_sample, end_sample, label)]) for the labeled segments."""
+    rng = np.random.default_rng(seed)
+    plan = [
+        (silence(2.0, rng), None),
+        (voiced(1.2, -22, 140, rng), 'speech'),
+        (hiss(3.0, -55, rng), None),
+        (voiced(0.6, -30, 210, rng), 'speech'),
+        (silence(1.5, rng), None),
+        (hiss(0.3, -20, rng), 'loud fricative'),
+        (hiss(2.0, -55, rng), None),
+        (hiss(0.4, -38, rng), 'quiet noise'),
+        (silence(4.0, rng), None),
+        (voiced(2.5, -26, 120, rng), 'speech'),
+        (silence(3.0, rng), None),
+    ]
+    segments, pos = [], 0
+    for samples, label in plan:
+        if label:
+            segments.append((pos, pos + len(samples), label))
+        pos += len(samples)
+    pcm = np.clip(np.concatenate([s for s, _ in plan]) * 32768, -32768, 32767).astype('<i2')
+    return pcm.tobytes(), segments
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-ms', type=int, default=170, help='feed size (browser blocks are ~170 ms)')
+    parser.add_argument('--energy-db', type=float, default=-45.0)
+    parser.add_argument('--zcr-max', type=float, default=0.25)
+    parser.add_argument('--hangover-ms', type=int, default=700)
+    parser.add_argument('--preroll-ms', type=int, default=300)
+    parser.add_argument('--min-trailing-ms', type=int, default=500, help='upstream silence_duration_ms')
+    args = parser.parse_args(argv)
+
+    pcm, segments = fixture()
+    gate = VoiceGate(energy_db=args.energy_db, zcr_max=args.zcr_max, hangover_ms=args.hangover_ms,
+                     preroll_ms=args.preroll_ms)
+    chunk = RATE * args.chunk_ms // 1000 * 2
+    kept = set()
+    start = time.perf_counter()
+    for offset in range(0, len(pcm), chunk):
+        kept.update(number for number, _ in gate.process_frames(pcm[offset:offset + chunk]))
+    elapsed = time.perf_counter() - start
+
+    stats = gate.stats()
+    audio_s = len(pcm) / 2 / RATE
+    print(f'{audio_s:.1f} s of audio in {args.chunk_ms} ms chunks, gated in {elapsed * 1000:.1f} ms '
+          f'({audio_s / elapsed:,.0f}x real time)')
+    print(f'suppressed {stats["suppressed"]:.1%}  bytes saved {stats["bytes_saved"]:,} of {stats["bytes_in"]:,}  '
+          f'voiced frames {stats["voiced_frames"]}/{stats["frames"]}')
+
+    frame_samples = gate.frame_bytes // 2
+    preroll_frames = args.preroll_ms // (gate.frame_bytes // 2 * 1000 // RATE)
+    trailing_frames = -(-args.min_trailing_ms * RATE // 1000 // frame_samples)
+    failures = 0
+    for begin, end, label in segments:
+        first, last = begin // frame_samples, (end - 1) // frame_samples
+        if label == 'quiet noise':
+            checks = {'dropped': not set(range(first, last + 1)) & kept}
+            failures += not all(checks.values())
+            print(f'{label:15s} {begin / RATE:6.2f}-{end / RATE:6.2f} s  dropped: {"ok" if checks["dropped"] else "FAIL"}')
+            continue
+        onset = set(range(max(0, first - preroll_frames), first + 1))
+        checks = {
+            'onset kept': onset <= kept,
+            'segment kept': set(range(first, last + 1)) <= kept,
+            f'>= {args.min_trailing_ms} ms trailing': set(range(last + 1, last + 1 + trailing_frames)) <= kept,
+        }
+        failures += not all(checks.values())
+        status = '  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items())
+        print(f'{label:15s} {begin / RATE:6.2f}-{end / RATE:6.2f} s  {status}')
+    print('all checks passed' if not failures else f'{failures} segment(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+"""Per-worker memory of ``uvicorn --workers N`` with private vs shared catalog structures.
+
+    python bench_workers.py --workers 4 --dim 1536
+    python bench_workers.py --workers 4 --store embs_full.store --catalog df_full.csv
+
+This builds a synthetic float32 store for ``--catalog`` (or uses ``--store``).
+It then starts emb_server under uvicorn twice against a fake OpenAI HTTP API:
+
+- private: every worker parses the CSV and builds its own rows, exact and
+  lexical indexes
+- shared: ``python catalog.py`` has written them into the store and workers
+  map them
+
+In each run, concurrent ``/top`` calls touch the embeddings, rows and indexes
+in every worker. The script then reads /proc/<pid>/smaps_rollup for each
+worker and prints RSS, PSS (shared pages split between the processes mapping
+them) and USS (pages only this worker holds). Summed PSS is what N workers
+really cost the machine.
+
+Exits 1 unless every worker is found in both runs and the shared run costs
+less summed PSS and USS than the private one.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import catalog
+import emb_store
+from bench_realtime import HERE, fake_openai_http, free_port, wait_for_ready
+
+
+def synthetic_store(store_dir: str, catalog_csv: str, rows: int, dim: int):
+    def all_rows():
+        rng = np.random.default_rng(0)
+        for start in range(0, rows, 4096):
+            block = rng.standard_normal((min(4096, rows - start), dim), dtype=np.float32)
+            block /= np.linalg.norm(block, axis=1, keepdims=True)
+            yield from block
+    emb_store.write_store(store_dir, all_rows(), dim, rows, catalog_csv)
+
+
+def worker_pids(master: int) -> list:
+    with open(f'/proc/{master}/task/{master}/children') as f:
+        children = [int(pid) for pid in f.read().split()]
+    pids = []
+    for pid in children:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            if b'resource_tracker' not in f.read():  # multiprocessing's helper, not a worker
+                pids.append(pid)
+    return pids
+
+
+def memory_mib(pid: int) -> dict:
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'uss': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def post_top(port: int, names: list):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/top?k=10', data=json.dumps(names).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        response.read()
+
+
+def run(label: str, store_dir: str, catalog_csv: str, http_port: int, args):
+    port = free_port()
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'sk-bench'),
+               OPENAI_BASE_URL=f'http://127.0.0.1:{http_port}/v1', EMB_STORE=store_dir, CATALOG_CSV=catalog_csv,
+               EMBED_CACHE_PATH='', UPSTREAM_POOL_SIZE='0',
+               PYTHONPATH=HERE + os.pathsep + os.getenv('PYTHONPATH', ''))
+    started = time.perf_counter()
+    master = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'emb_server:app', '--port', str(port),
+                               '--workers', str(args.workers), '--log-level', 'warning'],
+                              cwd=HERE, env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_ready(port, workers=args.workers)
+        # distinct names so the exact index and embedding cache never answer
+        names = [[f'bench widget {i} {j}' for j in range(3)] for i in range(args.requests)]
+        with ThreadPoolExecutor(args.requests) as pool:
+            list(pool.map(lambda n: post_top(port, n), names))
+        ready = time.perf_counter() - started
+        pids = worker_pids(master.pid)
+        usage = [memory_mib(pid) for pid in pids]
+    finally:
+        master.terminate()
+        master.wait()
+    print(f'{label:8s} workers={len(pids)}  ready and first /top burst done after {ready:5.1f} s')
+    for pid, u in zip(pids, usage):
+        print(f'    pid {pid:7d}  RSS={u["rss"]:7.0f} MiB  PSS={u["pss"]:7.0f} MiB  USS={u["uss"]:7.0f} MiB')
+    total = {key: sum(u[key] for u in usage) for key in ('rss', 'pss', 'uss')}
+    print(f'    total    RSS={total["rss"]:7.0f} MiB  PSS={total["pss"]:7.0f} MiB  USS={total["uss"]:7.0f} MiB')
+    return len(pids), total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--catalog', default=os.path.join(HERE, 'df_full.csv'))
+    parser.add_argument('--store', help='existing embedding store for --catalog (default: synthetic)')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--requests', type=int, default=64, help='concurrent /top calls per run')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as cleanup:
+        tmp = tempfile.mkdtemp(prefix='bench_workers_')
+        cleanup.callback(shutil.rmtree, tmp, ignore_errors=True)
+        catalog_csv = os.path.abspath(args.catalog)
+        if args.store:
+            # catalog.py writes into the store; work on a copy that links to the embedding files
+            store_dir = os.path.join(tmp, 'store')
+            shutil.copytree(args.store, store_dir, copy_function=lambda src, dst: os.symlink(os.path.abspath(src), dst),
+                            ignore=shutil.ignore_patterns(catalog.CATALOG_DIR))
+        else:
+            store_dir = os.path.join(tmp, 'store')
+            os.makedirs(store_dir)
+            synthetic_store(store_dir, catalog_csv, emb_store.count_csv_rows(catalog_csv), args.dim)
+        dim = emb_store.read_manifest(store_dir)['dim']
+        http_port = free_port()
+        server = fake_openai_http(http_port, 0.0, 0.0, dim)
+        cleanup.callback(server.shutdown)
+
+        private_workers, private = run('private', store_dir, catalog_csv, http_port, args)
+        catalog.build(store_dir, catalog_csv)
+        shared_workers, shared = run('shared', store_dir, catalog_csv, http_port, args)
+
+    checks = {
+        f'{args.workers} workers per run': private_workers == shared_workers == args.workers,
+        'shared PSS below private': shared['pss'] < private['pss'],
+        'shared USS below private': shared['uss'] < private['uss'],
+    }
+    print('  '.join(f'{name}: {"ok" if ok else "FAIL"}' for name, ok in checks.items()))
+    failures = sum(not ok for ok in checks.values())
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
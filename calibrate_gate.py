@@ -0,0 +1,94 @@
+"""Calibrate the confidence gate on labeled (query, item_id) pairs.
+
+    python calibrate_gate.py labeled.csv --target-precision 0.98
+
+``labeled.csv`` has ``query`` and ``item_id`` columns. Each query goes
+through the same steps as in ``call_top`` (same catalog, engine and embedding
+cache, configured through the usual environment variables). Queries the exact
+index answers never reach the gate, so they are counted and left out. For
+every threshold the report shows how many of the remaining parts the gate
+would accept (LLM calls avoided) and how many of those accepted top-1
+candidates were the labeled item (precision).
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import gate
+
+
+def gate_scores(cat, embed, queries, margin_weight: float, batch: int = 256):
+    """(positions of the queries that reach the gate, their scores, their top-1 item ids)."""
+    gated = [i for i, query in enumerate(queries) if cat.exact.lookup(query) is None]
+    scores, top_ids = [], []
+    for start in range(0, len(gated), batch):
+        chunk = [queries[i] for i in gated[start:start + batch]]
+        top_indices, top_scores = cat.engine.search(np.array(embed(chunk), dtype=np.float32), 2)
+        for query, ixs, sims in zip(chunk, top_indices, top_scores):
+            if ixs[0] < 0:  # an approximate engine found nothing
+                scores.append(-np.inf)
+                top_ids.append(None)
+                continue
+            top2 = float(sims[1]) if len(sims) > 1 else float('-inf')
+            scores.append(gate.score(query, cat.rows.value(ixs[0], 'description'), float(sims[0]), top2,
+                                     margin_weight=margin_weight))
+            top_ids.append(cat.rows.value(ixs[0], 'item_id'))
+    return gated, np.array(scores, dtype=np.float64), top_ids
+
+
+def sweep(scores: np.ndarray, correct: np.ndarray, thresholds, target_precision: float):
+    """([(threshold, accepted, fraction avoided, precision)], lowest threshold meeting the target or None).
+
+    The lowest threshold is the one from which every higher threshold that
+    accepts anything also meets ``target_precision``.
+    """
+    rows, best = [], None
+    for t in thresholds:
+        accepted = scores >= t
+        precision = correct[accepted].mean() if accepted.any() else float('nan')
+        rows.append((t, int(accepted.sum()), accepted.mean() if len(scores) else 0.0, precision))
+        if not accepted.any():
+            continue
+        if precision < target_precision:
+            best = None
+        elif best is None:
+            best = t
+    return rows, best
+
+
+def main(argv=None):
+    import emb_server as server
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('labeled_csv')
+    parser.add_argument('--margin-weight', type=float, default=server.GATE_MARGIN_WEIGHT)
+    parser.add_argument('--thresholds', default=None, help='comma-separated thresholds (default: 0.30..1.50 step 0.05)')
+    parser.add_argument('--target-precision', type=float, default=0.98)
+    args = parser.parse_args(argv)
+
+    labeled = pd.read_csv(args.labeled_csv, dtype=str)
+    queries = labeled['query'].tolist()
+    cat = server.current_catalog or server.load_catalog()
+    gated, scores, top_ids = gate_scores(cat, server.embed, queries, args.margin_weight)
+    expected = labeled['item_id'].tolist()
+    correct = np.array([found == expected[i] for i, found in zip(gated, top_ids)], dtype=bool)
+    print(f'{len(queries)} labeled queries, {len(queries) - len(gated)} answered by the exact index (not gated); '
+          f'of the {len(gated)} gated, top-1 correct for {correct.mean() if len(correct) else 0:.1%}, '
+          f'margin weight {args.margin_weight}')
+
+    thresholds = ([float(t) for t in args.thresholds.split(',')] if args.thresholds
+                  else np.round(np.arange(0.30, 1.501, 0.05), 2))
+    rows, best = sweep(scores, correct, thresholds, args.target_precision)
+    print(f'{"threshold":>9}  {"accepted":>8}  {"avoided":>7}  {"precision":>9}')
+    for t, accepted, avoided, precision in rows:
+        print(f'{t:9.2f}  {accepted:8d}  {avoided:7.1%}  {precision:9.3f}')
+    if best is not None:
+        avoided = next(row[2] for row in rows if row[0] == best)
+        print(f'lowest threshold with precision >= {args.target_precision}: GATE_THRESHOLD={best} '
+              f'({avoided:.1%} of gated LLM calls avoided)')
+    else:
+        print(f'no threshold reaches precision {args.target_precision}')
+
+
+if __name__ == '__main__':
+    main()
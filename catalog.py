@@ -0,0 +1,187 @@
+"""Catalog rows and lookup indexes that worker processes share instead of copy.
+
+With ``uvicorn --workers N`` every worker imported emb_server on its own and
+held a private pandas frame, exact-match dicts and lexical index next to the
+(already shared) memory-mapped embeddings. ``python catalog.py`` writes all
+three into a ``catalog/`` directory inside the embedding store:
+
+    python catalog.py embs_full.store df_full.csv
+
+- ``rows/``: every CSV column as one UTF-8 blob, plus an offsets array and a
+  missing-value mask.
+- ``exact/``: the ``ExactIndex`` hash tables.
+- ``lexical/``: the ``LexicalIndex`` postings.
+
+Workers map these files read-only, so the OS keeps one copy in the page
+cache. Strings are decoded only for the rows a request touches.
+``RowStore.from_frame`` builds the same row interface in memory when the
+sidecar has not been written.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import emb_store
+from exact_index import ExactIndex
+from lexical import LexicalIndex
+
+CATALOG_DIR = 'catalog'
+CATALOG_VERSION = 1
+
+
+class RowStore:
+    """Read-only catalog rows: ``len``, ``value(i, column)``, ``row(i)``."""
+
+    def __init__(self, columns: list, blobs: dict, offsets: dict, missing: dict):
+        self.columns = columns
+        self._blobs = blobs
+        self._offsets = offsets
+        self._missing = missing
+
+    @classmethod
+    def from_frame(cls, df) -> 'RowStore':
+        blobs, offsets, missing = {}, {}, {}
+        for column in df.columns:
+            values = df[column]
+            missing[column] = values.isna().to_numpy()
+            encoded = [b'' if m else str(v).encode('utf-8') for v, m in zip(values, missing[column])]
+            offsets[column] = np.concatenate([[0], np.cumsum([len(e) for e in encoded], dtype=np.int64)])
+            blobs[column] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(list(df.columns), blobs, offsets, missing)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for i, column in enumerate(self.columns):
+            emb_store.replace_file(os.path.join(path, f'{i}.utf8'), self._blobs[column].tofile)
+            emb_store.save_array(os.path.join(path, f'{i}.offsets.npy'), self._offsets[column])
+            emb_store.save_array(os.path.join(path, f'{i}.missing.npy'), self._missing[column])
+        emb_store.replace_file(os.path.join(path, 'columns.json'), lambda f: f.write(json.dumps(self.columns).encode()))
+
+    @classmethod
+    def open(cls, path: str) -> 'RowStore':
+        with open(os.path.join(path, 'columns.json')) as f:
+            columns = json.load(f)
+        blobs, offsets, missing = {}, {}, {}
+        for i, column in enumerate(columns):
+            blob_path = os.path.join(path, f'{i}.utf8')
+            # np.memmap cannot map an empty file
+            blobs[column] = (np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path)
+                             else np.empty(0, dtype=np.uint8))
+            offsets[column] = np.load(os.path.join(path, f'{i}.offsets.npy'), mmap_mode='r')
+            missing[column] = np.load(os.path.join(path, f'{i}.missing.npy'), mmap_mode='r')
+        return cls(columns, blobs, offsets, missing)
+
+    def __len__(self) -> int:
+        return len(self._offsets[self.columns[0]]) - 1
+
+    def value(self, i: int, column: str) -> str | None:
+        if self._missing[column][i]:
+            return None
+        offsets = self._offsets[column]
+        return self._blobs[column][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def row(self, i: int) -> dict:
+        return {column: self.value(i, column) for column in self.columns}
+
+    def candidates_json(self, ixs) -> str:
+        """The rows as pandas ``reset_index().to_json(orient='records', indent=4)`` prints them.
+
+        Byte-identical to the frame-based prompt, including pandas' escaped
+        slashes, so resolution prompts do not change.
+        """
+        def dump(value):
+            return 'null' if value is None else json.dumps(value).replace('/', '\\/')
+
+        records = []
+        for position, i in enumerate(ixs):
+            fields = [f'"index":{position}'] + [f'{dump(c)}:{dump(self.value(i, c))}' for c in self.columns]
+            records.append('{\n        ' + ',\n        '.join(fields) + '\n    }')
+        return '[\n    ' + ',\n    '.join(records) + '\n]' if records else '[\n\n]'
+
+
+class Catalog:
+    """Everything a match reads, loaded together: vector engine, rows, exact and lexical indexes.
+
+    Request handlers take one reference and use it for the whole request, so
+    a catalog swapped in meanwhile never mixes rows of one version with
+    vectors of another. ``embeddings``, ``store_dir`` and ``catalog_csv``
+    record what it was built from, as the base for the next update.
+    """
+
+    def __init__(self, engine, rows: RowStore, exact: ExactIndex, lexical: LexicalIndex | None,
+                 embeddings: np.ndarray, store_dir: str | None, catalog_csv: str):
+        self.engine = engine
+        self.rows = rows
+        self.exact = exact
+        self.lexical = lexical
+        self.embeddings = embeddings
+        self.store_dir = store_dir
+        self.catalog_csv = catalog_csv
+
+    def close(self):
+        """Release the engine's batching thread once replaced; searches still work unbatched."""
+        if hasattr(self.engine, 'close'):
+            self.engine.close()
+
+
+def build(store_dir: str, catalog_csv: str) -> dict:
+    """Write rows and lookup indexes for ``catalog_csv`` into ``store_dir/catalog``."""
+    import pandas as pd
+    manifest = emb_store.read_manifest(store_dir)
+    sha = emb_store.file_sha256(catalog_csv)
+    if sha != manifest['catalog_sha256']:
+        raise ValueError(f'{catalog_csv} does not match the catalog {store_dir} was built from '
+                         f'({manifest["catalog_csv"]})')
+    df = pd.read_csv(catalog_csv)
+    out = os.path.join(store_dir, CATALOG_DIR)
+    # Servers starting mid-rebuild fall back to the CSV instead of mixing old and new files
+    if has_shared(store_dir):
+        os.remove(os.path.join(out, 'manifest.json'))
+    RowStore.from_frame(df).save(os.path.join(out, 'rows'))
+    ExactIndex.build(df['item_id'], df['description']).save(os.path.join(out, 'exact'))
+    LexicalIndex.build(df['description'].astype(str).tolist()).save(os.path.join(out, 'lexical'))
+    info = {'version': CATALOG_VERSION, 'rows': len(df), 'catalog_sha256': sha}
+    emb_store.replace_file(os.path.join(out, 'manifest.json'), lambda f: f.write(json.dumps(info, indent=2).encode()))
+    return info
+
+
+def has_shared(store_dir: str) -> bool:
+    return os.path.isfile(os.path.join(store_dir, CATALOG_DIR, 'manifest.json'))
+
+
+def open_shared(store_dir: str, lexical: bool = True):
+    """(rows, exact index, lexical index or None), mapped from ``store_dir/catalog``.
+
+    Raises ValueError if the sidecar was built from a different catalog than
+    the store's embeddings.
+    """
+    out = os.path.join(store_dir, CATALOG_DIR)
+    with open(os.path.join(out, 'manifest.json')) as f:
+        info = json.load(f)
+    if info.get('version') != CATALOG_VERSION:
+        raise ValueError(f'Unsupported catalog version {info.get("version")} in {out}')
+    if info['catalog_sha256'] != emb_store.read_manifest(store_dir)['catalog_sha256']:
+        raise ValueError(f'{out} was built from a different catalog than {store_dir}; rerun catalog.py')
+    rows = RowStore.open(os.path.join(out, 'rows'))
+    exact = ExactIndex.load(os.path.join(out, 'exact'))
+    lexical_index = LexicalIndex.load(os.path.join(out, 'lexical')) if lexical else None
+    return rows, exact, lexical_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write shared catalog rows and indexes into an embedding store')
+    parser.add_argument('store_dir')
+    parser.add_argument('catalog_csv')
+    args = parser.parse_args(argv)
+    try:
+        info = build(args.store_dir, args.catalog_csv)
+    except ValueError as e:
+        sys.exit(f'error: {e}')
+    print(f'Wrote {info["rows"]} catalog rows and lookup indexes to {os.path.join(args.store_dir, CATALOG_DIR)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Incremental catalog updates: embed only the rows whose description changed.
+
+The product file changes daily by a few hundred SKUs. Re-embedding all of it
+is slow and costs money. ``build_version`` compares a new CSV with the loaded
+catalog by ``item_id`` and by a hash of the embedded text (the description).
+A row keeps its old vector when its item_id still has the same description,
+or when any old row has the same description. Only new text is sent to the
+embeddings API. The result is a complete, self-contained store:
+
+    catalog_versions/20260118T063000-1a2b3c4d/
+        embs.f32, manifest.json   the new matrix (emb_store format)
+        hashes.npy                per-row description hashes, for the next diff
+        catalog.csv               the CSV it was built from
+        catalog/                  shared rows + exact/lexical indexes (catalog.py)
+        ivf/, int8-row/, ...      whatever vector indexes the base store had
+
+Then ``publish`` points ``catalog_versions/CURRENT`` at it atomically.
+Running servers watch that file and swap to the new catalog between
+requests (see emb_server). Build and publish from the command line with:
+
+    python catalog_update.py df_new.csv --store embs_full.store --catalog df_full.csv
+
+``--store``/``--catalog`` give the base to diff against while nothing has
+been published yet; after that the published version is the base.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import catalog
+import emb_store
+import retrieval
+
+CURRENT = 'CURRENT'
+HASHES_FILE = 'hashes.npy'
+CATALOG_COPY = 'catalog.csv'
+EMBED_BATCH = 1024  # rows per embeddings request
+KEEP_VERSIONS = 3  # published versions kept on disk, including the current one
+
+
+def content_hashes(texts) -> np.ndarray:
+    """64-bit BLAKE2 of each embedded text (None counts as empty)."""
+    return np.array([int.from_bytes(hashlib.blake2b((t or '').encode('utf-8'), digest_size=8).digest(), 'little')
+                     for t in texts], dtype=np.uint64)
+
+
+def row_hashes(rows: catalog.RowStore, store_dir: str | None = None) -> np.ndarray:
+    """Description hashes of ``rows``: saved with the store if it has them, else computed."""
+    if store_dir and os.path.isfile(os.path.join(store_dir, HASHES_FILE)):
+        return np.load(os.path.join(store_dir, HASHES_FILE))
+    return content_hashes(rows.value(i, 'description') for i in range(len(rows)))
+
+
+def read_catalog_csv(path: str):
+    """(frame, item ids, descriptions, description hashes) of a catalog CSV."""
+    import pandas as pd
+    df = pd.read_csv(path)
+    ids = [None if pd.isna(v) else str(v) for v in df['item_id']]
+    texts = [None if pd.isna(d) else str(d) for d in df['description']]
+    return df, ids, texts, content_hashes(texts)
+
+
+def diff(old_ids: list, old_hashes: np.ndarray, new_ids: list, new_hashes: np.ndarray):
+    """(sources, report): for each new row the old row whose vector it can reuse, or -1.
+
+    A row reuses its own item_id's vector when the description is unchanged,
+    otherwise any old row with an identical description.
+    """
+    by_id, by_hash = {}, {}
+    for i, (item_id, h) in enumerate(zip(old_ids, old_hashes.tolist())):
+        by_id.setdefault(item_id, i)
+        by_hash.setdefault(h, i)
+    sources = np.full(len(new_ids), -1, dtype=np.int64)
+    report = {'rows': len(new_ids), 'added': 0, 'changed': 0, 'unchanged': 0, 'reused_by_hash': 0}
+    for i, (item_id, h) in enumerate(zip(new_ids, new_hashes.tolist())):
+        old = by_id.get(item_id)
+        if old is not None and old_hashes[old] == h:
+            sources[i] = old
+            report['unchanged'] += 1
+            continue
+        report['changed' if old is not None else 'added'] += 1
+        if h in by_hash:
+            sources[i] = by_hash[h]
+            report['reused_by_hash'] += 1
+    report['removed'] = len(set(old_ids) - set(new_ids))
+    report['to_embed'] = len({h for h, s in zip(new_hashes.tolist(), sources) if s < 0})
+    return sources, report
+
+
+def build_version(old_rows: catalog.RowStore, old_embeddings: np.ndarray, old_hashes: np.ndarray,
+                  new_csv: str, versions_dir: str, embed_fn, base_store: str | None = None,
+                  batch_size: int = EMBED_BATCH, engine: str | None = None, quant_scales: str = 'row',
+                  prefix_dim: int = 256, log=print):
+    """Write a new store for ``new_csv`` under ``versions_dir``; returns (its path, report).
+
+    ``embed_fn(texts) -> vectors`` is only called for descriptions no old row
+    has. The version gets the vector indexes ``base_store`` has plus the ones
+    ``engine`` (a ``retrieval.load_engine`` name) needs. Nothing under
+    ``versions_dir`` changes until the finished directory is renamed into
+    place, and nothing is served from it until ``publish``.
+    """
+    started = time.perf_counter()
+    df, new_ids, texts, new_hashes = read_catalog_csv(new_csv)
+    old_ids = [old_rows.value(i, 'item_id') for i in range(len(old_rows))]
+    sources, report = diff(old_ids, old_hashes, new_ids, new_hashes)
+    log(f'[CATALOG] {new_csv}: {report["added"]} added, {report["changed"]} changed, {report["removed"]} removed, '
+        f'{report["unchanged"]} unchanged; {report["to_embed"]} descriptions to embed')
+
+    # One embedding per distinct new text, shared by every row that has it
+    fresh = {}
+    for i in np.flatnonzero(sources < 0):
+        fresh.setdefault(int(new_hashes[i]), texts[i] or '')
+    pending = list(fresh.items())
+    vectors = {}
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        for (h, _), vector in zip(chunk, embed_fn([text for _, text in chunk])):
+            vectors[h] = np.asarray(vector, dtype=np.float32)
+        log(f'[CATALOG] embedded {min(start + batch_size, len(pending))}/{len(pending)}')
+
+    dim = old_embeddings.shape[1]
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{emb_store.file_sha256(new_csv)[:8]}'
+    out = os.path.join(versions_dir, name)
+    n = 1
+    while os.path.exists(out):  # same CSV twice within a second
+        n += 1
+        out = os.path.join(versions_dir, f'{name}-{n}')
+    tmp = out + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        csv_copy = os.path.join(tmp, CATALOG_COPY)
+        shutil.copyfile(new_csv, csv_copy)
+        emb_store.write_store(tmp, (old_embeddings[s] if s >= 0 else vectors[int(h)]
+                                    for s, h in zip(sources, new_hashes)), dim, len(df), csv_copy)
+        np.save(os.path.join(tmp, HASHES_FILE), new_hashes)
+        report['indexes'] = retrieval.rebuild_indexes(base_store, tmp, emb_store.open_store(tmp), engine,
+                                                      quant_scales, prefix_dim)
+        catalog.build(tmp, csv_copy)
+        os.replace(tmp, out)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    log(f'[CATALOG] wrote {out} in {report["seconds"]:.1f} s')
+    return out, report
+
+
+def current_version(versions_dir: str) -> str | None:
+    """Path of the published version, or None if nothing has been published."""
+    try:
+        with open(os.path.join(versions_dir, CURRENT)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(versions_dir, name) if name else None
+
+
+def publish(versions_dir: str, version_dir: str, keep: int = KEEP_VERSIONS):
+    """Point CURRENT at ``version_dir`` (atomic rename) and prune older versions.
+
+    Servers still mapping a pruned version keep reading it: on POSIX the
+    files stay alive until the last mapping goes away.
+    """
+    tmp = os.path.join(versions_dir, CURRENT + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(os.path.basename(version_dir) + '\n')
+    os.replace(tmp, os.path.join(versions_dir, CURRENT))
+    versions = sorted(name for name in os.listdir(versions_dir)
+                      if not name.endswith('.tmp') and os.path.isfile(os.path.join(versions_dir, name, emb_store.MANIFEST)))
+    for name in versions[:-keep] if keep > 0 else []:
+        if name != os.path.basename(version_dir):
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+def openai_embedder(model: str = 'text-embedding-3-small'):
+    """embed_fn for the CLI: each EMBED_BATCH goes out as concurrent, retried requests (embed_catalog.py)."""
+    from embed_catalog import Embedder  # imports this module
+    return Embedder(os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'), os.getenv('OPENAI_API_KEY'),
+                    model).embed_texts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Diff a new catalog CSV against the current one, embed only '
+                                                 'what changed, and publish it to running servers')
+    parser.add_argument('new_csv')
+    parser.add_argument('--versions', default=os.getenv('CATALOG_VERSIONS_DIR', 'catalog_versions'))
+    parser.add_argument('--store', default=os.getenv('EMB_STORE', 'embs_subset.store'),
+                        help='base store while nothing is published yet')
+    parser.add_argument('--catalog', default=os.getenv('CATALOG_CSV', 'df_subset.csv'),
+                        help='CSV the base store was built from')
+    parser.add_argument('--engine', default=os.getenv('RETRIEVAL_ENGINE', 'exact'),
+                        help='retrieval engine the servers use; its index is built if the base lacks it')
+    parser.add_argument('--quant-scales', default=os.getenv('QUANT_SCALES', 'row'))
+    parser.add_argument('--prefix-dim', type=int, default=int(os.getenv('MATRYOSHKA_DIM', '256')))
+    parser.add_argument('--dry-run', action='store_true', help='print the diff only')
+    parser.add_argument('--no-publish', action='store_true', help='build the version but leave CURRENT alone')
+    args = parser.parse_args(argv)
+
+    base = current_version(args.versions)
+    base_csv = os.path.join(base, CATALOG_COPY) if base else args.catalog
+    base = base or args.store
+    try:
+        embeddings = emb_store.open_store(base, base_csv)
+    except (OSError, ValueError) as e:
+        sys.exit(f'error: cannot open base store {base}: {e}')
+    if catalog.has_shared(base):
+        rows = catalog.RowStore.open(os.path.join(base, catalog.CATALOG_DIR, 'rows'))
+    else:
+        import pandas as pd
+        rows = catalog.RowStore.from_frame(pd.read_csv(base_csv))
+    hashes = row_hashes(rows, base)
+    if args.dry_run:
+        _, new_ids, _, new_hashes = read_catalog_csv(args.new_csv)
+        print(diff([rows.value(i, 'item_id') for i in range(len(rows))], hashes, new_ids, new_hashes)[1])
+        return
+    os.makedirs(args.versions, exist_ok=True)
+    out, report = build_version(rows, embeddings, hashes, args.new_csv, args.versions, openai_embedder(),
+                                base_store=base, engine=args.engine, quant_scales=args.quant_scales,
+                                prefix_dim=args.prefix_dim)
+    if not args.no_publish:
+        publish(args.versions, out)
+        print(f'Published {out}')
+
+
+if __name__ == '__main__':
+    main()
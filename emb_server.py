@@ -1,29 +1,289 @@
+import asyncio
 import json
+from contextlib import asynccontextmanager
 import base64
-import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from typing import List
 from openai import OpenAI
 import os
-import websocket
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse
+import shutil
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import HTMLResponse, JSONResponse
+
+import catalog
+import catalog_update
+import emb_store
+import gate
+from exact_index import ExactIndex
+from extraction import IncrementalExtractor
+from pipeline import BlockingPool, CoalescingWorker, PoolFull
+import lexical
+import resolver
+import retrieval
+import upstream
+from vad import VoiceGate
+from embed_cache import EmbeddingCache
 
 # Original setup
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 API_KEY = os.getenv("OPENAI_API_KEY")
-WS_URL = 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01'
+WS_URL = os.getenv('REALTIME_WS_URL', 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01')
+
+# Catalog: a binary store built with `python emb_store.py embs.json df_full.csv embs_full.store`
+# is memory-mapped; the legacy JSON file is only read when no store exists.
+# Nothing is loaded at import: load_catalog runs in the background once the
+# server is listening (see lifespan and /readyz).
+CATALOG_CSV = os.getenv('CATALOG_CSV', 'df_subset.csv')
+EMB_STORE = os.getenv('EMB_STORE', 'embs_subset.store')
+EMB_JSON = os.getenv('EMB_JSON', 'embs_subset.json')
+
+# Retrieval backend for call_top: "exact" (brute force), "ivf" (needs
+# `python retrieval.py build-ivf <EMB_STORE>` first) or "int8"
+# (needs `python retrieval.py quantize <EMB_STORE>` first) or
+# "matryoshka" (needs `python retrieval.py truncate <EMB_STORE> --dim ...`).
+# RESCORE_K=0 turns off full-dimension rescoring for matryoshka.
+RETRIEVAL_ENGINE = os.getenv('RETRIEVAL_ENGINE', 'exact')
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '8'))
+QUANT_SCALES = os.getenv('QUANT_SCALES', 'row')
+RESCORE_K = int(os.getenv('RESCORE_K', '200'))
+MATRYOSHKA_DIM = int(os.getenv('MATRYOSHKA_DIM', '256'))
+# Searches from concurrent sessions arriving within SEARCH_BATCH_MS are run as
+# one batched search (one pass over the matrix); 0 (default) = every call searches
+# alone. Only applied to engines that search many queries in one pass (exact,
+# matryoshka); a single session gains nothing and pays the window on every search
+SEARCH_BATCH_MS = float(os.getenv('SEARCH_BATCH_MS', '0'))
+SEARCH_BATCH_MAX = int(os.getenv('SEARCH_BATCH_MAX', '256'))
+
+# Character n-gram BM25 over descriptions, fused with the vector candidates by
+# reciprocal rank. HYBRID_DEPTH candidates are taken from each list before fusion.
+LEXICAL_SEARCH = os.getenv('LEXICAL_SEARCH', '1') == '1'
+HYBRID_DEPTH = int(os.getenv('HYBRID_DEPTH', '30'))
+
+
+# Catalog updates (catalog_update.py, POST /catalog/update) are written as
+# versions under CATALOG_VERSIONS_DIR. Once one is published it is loaded
+# instead of EMB_STORE/CATALOG_CSV. Every worker checks for a newly published
+# version every CATALOG_WATCH_S seconds (0 = never) and swaps it in.
+CATALOG_VERSIONS_DIR = os.getenv('CATALOG_VERSIONS_DIR', 'catalog_versions')
+CATALOG_WATCH_S = float(os.getenv('CATALOG_WATCH_S', '5'))
+
+# The loaded catalog (engine, rows, exact and lexical indexes); None until
+# load_catalog finishes. Each job reads it once and uses that snapshot
+# throughout; swap_catalog replaces it with a single assignment.
+current_catalog = None
+# Warm-up progress reported by /readyz: state is "loading", "ready" or "failed"
+startup = {'state': 'loading', 'stage': None, 'stages': {}, 'error': None}
+STARTED_AT = time.monotonic()
+catalog_swaps = 0
+catalog_reload_lock = threading.Lock()
+
+
+class CatalogNotReady(RuntimeError):
+    pass
+
+
+def require_catalog() -> catalog.Catalog:
+    cat = current_catalog
+    if cat is None:
+        raise CatalogNotReady(f'catalog {startup["state"]} (stage: {startup["stage"]})')
+    return cat
+
+
+def build_catalog(store: str | None, catalog_csv: str, progress: dict) -> catalog.Catalog:
+    """Load embeddings, search engine, rows and lookup indexes (blocking); stage timings go to ``progress``"""
+
+    def stage(name, fn):
+        progress['stage'] = name
+        start = time.perf_counter()
+        result = fn()
+        # Replaced, not mutated: /readyz may be copying it from the event loop thread
+        progress['stages'] = {**progress['stages'], name: round(time.perf_counter() - start, 3)}
+        print(f'[CATALOG] {name}: {progress["stages"][name]:.2f} s')
+        return result
+
+    def read_json_embeddings():
+        with open(EMB_JSON) as f:
+            return np.array(json.load(f), dtype=np.float32)
+
+    embs_arr = stage('embeddings', lambda: emb_store.open_store(store, catalog_csv) if store else read_json_embeddings())
+    engine = stage('engine', lambda: retrieval.load_engine(RETRIEVAL_ENGINE, embs_arr, store_dir=store,
+                                                           nprobe=IVF_NPROBE, scales=QUANT_SCALES,
+                                                           rescore=RESCORE_K, dim=MATRYOSHKA_DIM))
+    # Fault the index pages in now rather than on the first caller's search
+    stage('warm_search', lambda: engine.search(np.array(embs_arr[:1], dtype=np.float32), 1))
+    # Catalog rows, plus verbatim item id / description lookups that short-circuit
+    # extraction and matching. With `python catalog.py <EMB_STORE> <CATALOG_CSV>`
+    # run first they are memory-mapped from the store, so uvicorn workers share one
+    # copy; otherwise every process builds its own from the CSV.
+    if store and catalog.has_shared(store):
+        rows, exact_lookup, lexical_index = stage('catalog', lambda: catalog.open_shared(store, lexical=LEXICAL_SEARCH))
+    else:
+        df = stage('catalog_csv', lambda: pd.read_csv(catalog_csv))
+        rows = stage('rows', lambda: catalog.RowStore.from_frame(df))
+        exact_lookup = stage('exact_index', lambda: ExactIndex.build(df['item_id'], df['description']))
+        lexical_index = None
+        if LEXICAL_SEARCH:
+            descriptions = df['description'].astype(str).tolist()
+            lexical_index = stage('lexical_index', lambda: lexical.LexicalIndex.build(descriptions))
+        del df
+    if len(rows) != len(embs_arr):
+        raise ValueError(f'{catalog_csv} has {len(rows)} rows but the embeddings have {len(embs_arr)}')
+    if SEARCH_BATCH_MS > 0:
+        if engine.batches_queries:
+            engine = retrieval.BatchingEngine(engine, window_ms=SEARCH_BATCH_MS, max_batch=SEARCH_BATCH_MAX)
+        else:
+            print(f'[CATALOG] SEARCH_BATCH_MS ignored: the {engine.name} engine searches one query at a time')
+    progress['stage'] = None
+    return catalog.Catalog(engine, rows, exact_lookup, lexical_index, embs_arr, store, catalog_csv)
+
+
+def swap_catalog(cat: catalog.Catalog):
+    """Make ``cat`` the catalog new jobs see; jobs already running finish on the old one"""
+    global current_catalog, catalog_swaps
+    old, current_catalog = current_catalog, cat
+    if old is not None:
+        catalog_swaps += 1
+        old.close()
+    print(f'[CATALOG] serving {cat.store_dir or EMB_JSON} ({len(cat.rows)} rows)')
+
+
+def load_catalog() -> catalog.Catalog:
+    """Load the published catalog version, else EMB_STORE/CATALOG_CSV, and serve it (blocking)"""
+    version = catalog_update.current_version(CATALOG_VERSIONS_DIR)
+    if version:
+        cat = build_catalog(version, os.path.join(version, catalog_update.CATALOG_COPY), startup)
+    else:
+        cat = build_catalog(EMB_STORE if os.path.isdir(EMB_STORE) else None, CATALOG_CSV, startup)
+    swap_catalog(cat)
+    startup['state'] = 'ready'
+    print(f'[STARTUP] catalog ready: {len(cat.rows)} rows, {time.monotonic() - STARTED_AT:.2f} s after import')
+    return cat
+
+
+async def warm_up():
+    try:
+        await asyncio.to_thread(load_catalog)
+    except Exception as e:
+        startup.update(state='failed', error=f'{type(e).__name__}: {e}')
+        print(f'[STARTUP] catalog load failed in stage {startup["stage"]}: {e}')
+
+
+async def watch_catalog_versions():
+    """Swap in versions published by catalog_update (from this or any other process)"""
+    while True:
+        await asyncio.sleep(CATALOG_WATCH_S)
+        version = catalog_update.current_version(CATALOG_VERSIONS_DIR)
+        cat = current_catalog
+        if version is None or cat is None or os.path.abspath(version) == os.path.abspath(cat.store_dir or ''):
+            continue
+        try:
+            await asyncio.to_thread(reload_catalog, version)
+        except Exception as e:
+            print(f'[CATALOG] could not load {version}, keeping the current catalog: {e}')
+
+
+def reload_catalog(version: str) -> catalog.Catalog:
+    """Build ``version`` off to the side, then swap it in (blocking)"""
+    with catalog_reload_lock:
+        cat = current_catalog
+        if cat is not None and cat.store_dir and os.path.abspath(cat.store_dir) == os.path.abspath(version):
+            return cat
+        cat = build_catalog(version, os.path.join(version, catalog_update.CATALOG_COPY), {'stage': None, 'stages': {}})
+        swap_catalog(cat)
+        return cat
+
+
+class VersionLoadError(RuntimeError):
+    pass
 
-with open('embs_subset.json') as f:
-# with open('embs.json') as f:
-    embs = json.load(f)
-embs_arr = np.array(embs)
-df = pd.read_csv('df_subset.csv')
-# df = pd.read_csv('df_full.csv')
 
-app = FastAPI()
+def update_catalog(cat: catalog.Catalog, csv_path: str) -> dict:
+    """Diff ``csv_path`` against ``cat``, embed what changed, publish the new version and serve it (blocking)
+
+    The version is loaded here before it is published, so one that cannot be
+    served never reaches CURRENT (and every worker's watcher and restart).
+    """
+    os.makedirs(CATALOG_VERSIONS_DIR, exist_ok=True)
+    version, report = catalog_update.build_version(cat.rows, cat.embeddings, catalog_update.row_hashes(cat.rows, cat.store_dir),
+                                                   csv_path, CATALOG_VERSIONS_DIR, embed_upstream, base_store=cat.store_dir,
+                                                   engine=RETRIEVAL_ENGINE, quant_scales=QUANT_SCALES,
+                                                   prefix_dim=MATRYOSHKA_DIM)
+    try:
+        new = build_catalog(version, os.path.join(version, catalog_update.CATALOG_COPY), {'stage': None, 'stages': {}})
+    except Exception as e:
+        shutil.rmtree(version, ignore_errors=True)
+        raise VersionLoadError(f'{os.path.basename(version)} does not load, not published: {type(e).__name__}: {e}')
+    with catalog_reload_lock:
+        catalog_update.publish(CATALOG_VERSIONS_DIR, version)
+        swap_catalog(new)
+    report['version'] = os.path.basename(version)
+    return report
+
+# Parts whose top vector hit scores at least GATE_THRESHOLD (see gate.py and
+# calibrate_gate.py) are accepted without an LLM call. Unset = always use the LLM.
+GATE_THRESHOLD = float(os.environ['GATE_THRESHOLD']) if os.getenv('GATE_THRESHOLD') else None
+GATE_MARGIN_WEIGHT = float(os.getenv('GATE_MARGIN_WEIGHT', '1.0'))
+
+# Query embedding cache: in-process LRU backed by SQLite (EMBED_CACHE_PATH='' keeps it in memory only)
+EMBED_MODEL = 'text-embedding-3-small'
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'embed_cache.sqlite')
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', '10000'))
+# Rows kept in the SQLite file (least recently used are deleted beyond it; 0 = unbounded).
+# A 1536-dim vector is 6 KiB, so the default caps the file around 300 MiB.
+EMBED_CACHE_DISK_SIZE = int(os.getenv('EMBED_CACHE_DISK_SIZE', '50000'))
+embed_cache = EmbeddingCache(EMBED_CACHE_PATH or None, capacity=EMBED_CACHE_SIZE, disk_capacity=EMBED_CACHE_DISK_SIZE)
+
+# Per-part resolution calls run concurrently on a shared pool; a call slower
+# than RESOLVE_TIMEOUT seconds resolves its part to None
+RESOLVE_CONCURRENCY = int(os.getenv('RESOLVE_CONCURRENCY', '8'))
+RESOLVE_TIMEOUT = float(os.getenv('RESOLVE_TIMEOUT', '15'))
+resolve_executor = ThreadPoolExecutor(max_workers=RESOLVE_CONCURRENCY, thread_name_prefix='resolve')
+# All blocking extraction/matching (live sessions, pasted transcripts, /top)
+# runs here, off the event loop. At most PROCESSING_WORKERS jobs run at once;
+# with PROCESSING_MAX_QUEUE set, jobs beyond that many waiting are rejected.
+PROCESSING_WORKERS = int(os.getenv('PROCESSING_WORKERS', '8'))
+PROCESSING_MAX_QUEUE = int(os.getenv('PROCESSING_MAX_QUEUE', '0'))
+processing_pool = BlockingPool(PROCESSING_WORKERS, PROCESSING_MAX_QUEUE, name='process')
+# Browser audio frames are buffered into upstream appends of at least this many ms
+AUDIO_COALESCE_MS = int(os.getenv('AUDIO_COALESCE_MS', '100'))
+# Optional local voice-activity gate (vad.py): silence and line noise are dropped
+# before audio goes upstream. Keep VAD_HANGOVER_MS above the upstream
+# silence_duration_ms (500) so turns still close.
+LOCAL_VAD = os.getenv('LOCAL_VAD', '0') == '1'
+VAD_ENERGY_DB = float(os.getenv('VAD_ENERGY_DB', '-45'))
+VAD_HANGOVER_MS = int(os.getenv('VAD_HANGOVER_MS', '700'))
+VAD_PREROLL_MS = int(os.getenv('VAD_PREROLL_MS', '300'))
+# "per_part" (one call per part) or "batched" (one call for all parts, per-part fallback)
+RESOLVE_MODE = os.getenv('RESOLVE_MODE', 'per_part')
+
+# Upstream realtime sessions connected and configured ahead of time; a new
+# browser connection takes one instead of waiting for the handshake. Off by
+# default: every worker holds this many open (billed) sessions even with no
+# clients. 0 = connect on demand. Idle sessions are replaced after UPSTREAM_POOL_MAX_IDLE_S.
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '0'))
+UPSTREAM_POOL_MAX_IDLE_S = float(os.getenv('UPSTREAM_POOL_MAX_IDLE_S', '300'))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.upstream_pool = upstream.SessionPool(WS_URL, API_KEY, UPSTREAM_POOL_SIZE, UPSTREAM_POOL_MAX_IDLE_S)
+    app.state.upstream_pool.start()
+    app.state.catalog_update_lock = asyncio.Lock()
+    # The port opens right away; matching answers 503 until the catalog is loaded
+    tasks = [asyncio.create_task(warm_up())]
+    if CATALOG_WATCH_S > 0:
+        tasks.append(asyncio.create_task(watch_catalog_versions()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await app.state.upstream_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ============== WEB UI ==============
 
@@ -292,7 +552,9 @@ async function submitPaste() {
             // Set up message handler for results
             ws.onmessage = (e) => {
                 const msg = JSON.parse(e.data);
-                if (msg.type === 'customer_info') {
+                if (msg.type === 'error') {
+                    alert(msg.message);
+                } else if (msg.type === 'customer_info') {
                     const data = msg.data;
                     if (data.company_name) {
                         document.getElementById('companyNameInput').value = data.company_name;
@@ -439,6 +701,8 @@ async function startRecording() {
             const msg = JSON.parse(e.data);
             if (msg.type === 'transcript') {
                 document.getElementById('transcript').textContent += msg.text;
+            } else if (msg.type === 'error') {
+                alert(msg.message);
             } else if (msg.type === 'customer_info') {
                 const data = msg.data;
                 if (data.company_name) {
@@ -532,9 +796,7 @@ async function startRecording() {
             for (let i = 0; i < float32.length; i++) {
                 int16[i] = Math.max(-32768, Math.min(32767, Math.floor(float32[i] * 32768)));
             }
-            const bytes = new Uint8Array(int16.buffer);
-            const b64 = btoa(String.fromCharCode.apply(null, bytes));
-            ws.send(b64);
+            ws.send(int16.buffer);  // binary PCM16 frame
         };
 
         source.connect(processor);
@@ -570,153 +832,146 @@ async def index():
 @app.websocket("/ws")
 async def websocket_endpoint(browser_ws: WebSocket):
     await browser_ws.accept()
+    if current_catalog is None:
+        # Nothing could be matched yet: tell the client instead of silently dropping parts
+        await browser_ws.send_json({'type': 'error', 'message': f'Catalog not loaded ({startup["state"]}), try again shortly'})
+        await browser_ws.close(code=1013)  # try again later
+        return
 
     openai_ws = None
     stop_flag = threading.Event()
-    transcript_text = []
+    current_utterance = []
     seen_item_ids = set()
-    send_queue = queue.Queue()
-
-    def receive_from_openai():
-        """Thread that receives messages from OpenAI - mirrors realtime.py's receive_messages"""
+    # Messages for the browser; worker threads hand theirs over through the loop
+    outbox = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    extractor = IncrementalExtractor(complete_extraction)
+
+    def send_threadsafe(msg):
+        loop.call_soon_threadsafe(outbox.put_nowait, msg)
+
+    def process_utterances(utterances):
+        """Extract and match one or more completed utterances (coalesced by the worker)"""
+        if stop_flag.is_set():
+            return
         try:
-            while not stop_flag.is_set():
-                try:
-                    message = openai_ws.recv()
-                    if not message:
-                        break
-                    data = json.loads(message)
-                    event_type = data.get('type', '')
-
-                    if event_type == 'session.created':
-                        # Send config exactly like realtime.py
-                        config = {
-                            "type": "session.update",
-                            "session": {
-                                "turn_detection": {
-                                    "type": "server_vad",
-                                    "threshold": 0.5,
-                                    "prefix_padding_ms": 300,
-                                    "silence_duration_ms": 500
-                                },
-                                "input_audio_format": "pcm16",
-                                "input_audio_transcription": {
-                                    "model": "whisper-1"
-                                }
-                            }
-                        }
-                        openai_ws.send(json.dumps(config))
-                        print('OpenAI session configured')
-
-                    elif event_type == 'conversation.item.input_audio_transcription.delta':
-                        delta = data.get('delta', '')
-                        if delta:
-                            transcript_text.append(delta)
-                            send_queue.put({'type': 'transcript', 'text': delta})
-
-                    elif event_type == 'conversation.item.input_audio_transcription.completed':
-                        # Transcription complete - extract customer info and parts
-                        full_transcript = ''.join(transcript_text)
-                        if full_transcript.strip():
-                            try:
-                                extracted_data = extract_transcript_data(full_transcript)
-
-                                # Send customer info if any field is available
-                                if any(extracted_data.get(key) for key in ['company_name', 'associate_name', 'po_number', 'email', 'address']):
-                                    customer_info = {
-                                        'company_name': extracted_data.get('company_name'),
-                                        'associate_name': extracted_data.get('associate_name'),
-                                        'po_number': extracted_data.get('po_number'),
-                                        'email': extracted_data.get('email'),
-                                        'address': extracted_data.get('address')
-                                    }
-                                    send_queue.put({'type': 'customer_info', 'data': customer_info})
-
-                                # Extract and match parts
-                                item_names = extracted_data.get('item_names', [])
-                                if item_names:
-                                    parts = [{'part_name': item['item_name'], 'quantity': item.get('quantity', 1)} for item in item_names]
-                                    matched = call_top(parts)
-                                    new_items = []
-                                    def convert_value(v):
-                                        """Convert numpy/pandas types and NaN to JSON-compatible values"""
-                                        if v is None:
-                                            return None
-                                        # Check if it's a numpy or pandas scalar
-                                        try:
-                                            if np.isscalar(v) and (pd.isna(v) or (isinstance(v, float) and np.isnan(v))):
-                                                return None
-                                        except (TypeError, ValueError):
-                                            pass
-                                        # Convert numpy types to Python native types
-                                        if hasattr(v, 'item'):  # numpy scalar
-                                            return v.item()
-                                        return v
-
-                                    for item in matched:
-                                        if item is not None:
-                                            d = item if isinstance(item, dict) else item.to_dict()
-                                            # Convert NaN to None for JSON compatibility
-                                            d = {k: convert_value(v) for k, v in d.items()}
-                                            # Also convert NaN in cross_sell_suggestions
-                                            if 'cross_sell_suggestions' in d and d['cross_sell_suggestions']:
-                                                d['cross_sell_suggestions'] = [
-                                                    {k: convert_value(v) for k, v in sugg.items()}
-                                                    for sugg in d['cross_sell_suggestions']
-                                                ]
-                                            if d.get('item_id') and d['item_id'] not in seen_item_ids:
-                                                seen_item_ids.add(d['item_id'])
-                                                new_items.append(d)
-                                    if new_items:
-                                        send_queue.put({'type': 'parts', 'items': new_items})
-                            except Exception as e:
-                                print(f'Extract/match error: {e}')
-
-                    elif event_type == 'error':
-                        print(f'OpenAI error: {data}')
-
-                except Exception as e:
-                    if not stop_flag.is_set():
-                        print(f'OpenAI recv error: {e}')
-                    break
+            cat = require_catalog()
+            item_names = extract_utterance(cat, extractor, ' '.join(utterances))
+
+            # Send customer info if any field is available
+            if any(extractor.customer.values()):
+                send_threadsafe({'type': 'customer_info', 'data': dict(extractor.customer)})
+
+            # Match parts the utterance added or changed
+            if item_names:
+                parts = [{'part_name': item['item_name'], 'quantity': item.get('quantity', 1)} for item in item_names]
+                new_items = unseen_items(call_top(parts, cat=cat), seen_item_ids)
+                if new_items:
+                    send_threadsafe({'type': 'parts', 'items': new_items})
+        except Exception as e:
+            print(f'Extract/match error: {e}')
+
+    def process_paste(text):
+        """Extract and match a pasted transcript (runs on the processing pool)"""
+        try:
+            cat = require_catalog()
+            # Extract both customer info and part names
+            extracted_data = extract_transcript_data(cat, text)
+
+            # Send customer info if any field is available
+            if any(extracted_data.get(key) for key in ['company_name', 'associate_name', 'po_number', 'email', 'address']):
+                customer_info = {
+                    'company_name': extracted_data.get('company_name'),
+                    'associate_name': extracted_data.get('associate_name'),
+                    'po_number': extracted_data.get('po_number'),
+                    'email': extracted_data.get('email'),
+                    'address': extracted_data.get('address')
+                }
+                send_threadsafe({'type': 'customer_info', 'data': customer_info})
+
+            # Extract and match parts
+            item_names = extracted_data.get('item_names', [])
+            if item_names:
+                # Convert item_names to part_names format for call_top
+                parts = [{'part_name': item['item_name'], 'quantity': item.get('quantity', 1)} for item in item_names]
+                new_items = unseen_items(call_top(parts, cat=cat), seen_item_ids)
+                if new_items:
+                    send_threadsafe({'type': 'parts', 'items': new_items})
+        except Exception as e:
+            print(f'Paste extract/match error: {e}')
+
+    worker = CoalescingWorker(processing_pool, process_utterances)
+    coalescer = upstream.AudioCoalescer(AUDIO_COALESCE_MS)
+    voice_gate = VoiceGate(energy_db=VAD_ENERGY_DB, hangover_ms=VAD_HANGOVER_MS,
+                           preroll_ms=VAD_PREROLL_MS) if LOCAL_VAD else None
+
+    async def forward_audio(pcm):
+        """Gate (optional), coalesce and send one frame of browser PCM16"""
+        if voice_gate:
+            pcm = voice_gate.process(pcm)
+        chunk = coalescer.add(pcm) if pcm else None
+        if chunk:
+            await upstream.send_audio(openai_ws, chunk)
+
+    async def receive_from_openai():
+        """Forward transcription events from OpenAI as they arrive"""
+        try:
+            async for message in openai_ws:
+                data = json.loads(message)
+                event_type = data.get('type', '')
+
+                if event_type == 'conversation.item.input_audio_transcription.delta':
+                    delta = data.get('delta', '')
+                    if delta:
+                        current_utterance.append(delta)
+                        outbox.put_nowait({'type': 'transcript', 'text': delta})
+
+                elif event_type == 'conversation.item.input_audio_transcription.completed':
+                    # Utterance complete - extract what it adds to the running order
+                    utterance = data.get('transcript') or ''.join(current_utterance)
+                    current_utterance.clear()
+                    if utterance.strip():
+                        # Extraction and matching run on the processing pool so
+                        # the event loop keeps forwarding transcript deltas
+                        try:
+                            worker.submit(utterance)
+                        except PoolFull:
+                            print('Processing queue full, utterance deferred to the next one')
+
+                elif event_type == 'error':
+                    print(f'OpenAI error: {data}')
+        except Exception as e:
+            if not stop_flag.is_set():
+                print(f'OpenAI recv error: {e}')
         finally:
             print('OpenAI receiver stopped')
 
     async def send_to_browser():
-        """Send queued messages to browser"""
-        import asyncio
-        while not stop_flag.is_set():
+        """Send queued messages to browser as soon as they are queued"""
+        while True:
+            msg = await outbox.get()
             try:
-                while not send_queue.empty():
-                    msg = send_queue.get_nowait()
-                    await browser_ws.send_json(msg)
-            except:
-                pass
-            await asyncio.sleep(0.05)
+                await browser_ws.send_json(msg)
+            except Exception:
+                return
 
+    tasks = []
     try:
-        # Connect to OpenAI exactly like realtime.py
-        openai_ws = websocket.create_connection(
-            WS_URL,
-            header=[
-                f'Authorization: Bearer {API_KEY}',
-                'OpenAI-Beta: realtime=v1'
-            ]
-        )
+        openai_ws = await app.state.upstream_pool.acquire()
         print('Connected to OpenAI')
-
-        # Start receiver thread
-        recv_thread = threading.Thread(target=receive_from_openai, daemon=True)
-        recv_thread.start()
-
-        # Start sender task
-        import asyncio
-        send_task = asyncio.create_task(send_to_browser())
+        tasks = [asyncio.create_task(receive_from_openai()), asyncio.create_task(send_to_browser())]
 
         # Receive audio from browser and forward to OpenAI
         while True:
             try:
-                data = await browser_ws.receive_text()
+                message = await browser_ws.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('bytes') is not None:
+                    # Binary frame: raw PCM16
+                    await forward_audio(message['bytes'])
+                    continue
+                data = message.get('text') or ''
 
                 # Try to parse as JSON (paste_transcript)
                 try:
@@ -725,66 +980,17 @@ async def websocket_endpoint(browser_ws: WebSocket):
                         text = msg.get('text', '')
                         if text:
                             print(f'[PASTED] {text}')
-
-                            # Extract both customer info and part names
-                            extracted_data = extract_transcript_data(text)
-
-                            # Send customer info if any field is available
-                            if any(extracted_data.get(key) for key in ['company_name', 'associate_name', 'po_number', 'email', 'address']):
-                                customer_info = {
-                                    'company_name': extracted_data.get('company_name'),
-                                    'associate_name': extracted_data.get('associate_name'),
-                                    'po_number': extracted_data.get('po_number'),
-                                    'email': extracted_data.get('email'),
-                                    'address': extracted_data.get('address')
-                                }
-                                send_queue.put({'type': 'customer_info', 'data': customer_info})
-
-                            # Extract and match parts
-                            item_names = extracted_data.get('item_names', [])
-                            if item_names:
-                                # Convert item_names to part_names format for call_top
-                                parts = [{'part_name': item['item_name'], 'quantity': item.get('quantity', 1)} for item in item_names]
-                                matched = call_top(parts)
-                                new_items = []
-
-                                def convert_value(v):
-                                    if v is None:
-                                        return None
-                                    try:
-                                        if np.isscalar(v) and (pd.isna(v) or (isinstance(v, float) and np.isnan(v))):
-                                            return None
-                                    except (TypeError, ValueError):
-                                        pass
-                                    if hasattr(v, 'item'):
-                                        return v.item()
-                                    return v
-
-                                for item in matched:
-                                    if item is not None:
-                                        d = item if isinstance(item, dict) else item.to_dict()
-                                        d = {k: convert_value(v) for k, v in d.items()}
-                                        if 'cross_sell_suggestions' in d and d['cross_sell_suggestions']:
-                                            d['cross_sell_suggestions'] = [
-                                                {k: convert_value(v) for k, v in sugg.items()}
-                                                for sugg in d['cross_sell_suggestions']
-                                            ]
-                                        if d.get('item_id') and d['item_id'] not in seen_item_ids:
-                                            seen_item_ids.add(d['item_id'])
-                                            new_items.append(d)
-                                if new_items:
-                                    send_queue.put({'type': 'parts', 'items': new_items})
+                            # Runs on the processing pool; audio keeps flowing meanwhile
+                            try:
+                                processing_pool.submit(process_paste, text)
+                            except PoolFull:
+                                print('Processing queue full, paste dropped')
                         continue
                 except (json.JSONDecodeError, ValueError):
                     pass
 
-                # Otherwise treat as base64 PCM16 audio
-                audio_bytes = base64.b64decode(data)
-                encoded = base64.b64encode(audio_bytes).decode('utf-8')
-                openai_ws.send(json.dumps({
-                    'type': 'input_audio_buffer.append',
-                    'audio': encoded
-                }))
+                # Otherwise treat as base64 PCM16 audio (text clients)
+                await forward_audio(base64.b64decode(data))
             except Exception as e:
                 # Silently break on disconnect - this is normal when client closes connection
                 break
@@ -793,16 +999,33 @@ async def websocket_endpoint(browser_ws: WebSocket):
         print(f'WebSocket error: {e}')
     finally:
         stop_flag.set()
+        tail = coalescer.flush()
+        if openai_ws and tail:
+            # The last < AUDIO_COALESCE_MS of speech, still waiting for more frames
+            try:
+                await upstream.send_audio(openai_ws, tail)
+            except Exception:
+                pass
+        for task in tasks:
+            task.cancel()
+        print(f'Audio: {coalescer.frames} browser frames sent as {coalescer.chunks} upstream appends')
+        if voice_gate:
+            vad_stats = voice_gate.stats()
+            print(f'VAD: suppressed {vad_stats["suppressed"]:.1%} of audio, saved {vad_stats["bytes_saved"]} bytes')
         if openai_ws:
             try:
-                openai_ws.close()
-            except:
+                await openai_ws.close()
+            except Exception:
                 pass
         print('Connection closed')
 
 
-def extract_transcript_data(transcript: str):
+def extract_transcript_data(cat: catalog.Catalog, transcript: str):
     """Extract both customer info and part names from transcript"""
+    if cat.exact.lookup_utterance(transcript) is not None:
+        # The whole utterance is an item id or multi-word catalog description: no LLM needed
+        return {"company_name": None, "associate_name": None, "po_number": None, "email": None, "address": None,
+                "item_names": [{"item_name": transcript.strip(), "quantity": 1}]}
     try:
         response = client.chat.completions.create(
             model="gpt-4o-mini-2024-07-18",
@@ -834,42 +1057,124 @@ Leave customer fields as null if not mentioned. If no items found, item_names is
         return {"company_name": None, "associate_name": None, "po_number": None, "email": None, "address": None, "item_names": []}
 
 
-def call_top(parts_with_qty: list, k: int = 10):
-    """Call the top matching logic with part names and quantities"""
+def extract_utterance(cat: catalog.Catalog, extractor: IncrementalExtractor, utterance: str):
+    """Merge one utterance into the session's running order; returns the items it added or changed"""
+    if cat.exact.lookup_utterance(utterance) is not None:
+        # The whole utterance is an item id or multi-word catalog description: no LLM needed
+        return extractor.merge({'item_names': [{'item_name': utterance.strip(), 'quantity': 1}]})
+    changed = extractor.update(utterance)
+    print(f'[EXTRACTED] {extractor.summary()}')
+    return changed
+
+
+def complete_extraction(messages: list) -> str:
+    return client.chat.completions.create(
+        model="gpt-4o-mini-2024-07-18",
+        messages=messages,
+    ).choices[0].message.content
+
+
+def convert_value(v):
+    """Convert numpy/pandas types and NaN to JSON-compatible values"""
+    if v is None:
+        return None
+    # Check if it's a numpy or pandas scalar
+    try:
+        if np.isscalar(v) and (pd.isna(v) or (isinstance(v, float) and np.isnan(v))):
+            return None
+    except (TypeError, ValueError):
+        pass
+    # Convert numpy types to Python native types
+    if hasattr(v, 'item'):  # numpy scalar
+        return v.item()
+    return v
+
+
+def unseen_items(matched: list, seen_item_ids: set) -> list:
+    """JSON-ready matched rows whose item_id this session has not sent yet"""
+    new_items = []
+    for item in matched:
+        if item is not None:
+            d = item if isinstance(item, dict) else item.to_dict()
+            # Convert NaN to None for JSON compatibility
+            d = {k: convert_value(v) for k, v in d.items()}
+            # Also convert NaN in cross_sell_suggestions
+            if 'cross_sell_suggestions' in d and d['cross_sell_suggestions']:
+                d['cross_sell_suggestions'] = [
+                    {k: convert_value(v) for k, v in sugg.items()}
+                    for sugg in d['cross_sell_suggestions']
+                ]
+            if d.get('item_id') and d['item_id'] not in seen_item_ids:
+                seen_item_ids.add(d['item_id'])
+                new_items.append(d)
+    return new_items
+
+
+def call_top(parts_with_qty: list, k: int = 10, cat: catalog.Catalog | None = None):
+    """Call the top matching logic with part names and quantities (against ``cat``, default the current catalog)"""
     import random
 
+    cat = cat or require_catalog()
+    rows = cat.rows
+
     # Extract just the part names for embedding
     item_names = [p['part_name'] for p in parts_with_qty]
     quantities = [p.get('quantity', 1) for p in parts_with_qty]
 
-    embs_query = np.array(embed(item_names)).T
-    scores = embs_arr @ embs_query
-    top_indices = np.argpartition(scores, -k, axis=0)[-k:]
-    prompts = [map_results_to_resolution_prompt(top_indices[:, i].tolist(), item_names[i])
-               for i in range(len(item_names))]
-    responses = [client.chat.completions.create(
-        model='gpt-4o-mini',
-        messages=[{'role': 'system', 'content': prompt}]
-    ).choices[0].message.content for prompt in prompts]
-    postprocessed = [try_parse_int(z) for z in responses]
-    indices_in_df = [int(top_indices[z, i]) if z is not None else None
-                     for i, z in enumerate(postprocessed)]
-    matched_df_rows = [df.iloc[z] if z is not None else None for z in indices_in_df]
+    indices_in_df = [None] * len(item_names)
+    resolved_by = [None] * len(item_names)
+
+    # Item ids and descriptions read out verbatim resolve without any network call
+    for i, name in enumerate(item_names):
+        hit = cat.exact.lookup(name)
+        if hit is not None:
+            indices_in_df[i], resolved_by[i] = hit
+    searched = [i for i in range(len(item_names)) if resolved_by[i] is None]
+
+    candidate_ixs = {}
+    if searched:
+        embs_query = np.array(embed([item_names[i] for i in searched]), dtype=np.float32)
+        top_indices, top_scores = cat.engine.search(embs_query, max(k, HYBRID_DEPTH) if cat.lexical else k)
+        for row, i in enumerate(searched):
+            # Approximate engines pad with -1 when they find fewer than k candidates
+            candidate_ixs[i] = [ix for ix in top_indices[row].tolist() if ix >= 0]
+            if GATE_THRESHOLD is None or not candidate_ixs[i]:
+                continue
+            top2 = float(top_scores[row, 1]) if top_scores.shape[1] > 1 else float('-inf')
+            confidence = gate.score(item_names[i], rows.value(candidate_ixs[i][0], 'description'),
+                                    float(top_scores[row, 0]), top2, margin_weight=GATE_MARGIN_WEIGHT)
+            if confidence >= GATE_THRESHOLD:
+                indices_in_df[i] = candidate_ixs[i][0]
+                resolved_by[i] = 'gate'
+
+    to_resolve = [i for i in searched if resolved_by[i] is None]
+    if cat.lexical:
+        for i in to_resolve:
+            candidate_ixs[i] = lexical.rrf([candidate_ixs[i], cat.lexical.search(item_names[i], HYBRID_DEPTH)[0].tolist()], k)
+    if to_resolve:
+        postprocessed = resolve_candidates([candidate_ixs[i] for i in to_resolve], [item_names[i] for i in to_resolve],
+                                           rows)
+        for i, z in zip(to_resolve, postprocessed):
+            if z is not None and 0 <= z < len(candidate_ixs[i]):
+                indices_in_df[i] = candidate_ixs[i][z]
+                resolved_by[i] = 'llm'
+    matched_df_rows = [rows.row(z) if z is not None else None for z in indices_in_df]
 
     # Add quantity and cross/upsell suggestions to each matched row
     result = []
-    for part_name, row, qty in zip(item_names, matched_df_rows, quantities):
+    for part_name, row, qty, how in zip(item_names, matched_df_rows, quantities, resolved_by):
         if row is not None:
             row_dict = row.to_dict() if hasattr(row, 'to_dict') else row
             row_dict['part_name'] = part_name  # Original transcript part name
             row_dict['quantity'] = qty
+            row_dict['resolved_by'] = how
 
             # Generate cross/upsell suggestions: 2-5 random parts
             num_suggestions = random.randint(2, 5)
-            random_indices = np.random.choice(len(df), size=num_suggestions, replace=False)
+            random_indices = np.random.choice(len(rows), size=num_suggestions, replace=False)
             cross_sell_rows = []
             for idx in random_indices:
-                sugg_row = df.iloc[idx]
+                sugg_row = rows.row(idx)
                 sugg_dict = sugg_row.to_dict() if hasattr(sugg_row, 'to_dict') else sugg_row
                 cross_sell_rows.append(sugg_dict)
             row_dict['cross_sell_suggestions'] = cross_sell_rows
@@ -888,17 +1193,99 @@ def call_top(parts_with_qty: list, k: int = 10):
 async def top_endpoint(item_names: List[str], k: int = 10):
     # Convert to new format with default quantities
     parts = [{"part_name": name, "quantity": 1} for name in item_names]
-    return call_top(parts, k)
+    try:
+        cat = require_catalog()
+    except CatalogNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '5'})
+    try:
+        return await processing_pool.run(call_top, parts, k, cat)
+    except PoolFull:
+        raise HTTPException(status_code=503, detail='processing queue full')
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving. A failed catalog load shows on /readyz, not here,
+    so an orchestrator does not restart a process into the same failure"""
+    return {'status': 'ok'}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the catalog, embeddings and indexes are loaded, 503 with progress until then"""
+    # pid tells the workers of `uvicorn --workers N` apart behind the shared port
+    body = {**startup, 'uptime_s': round(time.monotonic() - STARTED_AT, 3), 'pid': os.getpid()}
+    if current_catalog is not None:
+        body.update(rows=len(current_catalog.rows), catalog=current_catalog.store_dir or EMB_JSON, swaps=catalog_swaps)
+    return JSONResponse(body, status_code=200 if startup['state'] == 'ready' else 503)
+
+
+@app.post("/catalog/update")
+async def catalog_update_endpoint(request: Request):
+    """Body: the new catalog CSV. Embeds only new or changed descriptions, then swaps the catalog in"""
+    try:
+        cat = require_catalog()
+    except CatalogNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '5'})
+    if app.state.catalog_update_lock.locked():
+        raise HTTPException(status_code=409, detail='a catalog update is already running')
+    async with app.state.catalog_update_lock:
+        os.makedirs(CATALOG_VERSIONS_DIR, exist_ok=True)
+        path = os.path.join(CATALOG_VERSIONS_DIR, f'incoming-{os.getpid()}.csv')
+        with open(path, 'wb') as f:
+            f.write(await request.body())
+        try:
+            return await asyncio.to_thread(update_catalog, cat, path)
+        except (KeyError, ValueError) as e:
+            # Missing item_id/description columns or an unparseable CSV
+            raise HTTPException(status_code=400, detail=f'{type(e).__name__}: {e}')
+        except VersionLoadError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            os.remove(path)
+
+
+@app.get("/stats")
+async def stats_endpoint():
+    return {'embed_cache': embed_cache.stats(), 'processing': processing_pool.stats(),
+            'upstream_pool': app.state.upstream_pool.stats()}
 
 
 def embed(lst: List[str]):
+    return embed_cache.get_many(lst, EMBED_MODEL, embed_upstream)
+
+
+def embed_upstream(lst: List[str]):
     response = client.embeddings.create(
-        model='text-embedding-3-small',
+        model=EMBED_MODEL,
         input=lst,
     )
     return [z.embedding for z in response.data]
 
 
+def resolve_candidates(candidate_ixs: List[List[int]], item_names: List[str], rows: catalog.RowStore) -> List[int | None]:
+    """Index into each part's candidate list chosen by the LLM, or None"""
+    if RESOLVE_MODE == 'batched' and len(item_names) > 1:
+        try:
+            prompt = map_results_to_batched_resolution_prompt(candidate_ixs, item_names, rows)
+            return resolver.parse_batched(complete_resolution(prompt, json_object=True), len(item_names))
+        except Exception as e:
+            print(f'Batched resolution failed, falling back to per-part calls: {e}')
+    prompts = [map_results_to_resolution_prompt(ixs, name, rows) for ixs, name in zip(candidate_ixs, item_names)]
+    responses = resolver.resolve_all(prompts, complete_resolution, resolve_executor, RESOLVE_TIMEOUT)
+    return [try_parse_int(z) for z in responses]
+
+
+def complete_resolution(prompt: str, json_object: bool = False) -> str:
+    extra = {'response_format': {'type': 'json_object'}} if json_object else {}
+    return client.chat.completions.create(
+        model='gpt-4o-mini',
+        messages=[{'role': 'system', 'content': prompt}],
+        timeout=RESOLVE_TIMEOUT,
+        **extra,
+    ).choices[0].message.content
+
+
 def try_parse_int(s: str) -> int | None:
     try:
         return int(s)
@@ -906,13 +1293,12 @@ def try_parse_int(s: str) -> int | None:
         return None
 
 
-def map_results_to_resolution_prompt(row_of_ixs: List[int], item_name: str):
-    prompt = f"""We are a manufacturing automation business. We extracted that the customer asked for "{item_name}". We cosine similarity matched it to the following top items:
+def map_results_to_resolution_prompt(row_of_ixs: List[int], item_name: str, rows: catalog.RowStore):
+    return resolver.resolution_prompt(rows.candidates_json(row_of_ixs), item_name)
 
-    {df.iloc[row_of_ixs].reset_index(drop=True).reset_index().to_json(orient='records',indent=4)}
 
-    If one of them are what the user asked for, output its index as an int, 0-9. Otherwise, output the string "NONE". E.g., the user could have said "two-and-a-half inch fire lock T", and that would match "2 1/2 FIRELOCK TEE", so if it had index=5, you would output 5. Please don't output an index unless there is a strong semantic match. Other examples: query "three-quarter inch chrome up cut chin" would match "3/4 Chrome Cup 401 Escutcheon" because they sound the same (transcription isn't perfect), query "half-inch gate valve whole part" would match "1/2 BRZ GATE VLV TE FULL PRT". One bug that you run into is matching user query "b" to part name "2 1\\/2 FIRELOCK TEE", which doesn't make sense, don't do that. Another false positive you made was that the user said "any free system 6x2" and you matched "SIGN - BLANK 6 X 2", nice job on the 6x2 but the rest doesn't match enough. Here is another error that you made. The transcript said "I want an antifreeze system, six by two. I want two antifreeze systems, five by seven" and you extracted part_name=antifreeze system quantity=2 and part_name=antifreeze system quantity=1, but really you should have included the 6X2 and 5X7 in the part names. Here's another error, the transcript said "I wonder if I can have...21 over 2 inch, 2000 SS, LF, Aussie, FXG", though that was the customer trying to describe 21/2" 2000SS LF OSY FXG, so as you can see, the transcript will often include commas in between words, because part numbers are compound, and unlike normal language, but you should look past this, and if a series of words with commas in between looks like it should be one part, try to only extract one part.
-    """
-    return prompt
+def map_results_to_batched_resolution_prompt(rows_of_ixs: List[List[int]], item_names: List[str],
+                                             rows: catalog.RowStore):
+    return resolver.batched_resolution_prompt([rows.candidates_json(ixs) for ixs in rows_of_ixs], item_names)
 # Sample: Hi could I get four 11 quarter inch double check backflow less valves? I'm Reed calling from ABC Supply. Order number 1920219052190, reed@abc.co.uk, 775 Surrey Lane, London UK. Also three 11 over 4 double check quart FZs.
 # Sample: Hi, how are you?Hi, can I get four 11 1⁄4-inch double check backflow-less valves?أنا ريدMy name is Reid.I'm calling from ABC Supply.Yeah, I'm talking about order number 1920-2190-52-190.Yeah, email is reid.abc.co.uk and I'm at 775 Surrey Lane in London, UK.Could I also get three 11 over four double check court FZs?
\ No newline at end of file
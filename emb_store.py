@@ -0,0 +1,183 @@
+"""Binary, memory-mapped store for catalog embeddings.
+
+A store is a directory holding contiguous float32 rows (``embs.f32``) and a
+``manifest.json`` describing them:
+
+    {"version": 1, "dtype": "float32", "rows": 69363, "dim": 1536,
+     "data": "embs.f32", "catalog_csv": "df_full.csv", "catalog_sha256": "..."}
+
+Opening a store maps the file read-only, so loading is near-instant and every
+process that opens the same store shares the same page-cache pages.
+
+Convert an existing embs.json/df_full.csv pair with:
+
+    python emb_store.py embs.json df_full.csv embs_full.store
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+DATA_FILE = 'embs.f32'
+STORE_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(store_dir: str) -> dict:
+    with open(os.path.join(store_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def write_manifest(store_dir: str, manifest: dict):
+    replace_file(os.path.join(store_dir, MANIFEST), lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+
+def replace_file(path: str, write):
+    """Call ``write(f)`` on ``path + '.tmp'`` (opened 'wb'), then rename it over ``path``.
+
+    Store files are memory-mapped by running servers. Rewriting one in place
+    truncates their mapping (SIGBUS); after a rename they keep the old inode.
+    """
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def save_array(path: str, array: np.ndarray):
+    """``np.save`` through ``replace_file``."""
+    replace_file(path, lambda f: np.save(f, array))
+
+
+def write_store(store_dir: str, rows, dim: int, n_rows: int, catalog_csv: str) -> dict:
+    """Write ``n_rows`` embedding rows of width ``dim`` as float32 and the manifest.
+
+    ``rows`` may be any iterable of row vectors, so callers can stream rows
+    without materialising the whole matrix in memory.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    data_path = os.path.join(store_dir, DATA_FILE)
+    tmp_path = data_path + '.tmp'
+    mm = np.memmap(tmp_path, dtype=np.float32, mode='w+', shape=(n_rows, dim))
+    try:
+        written = 0
+        for i, row in enumerate(rows):
+            if i >= n_rows:
+                raise ValueError(f'More than {n_rows} embedding rows')
+            if len(row) != dim:
+                raise ValueError(f'Row {i} has dimension {len(row)}, expected {dim}')
+            mm[i] = row
+            written += 1
+        if written != n_rows:
+            raise ValueError(f'Expected {n_rows} embedding rows, got {written}')
+        mm.flush()
+    except BaseException:
+        del mm
+        os.remove(tmp_path)
+        raise
+    del mm
+    os.replace(tmp_path, data_path)
+
+    manifest = {
+        'version': STORE_VERSION,
+        'dtype': 'float32',
+        'rows': n_rows,
+        'dim': dim,
+        'data': DATA_FILE,
+        'catalog_csv': os.path.basename(catalog_csv),
+        'catalog_sha256': file_sha256(catalog_csv),
+    }
+    write_manifest(store_dir, manifest)
+    return manifest
+
+
+def open_store(store_dir: str, catalog_csv: str | None = None) -> np.memmap:
+    """Map a store read-only as a (rows, dim) float32 matrix.
+
+    If ``catalog_csv`` is given, its hash must match the one recorded when the
+    store was built, otherwise row ``i`` of the matrix would not describe row
+    ``i`` of the catalog.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest.get('version') != STORE_VERSION:
+        raise ValueError(f'Unsupported store version {manifest.get("version")} in {store_dir}')
+    if catalog_csv is not None:
+        sha = file_sha256(catalog_csv)
+        if sha != manifest['catalog_sha256']:
+            raise ValueError(f'{catalog_csv} does not match the catalog {store_dir} was built from '
+                             f'({manifest["catalog_csv"]})')
+    return np.memmap(os.path.join(store_dir, manifest['data']), dtype=np.float32, mode='r',
+                     shape=(manifest['rows'], manifest['dim']))
+
+
+def iter_json_rows(path: str):
+    """Yield rows of a JSON list-of-lists one at a time.
+
+    Avoids holding every row as Python floats at once, which is what makes
+    ``json.load`` on the full embs.json peak at several GB.
+    """
+    with open(path) as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    pos = text.index('[') + 1
+    n = len(text)
+    while True:
+        while pos < n and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= n or text[pos] == ']':
+            return
+        row, pos = decoder.raw_decode(text, pos)
+        yield np.asarray(row, dtype=np.float32)
+
+
+def count_csv_rows(path: str) -> int:
+    import pandas as pd
+    return len(pd.read_csv(path, usecols=[0]))
+
+
+def convert(embs_json: str, catalog_csv: str, store_dir: str) -> dict:
+    n_csv = count_csv_rows(catalog_csv)
+    rows = iter_json_rows(embs_json)
+    first = next(rows, None)
+    if first is None:
+        raise ValueError(f'{embs_json} contains no embeddings')
+
+    def all_rows():
+        yield first
+        yield from rows
+
+    # write_store raises if the JSON has more or fewer rows than the CSV
+    return write_store(store_dir, all_rows(), len(first), n_csv, catalog_csv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert embs.json + catalog CSV into a binary embedding store')
+    parser.add_argument('embs_json')
+    parser.add_argument('catalog_csv')
+    parser.add_argument('store_dir')
+    args = parser.parse_args(argv)
+    try:
+        manifest = convert(args.embs_json, args.catalog_csv, args.store_dir)
+    except ValueError as e:
+        sys.exit(f'error: {e}')
+    print(f'Wrote {manifest["rows"]} x {manifest["dim"]} float32 rows to {args.store_dir}')
+
+
+if __name__ == '__main__':
+    main()
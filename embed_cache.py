@@ -0,0 +1,149 @@
+"""Two-level cache in front of the embeddings API.
+
+Level 1 is an in-process LRU, level 2 a SQLite table that survives restarts.
+Both are keyed by (model, normalized text), where normalization collapses
+whitespace and case-folds, so "Gate  Valve" and "gate valve" share an entry.
+Only texts missing from both levels go upstream, de-duplicated and sent in a
+single batched request.
+
+The SQLite level is bounded too: beyond ``disk_capacity`` rows, the least
+recently used ones are deleted (a disk hit counts as a use).
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.split()).casefold()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str | None = None, capacity: int = 10000, disk_capacity: int = 50000):
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity  # 0 = unbounded
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_rows = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                             'model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, '
+                             'used REAL NOT NULL DEFAULT 0, PRIMARY KEY (model, text))')
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(embeddings)')]
+            if 'used' not in columns:  # file written before the disk level was bounded
+                self._db.execute('ALTER TABLE embeddings ADD COLUMN used REAL NOT NULL DEFAULT 0')
+            self._db.execute('CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)')
+            self._db.commit()
+            self._disk_rows = self._count_disk()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.upstream_calls = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._lru),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_size': self._count_disk() if self._db is not None else None,
+                'disk_capacity': self.disk_capacity if self._db is not None else None,
+                'disk_evictions': self.disk_evictions,
+                'upstream_calls': self.upstream_calls,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+    def _remember(self, key, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    def _count_disk(self) -> int:
+        # Other workers may share the file, so count rather than track
+        return self._db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def _prune_disk(self):
+        """Delete the least recently used rows beyond ``disk_capacity``."""
+        if not self.disk_capacity or self._disk_rows <= self.disk_capacity:
+            return
+        self._disk_rows = self._count_disk()
+        excess = self._disk_rows - self.disk_capacity
+        if excess > 0:
+            self._db.execute('DELETE FROM embeddings WHERE rowid IN '
+                             '(SELECT rowid FROM embeddings ORDER BY used LIMIT ?)', (excess,))
+            self.disk_evictions += excess
+            self._disk_rows -= excess
+
+    def _read_disk(self, model: str, texts: List[str]) -> dict:
+        if self._db is None or not texts:
+            return {}
+        found = {}
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(texts), 500):
+            chunk = texts[start:start + 500]
+            rows = self._db.execute(
+                f'SELECT text, vector FROM embeddings WHERE model = ? AND text IN ({",".join("?" * len(chunk))})',
+                [model, *chunk]).fetchall()
+            found.update((text, np.frombuffer(blob, dtype=np.float32)) for text, blob in rows)
+        if found:
+            self._db.executemany('UPDATE embeddings SET used = ? WHERE model = ? AND text = ?',
+                                 [(time.time(), model, text) for text in found])
+            self._db.commit()
+        return found
+
+    def get_many(self, texts: List[str], model: str, fetch: Callable[[List[str]], list]) -> List[np.ndarray]:
+        """Embeddings for ``texts`` in order; ``fetch`` is called once with the misses."""
+        keys = [normalize_text(t) for t in texts]
+        result = {}
+        with self._lock:
+            for key in keys:
+                vector = self._lru.get((model, key))
+                if vector is not None:
+                    self._lru.move_to_end((model, key))
+                    result[key] = vector
+            # Count per requested text, not per distinct key
+            self.hits += sum(1 for key in keys if key in result)
+            missing = list(dict.fromkeys(key for key in keys if key not in result))
+            from_disk = self._read_disk(model, missing)
+            for key, vector in from_disk.items():
+                self._remember((model, key), vector)
+            result.update(from_disk)
+            self.disk_hits += sum(1 for key in keys if key in from_disk)
+
+        upstream = [key for key in missing if key not in from_disk]
+        if upstream:
+            # Send the caller's original spelling of each missing text
+            originals = {}
+            for text, key in zip(texts, keys):
+                originals.setdefault(key, text)
+            vectors = [np.asarray(v, dtype=np.float32) for v in fetch([originals[key] for key in upstream])]
+            upstream_keys = set(upstream)
+            with self._lock:
+                self.upstream_calls += 1
+                self.misses += sum(1 for key in keys if key in upstream_keys)
+                for key, vector in zip(upstream, vectors):
+                    self._remember((model, key), vector)
+                    result[key] = vector
+                if self._db is not None:
+                    now = time.time()
+                    self._db.executemany('INSERT OR REPLACE INTO embeddings (model, text, vector, used) '
+                                         'VALUES (?, ?, ?, ?)',
+                                         [(model, key, vector.tobytes(), now) for key, vector in zip(upstream, vectors)])
+                    self._disk_rows += len(upstream)
+                    self._prune_disk()
+                    self._db.commit()
+        return [result[key] for key in keys]
@@ -0,0 +1,373 @@
+"""Embed a catalog CSV into a binary store: concurrent, rate-adaptive and resumable.
+
+The notebook embedded the catalog with one 1024-row request at a time and
+dumped one JSON file at the end, so any failure lost everything. Instead:
+
+    python embed_catalog.py df_full.csv embs_full.store --concurrency 8 --batch 256
+
+- Each distinct description is sent once, in ``--batch``-row requests with
+  up to ``--concurrency`` in flight. ``AdaptiveLimiter`` halves the
+  in-flight cap on a 429, holds new requests until Retry-After has passed,
+  and grows the cap back as requests succeed.
+- 429, 5xx, timeouts and connection errors are retried with exponential
+  backoff, up to ``--retries`` times per request.
+- Every ``--checkpoint-every`` batches, finished vectors are appended and
+  fsynced to ``<store>/checkpoint/``: float32 rows in the store's layout
+  plus their description hashes. Rerunning the same command resumes there.
+- Descriptions whose hash is already embedded are not sent again. That
+  covers the checkpoint, the store being replaced and any ``--reuse``
+  stores.
+
+The result is the usual emb_store layout plus ``hashes.npy``, which
+catalog_update.py diffs against. Any ``catalog/`` sidecar or vector index
+already in the store is rebuilt for the new matrix. The new store is written
+to ``<store>.tmp`` and renamed into place, so servers mapping the old one are
+not affected.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import catalog
+import emb_store
+import retrieval
+from catalog_update import HASHES_FILE, read_catalog_csv
+from http_pool import RETRY_STATUSES, HTTPPool, HTTPStatusError
+
+CHECKPOINT_DIR = 'checkpoint'
+EMBED_MODEL = 'text-embedding-3-small'
+
+
+class AdaptiveLimiter:
+    """Cap on requests in flight that backs off when the API rate-limits (AIMD).
+
+    A 429 halves the cap, at most once per ``decrease_interval`` since a burst
+    of in-flight requests tends to be rejected together. New requests are then
+    held until the Retry-After has passed. Every success adds ``1/cap``, so one
+    cap's worth of successes opens one more slot, up to ``max_inflight``. For
+    ``hold`` seconds after a decrease the cap does not grow, so the limiter
+    does not keep probing (and pausing for) a limit it has just found.
+    """
+
+    def __init__(self, max_inflight: int, decrease_interval: float = 1.0, hold: float = 10.0):
+        self.max_inflight = max_inflight
+        self.decrease_interval = decrease_interval
+        self.hold = hold
+        self.limit = float(max_inflight)
+        self.inflight = 0
+        self.throttles = 0
+        self._resume_at = 0.0
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._resume_at - time.monotonic()
+                if wait <= 0 and self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    def release(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def succeeded(self):
+        with self._cond:
+            if time.monotonic() - self._last_decrease >= self.hold:
+                self.limit = min(float(self.max_inflight), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def throttled(self, retry_after: float | None):
+        with self._cond:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+            if retry_after:
+                self._resume_at = max(self._resume_at, now + retry_after)
+
+
+class Checkpoint:
+    """Append-only log of finished (description hash, vector) pairs.
+
+    ``embs.f32`` holds float32 rows, ``hashes.u64`` the matching hashes and
+    ``meta.json`` the model and width. Vectors are written before their
+    hashes, so a crash mid-append leaves at most a tail with no hash. That
+    tail is cut off when the checkpoint is reopened.
+    """
+
+    def __init__(self, path: str, model: str, dim: int):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        meta_path = os.path.join(path, 'meta.json')
+        meta = {'model': model, 'dim': dim}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                found = json.load(f)
+            if found != meta:
+                raise ValueError(f'Checkpoint in {path} is for {found}, not {meta}; rerun with --restart')
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        self._vectors_path = os.path.join(path, 'embs.f32')
+        self._hashes_path = os.path.join(path, 'hashes.u64')
+        rows = min(self._size(self._vectors_path) // (4 * dim), self._size(self._hashes_path) // 8)
+        for file_path, row_bytes in ((self._vectors_path, 4 * dim), (self._hashes_path, 8)):
+            with open(file_path, 'ab') as f:
+                f.truncate(rows * row_bytes)
+        self.rows = rows
+        self._vectors = open(self._vectors_path, 'ab')
+        self._hashes = open(self._hashes_path, 'ab')
+
+    @staticmethod
+    def _size(path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def entries(self):
+        """(hashes, vectors) written so far; vectors are memory-mapped."""
+        if not self.rows:
+            return np.empty(0, dtype=np.uint64), np.empty((0, self.dim), dtype=np.float32)
+        return (np.fromfile(self._hashes_path, dtype=np.uint64, count=self.rows),
+                np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self.rows, self.dim)))
+
+    def append(self, hashes: np.ndarray, vectors: np.ndarray):
+        self._vectors.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._hashes.write(np.ascontiguousarray(hashes, dtype=np.uint64).tobytes())
+        self.rows += len(hashes)
+
+    def flush(self):
+        for f in (self._vectors, self._hashes):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        self._vectors.close()
+        self._hashes.close()
+
+
+class Embedder:
+    """Batched requests to an OpenAI-compatible /embeddings endpoint, several in flight."""
+
+    def __init__(self, base_url: str, api_key: str | None, model: str = EMBED_MODEL, concurrency: int = 8,
+                 batch_size: int = 256, retries: int = 6, backoff: float = 0.5, timeout: float = 120.0):
+        self.model = model
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+        # Retries live here rather than in the pool, so 429s can reach the limiter
+        self.http = HTTPPool(base_url, size=concurrency, read_timeout=timeout, retries=0, log=False)
+        self.limiter = AdaptiveLimiter(concurrency)
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='embed')
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+
+    def embed_batch(self, texts: list) -> np.ndarray:
+        """One request for ``texts``, retried; raises the last error once retries run out."""
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            self.limiter.acquire()
+            try:
+                with self._lock:
+                    self.requests += 1
+                # base64 float32 instead of JSON numbers: parsing floats cost more CPU than the rest together
+                body = self.http.post_json('/embeddings', {'model': self.model, 'input': texts,
+                                                           'encoding_format': 'base64'}, headers=self.headers)
+            except HTTPStatusError as e:
+                if e.status not in RETRY_STATUSES or attempt == self.retries:
+                    raise
+                if e.status == 429:
+                    self.limiter.throttled(e.retry_after)
+                retry_after = e.retry_after
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            else:
+                self.limiter.succeeded()
+                data = sorted(json.loads(body)['data'], key=lambda d: d['index'])
+                if len(data) != len(texts):
+                    raise ValueError(f'Asked for {len(texts)} embeddings, got {len(data)}')
+                return np.stack([np.frombuffer(base64.b64decode(d['embedding']), dtype='<f4')
+                                 if isinstance(d['embedding'], str) else np.asarray(d['embedding'], dtype=np.float32)
+                                 for d in data])
+            finally:
+                self.limiter.release()
+            with self._lock:
+                self.retried += 1
+            delay = min(30.0, self.backoff * 2 ** attempt) * (0.5 + random.random())
+            time.sleep(retry_after if retry_after is not None else delay)
+
+    def map(self, batches: list):
+        """Yield (batch number, vectors) as requests finish; pending batches are cancelled on error."""
+        futures = {self._executor.submit(self.embed_batch, batch): i for i, batch in enumerate(batches)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def embed_texts(self, texts: list) -> list:
+        """Vectors for ``texts`` in order, fetched in concurrent ``batch_size`` requests."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        out = [None] * len(batches)
+        for i, vectors in self.map(batches):
+            out[i] = vectors
+        return [v for vectors in out for v in vectors]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
+
+
+def known_vectors(store_dir: str) -> tuple:
+    """(hashes, matrix) of a finished store that records its description hashes, else empty arrays."""
+    hashes_path = os.path.join(store_dir, HASHES_FILE)
+    if not (os.path.isfile(hashes_path) and os.path.isfile(os.path.join(store_dir, emb_store.MANIFEST))):
+        return np.empty(0, dtype=np.uint64), None
+    hashes = np.load(hashes_path)
+    matrix = emb_store.open_store(store_dir)
+    if len(hashes) != len(matrix):
+        return np.empty(0, dtype=np.uint64), None
+    return hashes, matrix
+
+
+def replace_store(store_dir: str, staging: str):
+    """Move the finished ``staging`` directory to ``store_dir``, removing the old store and checkpoint.
+
+    Two renames, so ``store_dir`` is briefly missing. The old files are unlinked,
+    not rewritten, so servers that still map them keep reading the old store.
+    """
+    old = store_dir.rstrip(os.sep) + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    os.rename(store_dir, old)
+    os.rename(staging, store_dir)
+    shutil.rmtree(old)
+
+
+def embed_catalog(catalog_csv: str, store_dir: str, embedder: Embedder, dim: int, reuse: tuple = (),
+                  checkpoint_every: int = 8, log=print) -> dict:
+    """Embed ``catalog_csv`` into ``store_dir``, resuming from its checkpoint; returns a report."""
+    started = time.perf_counter()
+    old = store_dir.rstrip(os.sep) + '.old'
+    if not os.path.exists(store_dir) and os.path.isdir(old):
+        os.rename(old, store_dir)  # interrupted between the two renames of replace_store
+    df, _, texts, hashes = read_catalog_csv(catalog_csv)
+    # hash -> (matrix, row) for every vector we already have
+    known = {}
+    for path in (*reuse, store_dir):
+        old_hashes, matrix = known_vectors(path)
+        if matrix is not None and matrix.shape[1] != dim:
+            log(f'[EMBED] not reusing {path}: {matrix.shape[1]}-dim vectors, expected {dim}')
+            continue
+        for row, h in enumerate(old_hashes.tolist()):
+            known.setdefault(h, (matrix, row))
+    checkpoint = Checkpoint(os.path.join(store_dir, CHECKPOINT_DIR), embedder.model, dim)
+    done_hashes, done_vectors = checkpoint.entries()
+    for row, h in enumerate(done_hashes.tolist()):
+        known.setdefault(h, (done_vectors, row))
+
+    todo = {}
+    for h, text in zip(hashes.tolist(), texts):
+        if h not in known:
+            todo.setdefault(h, text or '')
+    todo = list(todo.items())
+    batches = [todo[i:i + embedder.batch_size] for i in range(0, len(todo), embedder.batch_size)]
+    report = {'rows': len(df), 'distinct': len(set(hashes.tolist())), 'from_checkpoint': checkpoint.rows,
+              'reused': len(set(hashes.tolist())) - len(todo), 'embedded': 0, 'batches': len(batches)}
+    log(f'[EMBED] {catalog_csv}: {report["rows"]} rows, {report["distinct"]} distinct descriptions, '
+        f'{report["reused"]} already embedded; {len(todo)} to embed in {len(batches)} requests')
+
+    finished = unflushed = 0
+    try:
+        for i, vectors in embedder.map([[text for _, text in batch] for batch in batches]):
+            if vectors.shape[1] != dim:
+                raise ValueError(f'Endpoint returned {vectors.shape[1]}-dim vectors, expected {dim} (--dim)')
+            checkpoint.append(np.array([h for h, _ in batches[i]], dtype=np.uint64), vectors)
+            finished += 1
+            unflushed += 1
+            report['embedded'] += len(vectors)
+            if unflushed >= checkpoint_every:
+                checkpoint.flush()
+                unflushed = 0
+                elapsed = time.perf_counter() - started
+                log(f'[EMBED] {finished}/{len(batches)} requests, {report["embedded"] / elapsed:.0f} rows/s, '
+                    f'cap {embedder.limiter.limit:.1f} in flight, {embedder.retried} retries, '
+                    f'{embedder.limiter.throttles} throttled')
+    finally:
+        # Keep everything that finished, also when a request gave up
+        checkpoint.close()
+
+    done_hashes, done_vectors = checkpoint.entries()
+    for row, h in enumerate(done_hashes.tolist()):
+        known.setdefault(h, (done_vectors, row))
+    # Servers may have the old store's files mapped: build next to it and swap directories
+    staging = store_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        emb_store.write_store(staging, (known[h][0][known[h][1]] for h in hashes.tolist()), dim, len(df), catalog_csv)
+        np.save(os.path.join(staging, HASHES_FILE), hashes)
+        report['indexes'] = retrieval.rebuild_indexes(store_dir, staging, emb_store.open_store(staging))
+        if catalog.has_shared(store_dir):
+            catalog.build(staging, catalog_csv)
+            report['indexes'].append(catalog.CATALOG_DIR)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    replace_store(store_dir, staging)
+    report.update(requests=embedder.requests, retries=embedder.retried, throttled=embedder.limiter.throttles,
+                  seconds=round(time.perf_counter() - started, 3))
+    log(f'[EMBED] wrote {len(df)} x {dim} rows to {store_dir} in {report["seconds"]:.1f} s '
+        f'({report["requests"]} requests, {report["retries"]} retries)')
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Embed a catalog CSV into a binary embedding store '
+                                                 '(concurrent, rate-adaptive, resumable)')
+    parser.add_argument('catalog_csv')
+    parser.add_argument('store_dir')
+    parser.add_argument('--model', default=EMBED_MODEL)
+    parser.add_argument('--dim', type=int, default=1536, help='embedding width the model returns')
+    parser.add_argument('--base-url', default=os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'))
+    parser.add_argument('--concurrency', type=int, default=8, help='most requests in flight')
+    parser.add_argument('--batch', type=int, default=256, help='descriptions per request')
+    parser.add_argument('--retries', type=int, default=6, help='retries per request before giving up')
+    parser.add_argument('--checkpoint-every', type=int, default=8, help='requests between checkpoint fsyncs')
+    parser.add_argument('--reuse', action='append', default=[], help='other store with hashes.npy to copy vectors from')
+    parser.add_argument('--restart', action='store_true', help='discard an existing checkpoint')
+    args = parser.parse_args(argv)
+
+    if args.restart:
+        shutil.rmtree(os.path.join(args.store_dir, CHECKPOINT_DIR), ignore_errors=True)
+    embedder = Embedder(args.base_url, os.getenv('OPENAI_API_KEY'), args.model, args.concurrency, args.batch,
+                        args.retries)
+    try:
+        embed_catalog(args.catalog_csv, args.store_dir, embedder, args.dim, tuple(args.reuse), args.checkpoint_every)
+    except (ValueError, OSError, HTTPStatusError, http.client.HTTPException) as e:
+        sys.exit(f'error: {e}\nFinished requests are checkpointed in {os.path.join(args.store_dir, CHECKPOINT_DIR)}; '
+                 f'rerun the same command to resume.')
+    finally:
+        embedder.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Hash index for parts read out verbatim: by item_id or by exact description.
+
+Descriptions are keyed by ``normalize_description`` (case-folded, whitespace
+collapsed, fractions written one way), ids by the case-folded id with all
+whitespace removed, so "0000 001289." still finds item 0000001289. Keys are
+kept as sorted 64-bit BLAKE2 hashes next to their rows, about 12 bytes per key.
+Keys that normalize to "" (a description of ".") are left out, so noise
+such as "..." never matches.
+The index can be saved next to the embedding store and memory-mapped, so
+worker processes share one copy. A lookup is two binary searches. A false hit
+needs a 64-bit collision with one of ~10^5 keys, about 1 in 10^14.
+"""
+import hashlib
+import os
+import re
+
+import numpy as np
+
+import emb_store
+
+_FRACTIONS = {'¼': '1/4', '½': '1/2', '¾': '3/4', '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8',
+              '⅓': '1/3', '⅔': '2/3'}
+_MIXED = re.compile(r'(\d)\s*-\s*(\d+/\d+)')  # 1-1/2 -> 1 1/2
+_SLASH = re.compile(r'(\d)\s*/\s*(\d)')  # 1 / 2 -> 1/2
+_UNICODE_FRACTION = re.compile('(\\d?)\\s*([' + ''.join(_FRACTIONS) + '])')
+_EDGE_PUNCTUATION = ' \t\r\n.,;:!?'
+
+
+def normalize_description(text: str) -> str:
+    text = str(text).casefold()
+    text = _UNICODE_FRACTION.sub(lambda m: (m.group(1) + ' ' if m.group(1) else '') + _FRACTIONS[m.group(2)], text)
+    text = _MIXED.sub(r'\1 \2', text)
+    text = _SLASH.sub(r'\1/\2', text)
+    return ' '.join(text.split()).strip(_EDGE_PUNCTUATION)
+
+
+def normalize_id(text: str) -> str:
+    return ''.join(str(text).split()).casefold().strip(_EDGE_PUNCTUATION)
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _table(keys):
+    """Sorted unique 64-bit key hashes and the first row each one came from; empty keys are skipped."""
+    rows = [(key_hash(k), row) for row, k in enumerate(keys) if k]
+    hashes = np.fromiter((h for h, _ in rows), dtype=np.uint64, count=len(rows))
+    unique, first = np.unique(hashes, return_index=True)
+    return unique, np.array([r for _, r in rows], dtype=np.int32)[first]
+
+
+def _find(hashes: np.ndarray, rows: np.ndarray, key: str):
+    if not key:
+        return None
+    h = np.uint64(key_hash(key))
+    i = int(np.searchsorted(hashes, h))
+    if i < len(hashes) and hashes[i] == h:
+        return int(rows[i])
+    return None
+
+
+class ExactIndex:
+    FILES = ('id_hashes', 'id_rows', 'description_hashes', 'description_rows')
+
+    def __init__(self, id_hashes: np.ndarray, id_rows: np.ndarray, description_hashes: np.ndarray,
+                 description_rows: np.ndarray):
+        self.id_hashes = id_hashes
+        self.id_rows = id_rows
+        self.description_hashes = description_hashes
+        self.description_rows = description_rows
+
+    @classmethod
+    def build(cls, item_ids, descriptions) -> 'ExactIndex':
+        # Duplicate ids / descriptions resolve to their first row
+        return cls(*_table(normalize_id(i) for i in item_ids),
+                   *_table(normalize_description(d) for d in descriptions))
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name in self.FILES:
+            emb_store.save_array(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str) -> 'ExactIndex':
+        """Map a saved index read-only (shared by every process that loads it)."""
+        return cls(*(np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in cls.FILES))
+
+    def lookup(self, text: str):
+        """(row, 'exact_id' | 'exact_description') for a verbatim match, else None."""
+        row = _find(self.id_hashes, self.id_rows, normalize_id(text))
+        if row is not None:
+            return row, 'exact_id'
+        row = _find(self.description_hashes, self.description_rows, normalize_description(text))
+        if row is not None:
+            return row, 'exact_description'
+        return None
+
+    def lookup_utterance(self, text: str, min_id_chars: int = 6, min_tokens: int = 2):
+        """``lookup`` for a whole spoken utterance, which skips extraction when it hits.
+
+        Short ids ("101.") and one-word descriptions ("Seal.", "Labor") also
+        turn up in ordinary speech, so those hits are ignored here and the
+        utterance goes through extraction as usual.
+        """
+        hit = self.lookup(text)
+        if hit is None:
+            return None
+        if hit[1] == 'exact_id':
+            long_enough = len(normalize_id(text)) >= min_id_chars
+        else:
+            long_enough = len(normalize_description(text).split()) >= min_tokens
+        return hit if long_enough else None
@@ -0,0 +1,101 @@
+"""Incremental extraction of customer fields and line items during a call.
+
+Instead of re-sending the whole transcript on every completed utterance,
+``IncrementalExtractor`` keeps the order extracted so far and sends the LLM a
+compact summary of it plus only the new utterance. The response lists the
+customer fields and items that utterance adds or changes, which are merged
+into the running order. Input size per turn is bounded by the size of the
+order, not the length of the call.
+"""
+import json
+from typing import Callable, List
+
+from exact_index import normalize_description
+
+CUSTOMER_FIELDS = ['company_name', 'associate_name', 'po_number', 'email', 'address']
+
+INCREMENTAL_PROMPT = '''We are taking a phone order. You get the order extracted so far and the newest utterance of the transcript. Return only a JSON object with what the new utterance adds or changes:
+{
+  "company_name": string or null,
+  "associate_name": string or null,
+  "po_number": string or null,
+  "email": string or null,
+  "address": string or null,
+  "item_names": [
+    {"item_name": "part1", "quantity": 2}
+  ]
+}
+Customer fields are null unless the new utterance states or corrects them. item_names only lists parts the new utterance mentions; "quantity" is the new total for that part, 0 if the customer cancels it. Reuse the exact item_name from the current order when the utterance refers to a part already in it. Default quantity to 1 if not mentioned. No backticks or markdown.'''
+
+
+def parse_json_object(content: str) -> dict:
+    content = content.strip()
+    if content.startswith('```'):
+        content = content.strip('`').removeprefix('json').strip()
+    parsed = json.loads(content)
+    if not isinstance(parsed, dict):
+        raise ValueError(f'expected a JSON object, got {content[:200]!r}')
+    return parsed
+
+
+class IncrementalExtractor:
+    """Running order for one call; ``complete(messages) -> str`` is the chat call."""
+
+    def __init__(self, complete: Callable[[list], str]):
+        self.complete = complete
+        self.customer = {field: None for field in CUSTOMER_FIELDS}
+        self.items = []  # [{'item_name': ..., 'quantity': ...}] in order of first mention
+
+    def summary(self) -> str:
+        state = {field: value for field, value in self.customer.items() if value}
+        state['item_names'] = self.items
+        return json.dumps(state, separators=(',', ':'))
+
+    def messages(self, utterance: str) -> list:
+        return [
+            {'role': 'system', 'content': INCREMENTAL_PROMPT},
+            {'role': 'user', 'content': f'Current order: {self.summary()}\nNew utterance: {utterance}'},
+        ]
+
+    def update(self, utterance: str) -> List[dict]:
+        """Extract from ``utterance`` and merge; returns the items it added or changed."""
+        try:
+            extracted = parse_json_object(self.complete(self.messages(utterance)))
+        except Exception as e:
+            print(f'Extract error: {e}')
+            return []
+        return self.merge(extracted)
+
+    def merge(self, extracted: dict) -> List[dict]:
+        """Apply an extraction to the order; returns the items added or changed. Quantity 0 removes an item."""
+        for field in CUSTOMER_FIELDS:
+            if extracted.get(field):
+                self.customer[field] = extracted[field]
+        changed = []
+        by_name = {normalize_description(item['item_name']): item for item in self.items}
+        for mention in extracted.get('item_names') or []:
+            name = str(mention.get('item_name') or '').strip()
+            if not name:
+                continue
+            quantity = mention.get('quantity', 1)
+            if quantity is None:
+                quantity = 1
+            item = by_name.get(normalize_description(name))
+            if quantity == 0:
+                if item is not None:
+                    self.items.remove(item)
+                    del by_name[normalize_description(name)]
+                    if item in changed:
+                        changed.remove(item)
+                continue
+            if item is None:
+                item = {'item_name': name, 'quantity': quantity}
+                self.items.append(item)
+                by_name[normalize_description(name)] = item
+            elif item['quantity'] == quantity:
+                continue
+            else:
+                item['quantity'] = quantity
+            if item not in changed:
+                changed.append(item)
+        return [dict(item) for item in changed]
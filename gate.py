@@ -0,0 +1,28 @@
+"""Confidence gate that accepts the top vector candidate without an LLM call.
+
+The score combines the top-1 cosine similarity with its margin over the
+runner-up, and short-circuits to 1.0 + top-1 when the query and the top
+candidate's description are equal (and not empty) after normalization:
+
+    score = top1 + margin_weight * (top1 - top2)
+
+Without a runner-up (one candidate, or an IVF result padded with -inf) the
+margin is unknown, so the score is -inf and the part goes to the LLM.
+
+``call_top`` accepts the candidate when the score clears ``GATE_THRESHOLD``.
+Pick the threshold with ``calibrate_gate.py``, which replays labeled
+(query, item_id) pairs and reports precision and the fraction of LLM calls
+avoided at each threshold.
+"""
+import math
+
+from exact_index import normalize_description
+
+
+def score(query: str, top_description: str, top1: float, top2: float, margin_weight: float = 1.0) -> float:
+    if not (math.isfinite(top1) and math.isfinite(top2)):
+        return -math.inf
+    query_key = normalize_description(query)
+    if query_key and query_key == normalize_description(top_description):
+        return 1.0 + top1
+    return top1 + margin_weight * (top1 - top2)
@@ -0,0 +1,130 @@
+"""Keep-alive HTTP connection pool for the CLI client (stdlib only).
+
+``realtime.py`` used to call ``urllib.request.urlopen`` for every chat
+completion and every ``/top`` call, paying a new TCP (and TLS) handshake each
+time. ``HTTPPool`` keeps up to ``size`` idle ``http.client`` connections per
+origin and reuses them. It retries connection errors, timeouts, 429 and 5xx
+with exponential backoff. A request that fails on a reused connection (the
+server closed it while idle) is retried straight away on another one,
+without counting as a retry. Each request logs its connect, time-to-first-byte and total time.
+"""
+import http.client
+import json
+import queue
+import random
+import time
+from urllib.parse import urlsplit
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# What a keep-alive connection the server already closed fails with
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+def retry_after_seconds(value: str | None) -> float | None:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None  # absent, or an HTTP date (not sent by the APIs we call)
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, body: bytes, retry_after: float | None = None):
+        super().__init__(f'HTTP {status}: {body[:200]!r}')
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after  # seconds, from the Retry-After header (429/503)
+
+
+class HTTPPool:
+    def __init__(self, base_url: str, size: int = 4, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 retries: int = 2, backoff: float = 0.5, log: bool = True):
+        url = urlsplit(base_url)
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.log = log
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.connects = 0
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        self.connects += 1
+        return conn
+
+    def _checkout(self):
+        """(connection, reused, connect seconds)"""
+        try:
+            return self._idle.get_nowait(), True, 0.0
+        except queue.Empty:
+            start = time.perf_counter()
+            return self._new_connection(), False, time.perf_counter() - start
+
+    def _checkin(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _exchange(self, conn, method, path, body, headers):
+        """Send one request on ``conn``: (response, body, ttfb seconds, total seconds)."""
+        start = time.perf_counter()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = conn.getresponse()
+            ttfb = time.perf_counter() - start
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return response, data, ttfb, time.perf_counter() - start
+
+    def request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None) -> bytes:
+        """Response body of a 2xx response; raises HTTPStatusError or the last connection error."""
+        attempt = 0
+        while True:
+            reused = False
+            try:
+                conn, reused, connect = self._checkout()
+                response, data, ttfb, total = self._exchange(conn, method, path, body, headers or {})
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                if reused and isinstance(e, STALE_ERRORS):
+                    continue  # idle connection closed by the server: retry now on the next one
+                if attempt >= self.retries:
+                    raise
+                print(f'[HTTP] {method} {path} {type(e).__name__}: {e}; retrying')
+            else:
+                if self.log:
+                    print(f'[HTTP] {method} {path} {status} connect={connect * 1000:.1f}ms '
+                          f'ttfb={(connect + ttfb) * 1000:.1f}ms total={(connect + total) * 1000:.1f}ms'
+                          f'{" (reused)" if reused else ""}')
+                if 200 <= status < 300:
+                    return data
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    raise HTTPStatusError(status, data, retry_after_seconds(response.getheader('Retry-After')))
+            attempt += 1
+            time.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+
+    def post_json(self, path: str, payload, headers: dict | None = None) -> bytes:
+        return self.request('POST', path, body=json.dumps(payload).encode('utf-8'),
+                            headers={'Content-Type': 'application/json', **(headers or {})})
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
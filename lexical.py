@@ -0,0 +1,109 @@
+"""Character n-gram BM25 index over catalog descriptions.
+
+Spoken part requests are often near-literal catalog codes ("6000 FS THRD
+TEE"), which embedding similarity ranks poorly. This index scores them by
+overlapping character n-grams instead. Posting lists are CSR-style NumPy
+arrays (``indptr``/``docs``/``weights``) with the BM25 term weight
+precomputed per (n-gram, row), so a query is a concatenation of a few
+posting slices and one ``np.bincount``.
+
+``rrf`` merges the lexical and vector rankings with reciprocal-rank fusion.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+import emb_store
+
+_SPACE = re.compile(r'\s+')
+
+
+def ngrams(text: str, n: int):
+    text = ' ' + _SPACE.sub(' ', text.casefold()).strip() + ' '
+    return [text[i:i + n] for i in range(max(len(text) - n + 1, 1))]
+
+
+class LexicalIndex:
+    def __init__(self, vocab: dict, indptr: np.ndarray, docs: np.ndarray, weights: np.ndarray,
+                 n_docs: int, n: int):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+        self.n_docs = n_docs
+        self.n = n
+
+    @classmethod
+    def build(cls, texts, n: int = 3, k1: float = 1.2, b: float = 0.75, max_df: float = 0.2) -> 'LexicalIndex':
+        """Index ``texts``; n-grams found in more than ``max_df`` of rows are dropped.
+
+        Such n-grams (" 1/", "ve ") carry almost no BM25 weight but have the
+        longest posting lists, so they dominate query time.
+        """
+        vocab = {}
+        term_ids, doc_ids, lengths = [], [], np.empty(len(texts), dtype=np.float32)
+        for d, text in enumerate(texts):
+            grams = ngrams(str(text), n)
+            lengths[d] = len(grams)
+            term_ids.extend(vocab.setdefault(g, len(vocab)) for g in grams)
+            doc_ids.extend([d] * len(grams))
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+
+        # Collapse repeated (term, doc) pairs into term frequencies, sorted by term
+        pair = np.unique(term_ids * len(texts) + doc_ids, return_counts=True)
+        terms, docs = np.divmod(pair[0], len(texts))
+        tf = pair[1].astype(np.float32)
+        df = np.bincount(terms, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        weights = idf[terms] * tf * (k1 + 1) / (tf + norm[docs])
+        common = df > max_df * len(texts)
+        keep = ~common[terms]
+        terms, docs, weights = terms[keep], docs[keep], weights[keep]
+        df[common] = 0
+        indptr = np.concatenate([[0], np.cumsum(df.astype(np.int64))])
+        return cls(vocab, indptr, docs.astype(np.int32), weights.astype(np.float32), len(texts), n)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name in ('indptr', 'docs', 'weights'):
+            emb_store.save_array(os.path.join(path, name + '.npy'), getattr(self, name))
+        grams = sorted(self.vocab, key=self.vocab.get)
+        meta = json.dumps({'n': self.n, 'n_docs': self.n_docs, 'grams': grams}, ensure_ascii=False)
+        emb_store.replace_file(os.path.join(path, 'vocab.json'), lambda f: f.write(meta.encode('utf-8')))
+
+    @classmethod
+    def load(cls, path: str) -> 'LexicalIndex':
+        """Map saved postings read-only; only the n-gram vocabulary is loaded per process."""
+        with open(os.path.join(path, 'vocab.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ('indptr', 'docs', 'weights')]
+        return cls({g: i for i, g in enumerate(meta['grams'])}, *arrays, meta['n_docs'], meta['n'])
+
+    def search(self, query: str, k: int = 10):
+        """Best-first (row indices, scores) of the ``k`` best-scoring rows."""
+        ids = [self.vocab[g] for g in set(ngrams(query, self.n)) if g in self.vocab]
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs = np.concatenate([self.docs[self.indptr[t]:self.indptr[t + 1]] for t in ids])
+        weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] for t in ids])
+        scores = np.bincount(docs, weights=weights, minlength=self.n_docs)
+        # Select among matching rows only; argpartition over a mostly-zero array degrades badly
+        hit = np.flatnonzero(scores > 0)
+        k = min(k, len(hit))
+        top = hit[np.argpartition(scores[hit], -k)[-k:]]
+        top = top[np.argsort(-scores[top])]
+        return top.astype(np.int64), scores[top].astype(np.float32)
+
+
+def rrf(rankings, k: int = 10, c: int = 60):
+    """Reciprocal-rank fusion of best-first row-id lists; returns the top ``k`` ids."""
+    fused = {}
+    for ranking in rankings:
+        for rank, ix in enumerate(ranking):
+            if ix >= 0:
+                fused[ix] = fused.get(ix, 0.0) + 1.0 / (c + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:k]
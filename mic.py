@@ -0,0 +1,54 @@
+"""Bounded buffer between the PyAudio mic callback and the sender thread.
+
+The callback must never block, so ``put`` is non-blocking. When the sender
+falls behind and the buffer is full, the oldest chunk is dropped: for live
+transcription, fresh audio matters more than a backlog. ``get_batch`` blocks
+(no spinning) until audio arrives, then collects chunks until about
+``min_bytes`` are buffered or ``max_wait`` passes, and drains whatever else is
+queued. The sender sends the result as one append.
+"""
+import queue
+import time
+
+
+class MicBuffer:
+    def __init__(self, max_chunks: int = 200):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self.dropped = 0
+
+    def put(self, chunk: bytes):
+        """Enqueue from the audio callback; drops the oldest chunk when full."""
+        while True:
+            try:
+                self._queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get_batch(self, min_bytes: int, max_wait: float, timeout: float = 0.5) -> bytes | None:
+        """Concatenated audio, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            chunks = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        size = len(chunks[0])
+        deadline = time.monotonic() + max_wait
+        while size < min_bytes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                chunks.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            size += len(chunks[-1])
+        while True:
+            try:
+                chunks.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return b''.join(chunks)
@@ -0,0 +1,128 @@
+"""Per-session processing stage for extraction and matching.
+
+The realtime receiver only calls ``CoalescingWorker.submit`` and goes back to
+reading the upstream socket. Jobs run on a shared executor, one at a time per
+session so the running order is updated in sequence. Items submitted while a
+job is running are handed over together on the next run. For example, three
+utterances that complete during one slow extraction are processed in one
+pass, not three.
+
+``BlockingPool`` is the bounded pool those jobs (and the paste path and
+``/top``) run on, with a concurrency cap and queueing metrics.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, List
+
+
+class CoalescingWorker:
+    def __init__(self, executor: Executor, process: Callable[[List], None]):
+        self.executor = executor
+        self.process = process
+        self._pending = []
+        self._running = False
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.runs = 0
+
+    def submit(self, item):
+        with self._lock:
+            self._pending.append(item)
+            self.submitted += 1
+            if self._running:
+                return
+            self._running = True
+        try:
+            self.executor.submit(self._drain)
+        except Exception:
+            # Rejected (e.g. PoolFull): the item stays pending for the next submit
+            with self._lock:
+                self._running = False
+            raise
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                batch, self._pending = self._pending, []
+                self.runs += 1
+            try:
+                self.process(batch)
+            except Exception as e:
+                print(f'Processing error: {e}')
+
+
+class PoolFull(RuntimeError):
+    pass
+
+
+class BlockingPool:
+    """Thread pool for blocking catalog/LLM work called from the event loop.
+
+    At most ``max_workers`` jobs run at once. Others wait in the pool's
+    queue, and with ``max_queue`` set a submit beyond that many waiting jobs
+    raises ``PoolFull``. ``stats()`` reports queue depth and wait times.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int = 0, name: str = 'blocking'):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if self.max_queue and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise PoolFull(f'{self.queued} jobs already waiting')
+            self.queued += 1
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        enqueued = time.perf_counter()
+
+        def job():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._waits.append(time.perf_counter() - enqueued)
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+            return result
+
+        return self._executor.submit(job)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` on the pool without blocking the loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            out = {'max_workers': self.max_workers, 'max_queue': self.max_queue, 'queued': self.queued,
+                   'running': self.running, 'max_queued': self.max_queued, 'submitted': self.submitted,
+                   'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected}
+        if waits:
+            out['wait_ms_p50'] = round(waits[len(waits) // 2] * 1000, 3)
+            out['wait_ms_p99'] = round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3)
+        return out
@@ -1,13 +1,16 @@
 import base64
 import json
 import os
-import queue
 import threading
 import time
-import urllib.request
 import pyaudio
 import websocket
 
+from http_pool import HTTPPool
+from mic import MicBuffer
+from transcript import TranscriptBuffer
+from vad import VoiceGate
+
 API_KEY = os.getenv("OPENAI_API_KEY")
 if not API_KEY:
     raise ValueError("Set OPENAI_API_KEY environment variable")
@@ -17,26 +20,55 @@ WS_URL = 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10
 CHUNK_SIZE = 1024
 RATE = 24000
 FORMAT = pyaudio.paInt16
-
-mic_queue = queue.Queue()
-extract_queue = queue.Queue()
+# Mic chunks buffered for the sender (200 x 1024 samples ~ 8.5 s); oldest dropped when full
+MIC_QUEUE_CHUNKS = int(os.getenv('MIC_QUEUE_CHUNKS', '200'))
+# Audio per upstream append: the sender batches chunks up to this duration
+MIC_BATCH_MS = int(os.getenv('MIC_BATCH_MS', '100'))
+
+# LOCAL_VAD=1 drops silence/noise before it is sent (see vad.py)
+voice_gate = VoiceGate() if os.getenv('LOCAL_VAD', '0') == '1' else None
+
+mic_buffer = MicBuffer(MIC_QUEUE_CHUNKS)
+
+# Keep-alive connections for extraction (OpenAI) and matching (local /top),
+# reused across requests; retries with backoff on errors, 429 and 5xx
+HTTP_OPTIONS = dict(
+    connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.getenv('HTTP_READ_TIMEOUT', '60')),
+    retries=int(os.getenv('HTTP_RETRIES', '2')),
+    backoff=float(os.getenv('HTTP_BACKOFF', '0.5')),
+)
+openai_http = HTTPPool(os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'), **HTTP_OPTIONS)
+top_http = HTTPPool(os.getenv('TOP_URL', 'http://127.0.0.1:8000'), **HTTP_OPTIONS)
+# Transcript kept in memory; a background writer appends it to transcript.txt
+# every TRANSCRIPT_FLUSH_MS and per utterance, fsyncing at most every TRANSCRIPT_FSYNC_S
+transcript = TranscriptBuffer('transcript.txt',
+                              flush_interval=int(os.getenv('TRANSCRIPT_FLUSH_MS', '1000')) / 1000,
+                              fsync_interval=float(os.getenv('TRANSCRIPT_FSYNC_S', '5')))
 stop_event = threading.Event()
 
 
 def mic_callback(in_data, frame_count, time_info, status):
-    mic_queue.put(in_data)
+    mic_buffer.put(in_data)
     return (None, pyaudio.paContinue)
 
 
 def send_mic_audio(ws):
+    batch_bytes = RATE * 2 * MIC_BATCH_MS // 1000
     while not stop_event.is_set():
-        if not mic_queue.empty():
-            chunk = mic_queue.get()
-            encoded = base64.b64encode(chunk).decode('utf-8')
-            try:
-                ws.send(json.dumps({'type': 'input_audio_buffer.append', 'audio': encoded}))
-            except Exception as e:
-                print(f'Send error: {e}')
+        # Blocks until audio arrives, then takes up to MIC_BATCH_MS plus anything queued
+        chunk = mic_buffer.get_batch(batch_bytes, MIC_BATCH_MS / 1000)
+        if chunk is None:
+            continue
+        if voice_gate:
+            chunk = voice_gate.process(chunk)
+            if not chunk:
+                continue
+        encoded = base64.b64encode(chunk).decode('utf-8')
+        try:
+            ws.send(json.dumps({'type': 'input_audio_buffer.append', 'audio': encoded}))
+        except Exception as e:
+            print(f'Send error: {e}')
 
 
 def receive_messages(ws):
@@ -53,15 +85,12 @@ def receive_messages(ws):
 
             elif event_type == 'conversation.item.input_audio_transcription.delta':
                 delta = data.get('delta', '')
-                with open('transcript.txt', 'a') as f:
-                    f.write(delta)
+                transcript.add_delta(delta)
                 # print(delta, end='', flush=True)
                 # print("IS DELTA")
-                extract_queue.put(1)
 
             elif event_type == 'conversation.item.input_audio_transcription.completed':
-                with open('transcript.txt', 'a') as f:
-                    f.write('\n')
+                transcript.complete()
                 # print()
                 # print("IS COMPLETED")
 
@@ -90,31 +119,19 @@ def send_session_config(ws):
 
 
 def extract_parts():
+    cursor = 0  # utterances already sent for extraction
     while not stop_event.is_set():
-        try:
-            extract_queue.get(timeout=1)
-        except queue.Empty:
-            continue
-
-        # Drain the queue
-        while not extract_queue.empty():
-            try:
-                extract_queue.get_nowait()
-            except queue.Empty:
-                break
-
-        # Read full transcript
-        try:
-            with open('transcript.txt', 'r') as f:
-                transcript = f.read()
-        except FileNotFoundError:
+        if not transcript.wait_for(cursor, timeout=1):
             continue
 
-        if not transcript.strip():
+        # Only the utterances completed since the last extraction
+        new_utterances, cursor = transcript.since(cursor)
+        new_text = '\n'.join(u for u in new_utterances if u.strip())
+        if not new_text:
             continue
 
         # Query gpt-4o-mini for part names
-        req_body = json.dumps({
+        req_body = {
             "model": "gpt-4o-mini-2024-07-18",
             "messages": [
                 {
@@ -138,37 +155,24 @@ ANGLE WALL POST KIT FIG 551 B
                 },
                 {
                     "role": "user",
-                    "content": transcript
+                    "content": new_text
                 }
             ]
-        }).encode('utf-8')
-
-        req = urllib.request.Request(
-            'https://api.openai.com/v1/chat/completions',
-            data=req_body,
-            headers={
-                'Authorization': f'Bearer {API_KEY}',
-                'Content-Type': 'application/json'
-            }
-        )
+        }
 
         try:
-            with urllib.request.urlopen(req) as resp:
-                result = json.loads(resp.read().decode('utf-8'))
-                parts_str = result['choices'][0]['message']['content']
-                print(f'\n[PARTS] {parts_str}')
-
-                # Parse the JSON array and send to local API
-                parts_list = json.loads(parts_str)
-                if parts_list:
-                    top_req = urllib.request.Request(
-                        'http://127.0.0.1:8000/top',
-                        data=json.dumps(parts_list).encode('utf-8'),
-                        headers={'Content-Type': 'application/json'}
-                    )
-                    with urllib.request.urlopen(top_req) as top_resp:
-                        top_result = json.loads(top_resp.read().decode('utf-8'))
-                        print(f'[TOP] {json.dumps(top_result, indent=2)}\n')
+            resp = openai_http.post_json('/chat/completions', req_body,
+                                         headers={'Authorization': f'Bearer {API_KEY}'})
+            result = json.loads(resp.decode('utf-8'))
+            parts_str = result['choices'][0]['message']['content']
+            print(f'\n[PARTS] {parts_str}')
+
+            # Parse the JSON array and send to local API
+            parts_list = json.loads(parts_str)
+            if parts_list:
+                top_resp = top_http.post_json('/top', parts_list)
+                top_result = json.loads(top_resp.decode('utf-8'))
+                print(f'[TOP] {json.dumps(top_result, indent=2)}\n')
         except Exception as e:
             print(f'Extract error: {e}')
 
@@ -193,6 +197,7 @@ def main():
             ]
         )
         print('Connected. Transcribing to transcript.txt...')
+        transcript.start()
 
         recv_thread = threading.Thread(target=receive_messages, args=(ws,))
         recv_thread.start()
@@ -213,6 +218,14 @@ def main():
         stop_event.set()
 
     finally:
+        transcript.close()
+        openai_http.close()
+        top_http.close()
+        if mic_buffer.dropped:
+            print(f'Mic: dropped {mic_buffer.dropped} chunks while the sender was behind')
+        if voice_gate:
+            vad_stats = voice_gate.stats()
+            print(f'VAD: suppressed {vad_stats["suppressed"]:.1%} of audio, saved {vad_stats["bytes_saved"]} bytes')
         mic_stream.stop_stream()
         mic_stream.close()
         p.terminate()
@@ -0,0 +1,98 @@
+"""Resolution of ``call_top`` candidates to catalog rows by the LLM.
+
+Two modes, selected with ``RESOLVE_MODE`` in emb_server:
+
+- ``per_part``: one prompt per part, fanned out by ``resolve_all``.
+- ``batched``: every part's candidate list in one prompt that answers with
+  one index-or-NONE per part, so the instruction block is sent once.
+  ``parse_batched`` raises on anything malformed and the caller falls back
+  to per-part calls.
+
+Per-part fan-out:
+
+Each prompt is sent through ``complete(prompt) -> str`` on a shared, bounded
+executor, so an order with eight parts waits for the slowest call instead of
+the sum of all eight. Results keep the original part order; a call that
+raises or runs past ``timeout`` seconds (counted from when it started, not
+while it sat in the queue) resolves to ``None`` without failing the batch.
+"""
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Callable, List
+
+RESOLUTION_GUIDANCE = """E.g., the user could have said "two-and-a-half inch fire lock T", and that would match "2 1/2 FIRELOCK TEE", so if it had index=5, you would output 5. Please don't output an index unless there is a strong semantic match. Other examples: query "three-quarter inch chrome up cut chin" would match "3/4 Chrome Cup 401 Escutcheon" because they sound the same (transcription isn't perfect), query "half-inch gate valve whole part" would match "1/2 BRZ GATE VLV TE FULL PRT". One bug that you run into is matching user query "b" to part name "2 1\\/2 FIRELOCK TEE", which doesn't make sense, don't do that. Another false positive you made was that the user said "any free system 6x2" and you matched "SIGN - BLANK 6 X 2", nice job on the 6x2 but the rest doesn't match enough. Here is another error that you made. The transcript said "I want an antifreeze system, six by two. I want two antifreeze systems, five by seven" and you extracted part_name=antifreeze system quantity=2 and part_name=antifreeze system quantity=1, but really you should have included the 6X2 and 5X7 in the part names. Here's another error, the transcript said "I wonder if I can have...21 over 2 inch, 2000 SS, LF, Aussie, FXG", though that was the customer trying to describe 21/2" 2000SS LF OSY FXG, so as you can see, the transcript will often include commas in between words, because part numbers are compound, and unlike normal language, but you should look past this, and if a series of words with commas in between looks like it should be one part, try to only extract one part."""
+
+
+def resolution_prompt(candidates: str, item_name: str) -> str:
+    prompt = f"""We are a manufacturing automation business. We extracted that the customer asked for "{item_name}". We cosine similarity matched it to the following top items:
+
+    {candidates}
+
+    If one of them are what the user asked for, output its index as an int, 0-9. Otherwise, output the string "NONE". {RESOLUTION_GUIDANCE}
+    """
+    return prompt
+
+
+def batched_resolution_prompt(candidate_lists: List[str], item_names: List[str]) -> str:
+    parts = '\n\n'.join(f'Part {i}: the customer asked for "{name}". Candidates:\n{candidates}'
+                         for i, (name, candidates) in enumerate(zip(item_names, candidate_lists)))
+    return f"""We are a manufacturing automation business. We extracted that the customer asked for the {len(item_names)} parts below, and cosine similarity matched each part to its own list of top items.
+
+{parts}
+
+For each part separately: if one of its candidates is what the user asked for, its answer is that candidate's index as an int, 0-9. Otherwise its answer is the string "NONE". {RESOLUTION_GUIDANCE}
+
+Output only a JSON object of the form {{"answers": [...]}} with exactly {len(item_names)} answers, one per part in the order given. No backticks or markdown.
+"""
+
+
+def parse_batched(content: str, n: int) -> List[int | None]:
+    """Answers of a batched response; raises ValueError unless there is one valid answer per part."""
+    content = content.strip()
+    if content.startswith('```'):
+        content = content.strip('`').removeprefix('json').strip()
+    answers = json.loads(content)
+    if isinstance(answers, dict):
+        answers = answers.get('answers')
+    if not isinstance(answers, list) or len(answers) != n:
+        raise ValueError(f'expected {n} answers, got {content[:200]!r}')
+    parsed = []
+    for answer in answers:
+        if isinstance(answer, str) and answer.strip().upper() == 'NONE':
+            parsed.append(None)
+        elif isinstance(answer, int) and not isinstance(answer, bool):
+            parsed.append(answer)
+        elif isinstance(answer, str) and answer.strip().isdigit():
+            parsed.append(int(answer))
+        else:
+            raise ValueError(f'invalid answer {answer!r}')
+    return parsed
+
+
+def resolve_all(prompts: List[str], complete: Callable[[str], str], executor: Executor,
+                timeout: float) -> List[str | None]:
+    starts = [None] * len(prompts)
+
+    def run(i: int, prompt: str):
+        starts[i] = time.monotonic()
+        return complete(prompt)
+
+    futures = {executor.submit(run, i, prompt): i for i, prompt in enumerate(prompts)}
+    results = [None] * len(prompts)
+    pending = set(futures)
+    while pending:
+        started = [starts[futures[f]] for f in pending if starts[futures[f]] is not None]
+        wait_for = min(started) + timeout - time.monotonic() if started else timeout
+        done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+        for f in done:
+            try:
+                results[futures[f]] = f.result()
+            except Exception as e:
+                print(f'Resolve error (part {futures[f]}): {e}')
+        now = time.monotonic()
+        for f in [f for f in pending if starts[futures[f]] is not None and now - starts[futures[f]] >= timeout]:
+            # The worker thread finishes on its own; its late answer is discarded
+            print(f'Resolve timeout (part {futures[f]}) after {timeout:.1f}s')
+            pending.discard(f)
+    return results
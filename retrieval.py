@@ -0,0 +1,510 @@
+"""Retrieval engines for matching query embeddings against the catalog matrix.
+
+Every engine exposes ``search(queries, k) -> (indices, scores)`` where
+``queries`` is a (q, dim) float array and both results are (q, k) arrays
+sorted best-first. ``call_top`` only talks to this interface, so engines can
+be swapped through the ``RETRIEVAL_ENGINE`` setting.
+
+- ``exact``: brute-force scan of the whole matrix.
+- ``ivf``: inverted-file index. Rows are clustered offline with spherical
+  k-means; a query only scans the ``nprobe`` lists whose centroids are
+  closest to it. Build it next to an embedding store with:
+
+      python retrieval.py build-ivf embs_full.store --nlist 1024
+
+- ``int8``: first pass over an int8 copy of the matrix (per-row or
+  per-dimension scales), then the best ``rescore`` candidates are rescored
+  against the float32 store before the top k is returned. Build the
+  quantized copy with:
+
+      python retrieval.py quantize embs_full.store --dtype int8 --scales row
+
+- ``matryoshka``: first pass over the re-normalized first ``dim`` values of
+  every row (text-embedding-3 vectors keep most of their quality when
+  truncated), optionally rescoring the shortlist at full dimension. Build
+  the truncated copy with:
+
+      python retrieval.py truncate embs_full.store --dim 256
+
+``BatchingEngine`` wraps an engine for a server with many concurrent
+sessions. Searches issued within a short window are stacked into one call,
+so the matrix is streamed once per window, not once per caller. That only
+pays off for engines with ``batches_queries`` set (exact, matryoshka), whose
+``search`` is one matrix product for any number of queries; IVF and the
+quantized rescore loop per query anyway, so batching them only adds the
+window to every search.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import emb_store
+
+IVF_DIR = 'ivf'
+SCAN_BLOCK = 8192
+# float32 buffer the quantized scan upcasts into; small enough to stay in cache
+QUANT_BLOCK_BYTES = 1 << 20
+
+
+def top_k(scores: np.ndarray, k: int):
+    """Best-first (indices, scores) of the ``k`` largest entries of each row."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(scores, -k, axis=1)[:, -k:]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class ExactEngine:
+    name = 'exact'
+    batches_queries = True  # one matmul for any number of queries
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.asarray(queries, dtype=self.matrix.dtype)
+        return top_k((self.matrix @ queries.T).T, k)
+
+
+class IVFEngine:
+    name = 'ivf'
+    batches_queries = False  # scans each query's probed lists separately
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray,
+                 vectors: np.ndarray, nprobe: int = 8):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors  # rows in list order, so each list is one contiguous slice
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(self.nprobe, self.nlist)
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+        out_ix = np.full((len(queries), k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for qi, query in enumerate(queries):
+            ranges = [(self.offsets[l], self.offsets[l + 1]) for l in probes[qi]]
+            scores = np.concatenate([self.vectors[a:b] @ query for a, b in ranges])
+            positions = np.concatenate([np.arange(a, b) for a, b in ranges])
+            if len(scores) == 0:
+                continue
+            best, best_scores = top_k(scores[None, :], k)
+            out_ix[qi, :best.shape[1]] = self.ids[positions[best[0]]]
+            out_scores[qi, :best.shape[1]] = best_scores[0]
+        return out_ix, out_scores
+
+
+class QuantizedEngine:
+    """Scan a quantized matrix, then rescore a shortlist at full precision.
+
+    NumPy has no int8 matrix multiply, so the scan upcasts the codes
+    to float32 a few hundred rows at a time, into one buffer of
+    ``QUANT_BLOCK_BYTES`` that stays in cache while the block is multiplied.
+    The scan reads 1 byte per value instead of 4, and only the
+    ``rescore`` shortlisted rows of the float32 store are touched per query.
+    The upcast runs on one core, so where BLAS spreads the float32 scan over
+    many cores the exact engine can still be faster; the quantized engines
+    then buy memory, not speed. (A float16 copy was dropped: NumPy upcasts
+    float16 an order of magnitude slower than int8, so its first pass never
+    beat the float32 scan.)
+    """
+    batches_queries = False  # rescoring loops per query
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray | None, scale_mode: str | None,
+                 full: np.ndarray, rescore: int = 200):
+        self.codes = codes
+        self.scales = scales
+        self.scale_mode = scale_mode
+        self.full = full
+        self.rescore = rescore
+        self.name = str(codes.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def first_pass(self, queries: np.ndarray) -> np.ndarray:
+        if self.scale_mode == 'dim':
+            queries = queries * self.scales
+        rows = max(1, QUANT_BLOCK_BYTES // (4 * self.codes.shape[1]))
+        buffer = np.empty((rows, self.codes.shape[1]), dtype=np.float32)
+        scores = np.empty((len(self.codes), len(queries)), dtype=np.float32)  # row-major, so blocks write in place
+        for start in range(0, len(self.codes), rows):
+            block = buffer[:len(self.codes[start:start + rows])]
+            np.copyto(block, self.codes[start:start + len(block)], casting='unsafe')
+            np.matmul(block, queries.T, out=scores[start:start + len(block)])
+        if self.scale_mode == 'row':
+            scores *= self.scales[:, None]
+        return np.ascontiguousarray(scores.T)
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.asarray(queries, dtype=np.float32)
+        shortlist, _ = top_k(self.first_pass(queries), max(k, self.rescore))
+        return rescore(self.full, queries, shortlist, k)
+
+
+def rescore(full: np.ndarray, queries: np.ndarray, shortlist: np.ndarray, k: int):
+    """Re-rank each query's shortlisted row ids by exact dot product against ``full``."""
+    out_ix = np.empty((len(queries), min(k, shortlist.shape[1])), dtype=np.int64)
+    out_scores = np.empty(out_ix.shape, dtype=np.float32)
+    for qi, query in enumerate(queries):
+        rows = np.sort(shortlist[qi])  # sorted ids keep memmap reads sequential
+        best, best_scores = top_k((np.asarray(full[rows], dtype=np.float32) @ query)[None, :], k)
+        out_ix[qi] = rows[best[0]]
+        out_scores[qi] = best_scores[0]
+    return out_ix, out_scores
+
+
+class TruncatedEngine:
+    """Scan a Matryoshka prefix of the matrix; rescore at full dimension if ``rescore``."""
+    name = 'matryoshka'
+    batches_queries = True
+
+    def __init__(self, prefix: np.ndarray, full: np.ndarray, rescore: int = 200):
+        self.prefix = prefix
+        self.full = full
+        self.rescore = rescore
+
+    @property
+    def dim(self) -> int:
+        return self.prefix.shape[1]
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = truncate(queries, self.dim) @ self.prefix.T
+        if not self.rescore:
+            return top_k(scores, k)
+        shortlist, _ = top_k(scores, max(k, self.rescore))
+        return rescore(self.full, queries, shortlist, k)
+
+
+def truncate(matrix: np.ndarray, dim: int) -> np.ndarray:
+    """First ``dim`` values of every row, re-normalized to unit length.
+
+    Used for both the stored catalog prefix and incoming query embeddings so
+    the two are always cut the same way.
+    """
+    if dim > matrix.shape[1]:
+        raise ValueError(f'Cannot truncate {matrix.shape[1]}-dimensional embeddings to {dim} dimensions')
+    out = np.empty((len(matrix), dim), dtype=np.float32)
+    for start in range(0, len(matrix), SCAN_BLOCK):
+        out[start:start + SCAN_BLOCK] = normalize(np.asarray(matrix[start:start + SCAN_BLOCK, :dim], dtype=np.float32))
+    return out
+
+
+def prefix_path(store_dir: str, dim: int) -> str:
+    return os.path.join(store_dir, f'prefix-{dim}.npy')
+
+
+def load_truncated(store_dir: str, full: np.ndarray, dim: int, rescore: int = 200) -> TruncatedEngine:
+    path = prefix_path(store_dir, dim)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No {dim}-dim prefix in {store_dir}; build one with '
+                                f'`python retrieval.py truncate {store_dir} --dim {dim}`')
+    return TruncatedEngine(np.load(path, mmap_mode='r'), full, rescore=rescore)
+
+
+def quantize(matrix: np.ndarray, dtype: str = 'int8', scales: str = 'row'):
+    """Return (codes, scales) for ``matrix``."""
+    if dtype != 'int8':
+        raise ValueError(f'Unsupported quantization dtype {dtype!r}')
+    if scales == 'row':
+        factors = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SCAN_BLOCK):
+            block = np.asarray(matrix[start:start + SCAN_BLOCK], dtype=np.float32)
+            factors[start:start + len(block)] = np.abs(block).max(axis=1) / 127
+        factors = np.maximum(factors, 1e-12)
+        shape = (-1, 1)
+    elif scales == 'dim':
+        factors = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), SCAN_BLOCK):
+            block = np.asarray(matrix[start:start + SCAN_BLOCK], dtype=np.float32)
+            factors = np.maximum(factors, np.abs(block).max(axis=0) / 127)
+        factors = np.maximum(factors, 1e-12)
+        shape = (1, -1)
+    else:
+        raise ValueError(f'Unsupported scale mode {scales!r}')
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, len(matrix), SCAN_BLOCK):
+        block = np.asarray(matrix[start:start + SCAN_BLOCK], dtype=np.float32)
+        block_factors = factors[start:start + len(block)] if scales == 'row' else factors
+        codes[start:start + len(block)] = np.clip(np.rint(block / block_factors.reshape(shape)), -127, 127)
+    return codes, factors
+
+
+def quant_dir(store_dir: str, dtype: str, scales: str) -> str:
+    return os.path.join(store_dir, f'{dtype}-{scales}')
+
+
+def save_quantized(store_dir: str, dtype: str, scales: str, codes: np.ndarray, factors: np.ndarray | None):
+    out = quant_dir(store_dir, dtype, scales)
+    os.makedirs(out, exist_ok=True)
+    emb_store.save_array(os.path.join(out, 'codes.npy'), codes)
+    if factors is not None:
+        emb_store.save_array(os.path.join(out, 'scales.npy'), factors)
+
+
+def load_quantized(store_dir: str, full: np.ndarray, dtype: str, scales: str = 'row',
+                   rescore: int = 200) -> QuantizedEngine:
+    path = quant_dir(store_dir, dtype, scales)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'No {os.path.basename(path)} matrix in {store_dir}; build one with '
+                                f'`python retrieval.py quantize {store_dir} --dtype {dtype} --scales {scales}`')
+    # Mapped, not loaded: scanned pages stay resident and are shared by worker processes
+    codes = np.load(os.path.join(path, 'codes.npy'), mmap_mode='r')
+    factors = np.load(os.path.join(path, 'scales.npy'), mmap_mode='r')
+    return QuantizedEngine(codes, factors, scales, full, rescore=rescore)
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    labels = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), chunk):
+        block = np.asarray(matrix[start:start + chunk], dtype=np.float32)
+        labels[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(matrix: np.ndarray, nlist: int, iters: int = 20, sample: int | None = None, seed: int = 0):
+    """Spherical k-means (cosine) centroids, trained on a row sample."""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    sample = min(n, sample or 256 * nlist)
+    train = np.asarray(matrix[np.sort(rng.choice(n, sample, replace=False))], dtype=np.float32)
+    centroids = train[rng.choice(sample, nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        empty = np.bincount(labels, minlength=nlist) == 0
+        # Re-seed empty clusters with random training rows
+        sums[empty] = train[rng.choice(sample, int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def build_ivf(matrix: np.ndarray, nlist: int, iters: int = 20, seed: int = 0) -> IVFEngine:
+    return ivf_from_centroids(matrix, kmeans(matrix, nlist, iters=iters, seed=seed))
+
+
+def ivf_from_centroids(matrix: np.ndarray, centroids: np.ndarray) -> IVFEngine:
+    """Assign every row to its nearest centroid and lay the lists out contiguously."""
+    nlist = len(centroids)
+    labels = _assign(matrix, centroids)
+    ids = np.argsort(labels, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+    vectors = np.asarray(matrix[ids], dtype=np.float32)
+    return IVFEngine(centroids, offsets, ids, vectors)
+
+
+def save_ivf(store_dir: str, engine: IVFEngine):
+    out = os.path.join(store_dir, IVF_DIR)
+    os.makedirs(out, exist_ok=True)
+    for name in ('centroids', 'offsets', 'ids', 'vectors'):
+        emb_store.save_array(os.path.join(out, name + '.npy'), getattr(engine, name))
+
+
+def load_ivf(store_dir: str, nprobe: int = 8) -> IVFEngine:
+    path = os.path.join(store_dir, IVF_DIR)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'No IVF index in {store_dir}; build one with `python retrieval.py build-ivf {store_dir}`')
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+              for name in ('centroids', 'offsets', 'ids', 'vectors')}
+    return IVFEngine(np.asarray(arrays['centroids']), np.asarray(arrays['offsets']),
+                     np.asarray(arrays['ids']), arrays['vectors'], nprobe=nprobe)
+
+
+class BatchingEngine:
+    """Coalesces concurrent ``search`` calls from different threads into one.
+
+    The first query to arrive opens a window of ``window_ms``. Everything
+    submitted until it closes (or until ``max_batch`` query rows are
+    waiting) is searched with one ``engine.search`` at the largest requested
+    k. Each caller gets its own rows, cut to its k.
+    """
+
+    def __init__(self, engine, window_ms: float = 2.0, max_batch: int = 256):
+        self.engine = engine
+        self.name = engine.name
+        self.batches_queries = engine.batches_queries
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = []  # [(queries, k, future)]
+        self._rows = 0
+        self._closed = False
+        self.batches = 0
+        self.queries = 0
+        threading.Thread(target=self._run, daemon=True, name='search-batcher').start()
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        future = Future()
+        with self._cond:
+            if self._closed:
+                return self.engine.search(queries, k)
+            self._pending.append((queries, k, future))
+            self._rows += len(queries)
+            self._cond.notify()
+        return future.result()
+
+    def close(self):
+        """Stop the dispatcher thread once pending searches are answered; later searches run unbatched."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while self._rows < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending, self._rows = self._pending, [], 0
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                indices, scores = self.engine.search(np.concatenate([q for q, _, _ in batch]),
+                                                     max(k for _, k, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(indices)
+            start = 0
+            for queries, k, future in batch:
+                end = start + len(queries)
+                future.set_result((indices[start:end, :k], scores[start:end, :k]))
+                start = end
+
+
+def default_nlist(rows: int) -> int:
+    return max(1, int(4 * np.sqrt(rows)))
+
+
+def rebuild_indexes(base_dir: str | None, store_dir: str, matrix: np.ndarray, engine: str | None = None,
+                    scales: str = 'row', dim: int = 256) -> list:
+    """Build in ``store_dir`` the indexes ``base_dir`` has, plus what ``engine`` needs; returns their names.
+
+    Used when a catalog update writes a new store. IVF keeps the base store's
+    centroids and only reassigns rows, which is cheap and good enough for a
+    catalog that changes by a few percent a day. ``engine``, ``scales`` and
+    ``dim`` are the ``load_engine`` settings the store will be served with;
+    an index they need that the base lacks is built from scratch.
+    """
+    built = []
+    if base_dir and os.path.isdir(os.path.join(base_dir, IVF_DIR)):
+        centroids = np.load(os.path.join(base_dir, IVF_DIR, 'centroids.npy'))
+        save_ivf(store_dir, ivf_from_centroids(matrix, centroids))
+        built.append('ivf')
+    for dtype, quant_scales in (('int8', 'row'), ('int8', 'dim')):
+        if base_dir and os.path.isdir(quant_dir(base_dir, dtype, quant_scales)):
+            save_quantized(store_dir, dtype, quant_scales, *quantize(matrix, dtype, quant_scales))
+            built.append(os.path.basename(quant_dir(store_dir, dtype, quant_scales)))
+    for name in sorted(os.listdir(base_dir)) if base_dir else []:
+        if name.startswith('prefix-') and name.endswith('.npy'):
+            prefix_dim = int(name[len('prefix-'):-len('.npy')])
+            emb_store.save_array(prefix_path(store_dir, prefix_dim), truncate(matrix, prefix_dim))
+            built.append(name[:-len('.npy')])
+    if engine == 'ivf' and 'ivf' not in built:
+        save_ivf(store_dir, build_ivf(matrix, default_nlist(len(matrix))))
+        built.append('ivf')
+    elif engine == 'int8' and os.path.basename(quant_dir(store_dir, engine, scales)) not in built:
+        save_quantized(store_dir, engine, scales, *quantize(matrix, engine, scales))
+        built.append(os.path.basename(quant_dir(store_dir, engine, scales)))
+    elif engine == 'matryoshka' and f'prefix-{dim}' not in built:
+        emb_store.save_array(prefix_path(store_dir, dim), truncate(matrix, dim))
+        built.append(f'prefix-{dim}')
+    return built
+
+
+def load_engine(name: str, matrix: np.ndarray, store_dir: str | None = None, nprobe: int = 8,
+                scales: str = 'row', rescore: int = 200, dim: int = 256):
+    """Build the engine selected by ``name`` over ``matrix`` / the store's saved indexes."""
+    if name == 'exact':
+        return ExactEngine(matrix)
+    if name == 'matryoshka' and store_dir is None:
+        # No store to keep the prefix in: cut it from the in-memory matrix
+        return TruncatedEngine(truncate(matrix, dim), matrix, rescore=rescore)
+    if name == 'float16':
+        raise ValueError('The float16 engine was removed (its first pass was slower than exact); use int8')
+    if name in ('ivf', 'int8', 'matryoshka') and store_dir is None:
+        raise ValueError(f'The {name} engine needs an embedding store (EMB_STORE)')
+    if name == 'ivf':
+        return load_ivf(store_dir, nprobe=nprobe)
+    if name == 'int8':
+        return load_quantized(store_dir, matrix, name, scales=scales, rescore=rescore)
+    if name == 'matryoshka':
+        return load_truncated(store_dir, matrix, dim, rescore=rescore)
+    raise ValueError(f'Unknown retrieval engine {name!r}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build retrieval indexes next to an embedding store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ivf = sub.add_parser('build-ivf', help='cluster the store into an IVF index')
+    ivf.add_argument('store_dir')
+    ivf.add_argument('--nlist', type=int, default=None, help='number of lists (default: 4*sqrt(rows))')
+    ivf.add_argument('--iters', type=int, default=20)
+    ivf.add_argument('--seed', type=int, default=0)
+    quant = sub.add_parser('quantize', help='write an int8 copy of the store')
+    quant.add_argument('store_dir')
+    quant.add_argument('--dtype', choices=['int8'], default='int8')
+    quant.add_argument('--scales', choices=['row', 'dim'], default='row', help='int8 scale granularity')
+    trunc = sub.add_parser('truncate', help='write a re-normalized prefix of the store')
+    trunc.add_argument('store_dir')
+    trunc.add_argument('--dim', type=int, default=256)
+    args = parser.parse_args(argv)
+
+    matrix = emb_store.open_store(args.store_dir)
+    if args.command == 'build-ivf':
+        nlist = args.nlist or default_nlist(len(matrix))
+        engine = build_ivf(matrix, nlist, iters=args.iters, seed=args.seed)
+        save_ivf(args.store_dir, engine)
+        sizes = np.diff(engine.offsets)
+        print(f'Built IVF index with {nlist} lists over {len(matrix)} rows '
+              f'(list size min/median/max {sizes.min()}/{int(np.median(sizes))}/{sizes.max()})')
+    elif args.command == 'quantize':
+        codes, factors = quantize(matrix, args.dtype, args.scales)
+        save_quantized(args.store_dir, args.dtype, args.scales, codes, factors)
+        nbytes = codes.nbytes + (factors.nbytes if factors is not None else 0)
+        print(f'Wrote {os.path.basename(quant_dir(args.store_dir, args.dtype, args.scales))} matrix: '
+              f'{nbytes / 2**20:.1f} MiB (float32 store is {matrix.nbytes / 2**20:.1f} MiB)')
+    elif args.command == 'truncate':
+        if args.dim > matrix.shape[1]:
+            parser.error(f'--dim {args.dim} is wider than the {matrix.shape[1]}-dimensional store')
+        prefix = truncate(matrix, args.dim)
+        emb_store.save_array(prefix_path(args.store_dir, args.dim), prefix)
+        print(f'Wrote {args.dim}-dim prefix: {prefix.nbytes / 2**20:.1f} MiB '
+              f'(float32 store is {matrix.nbytes / 2**20:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from exact_index import ExactIndex, normalize_description, normalize_id
+
+ITEM_IDS = ['0000001289', 'NV', '101', 'SEAL-1', 'ICAF-COMMISSIONING', 'FL90-2']
+DESCRIPTIONS = ['2 FIRELOCK 90 ELBOW', '.', 'SEAL', 'Seal.', 'Labor', '1-1/2 FLEX GRV COUPLING']
+
+
+@pytest.fixture
+def index():
+    return ExactIndex.build(ITEM_IDS, DESCRIPTIONS)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2 Firelock  90 Elbow.', '2 firelock 90 elbow'),
+    ('1-1/2 flex grv coupling', '1 1/2 flex grv coupling'),
+    ('1 ½ flex grv coupling', '1 1/2 flex grv coupling'),
+    ('1 / 2 nut', '1/2 nut'),
+    ('...', ''),
+    ('.', ''),
+    ('?', ''),
+    ('  ', ''),
+])
+def test_normalize_description(text, expected):
+    assert normalize_description(text) == expected
+
+
+def test_normalize_id():
+    assert normalize_id('0000 001289.') == '0000001289'
+    assert normalize_id(' ... ') == ''
+
+
+def test_empty_keys_are_not_indexed(index):
+    assert len(index.description_hashes) == len(set(filter(None, map(normalize_description, DESCRIPTIONS))))
+    for noise in ('...', '.', '?', ''):
+        assert index.lookup(noise) is None
+
+
+def test_lookup(index):
+    assert index.lookup('0000 001289.') == (0, 'exact_id')
+    assert index.lookup('2 firelock 90 elbow') == (0, 'exact_description')
+    assert index.lookup('1 ½ flex grv coupling') == (5, 'exact_description')
+    # Duplicate keys resolve to their first row
+    assert index.lookup('seal') == (2, 'exact_description')
+    assert index.lookup('2 firelock 45 elbow') is None
+
+
+def test_rows_stay_aligned_after_a_skipped_key():
+    index = ExactIndex.build(['A1', 'B2', 'C3'], ['.', 'OIL BREATHER', 'TEE'])
+    assert index.lookup('oil breather') == (1, 'exact_description')
+    assert index.lookup('tee') == (2, 'exact_description')
+
+
+@pytest.mark.parametrize('utterance', ['...', '.', '101.', 'Seal.', 'Labor', 'NV'])
+def test_lookup_utterance_ignores_short_hits(index, utterance):
+    assert index.lookup_utterance(utterance) is None
+
+
+def test_lookup_utterance_accepts_long_ids_and_descriptions(index):
+    assert index.lookup_utterance('0000 001289.') == (0, 'exact_id')
+    assert index.lookup_utterance('2 firelock 90 elbow.') == (0, 'exact_description')
+
+
+def test_save_and_load(index, tmp_path):
+    index.save(str(tmp_path))
+    loaded = ExactIndex.load(str(tmp_path))
+    for name in ExactIndex.FILES:
+        assert np.array_equal(getattr(loaded, name), getattr(index, name))
+    assert loaded.lookup('...') is None
+    assert loaded.lookup('fl90-2') == (5, 'exact_id')
@@ -0,0 +1,77 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calibrate_gate
+import gate
+import retrieval
+from catalog import RowStore
+from exact_index import ExactIndex
+
+
+@pytest.mark.parametrize('query, description, top1, top2, expected', [
+    ('firelock tee', 'FLEX COUPLING', 0.8, 0.6, 1.0),
+    ('firelock tee', 'FLEX COUPLING', 0.8, 0.8, 0.8),
+    ('2 Firelock Tee.', '2 FIRELOCK TEE', 0.7, 0.69, 1.7),
+    ('1-1/2 tee', '1 ½ TEE', 0.7, 0.69, 1.7),
+])
+def test_score(query, description, top1, top2, expected):
+    assert gate.score(query, description, top1, top2) == pytest.approx(expected)
+
+
+def test_score_margin_weight():
+    assert gate.score('a', 'b', 0.8, 0.6, margin_weight=0.5) == pytest.approx(0.9)
+
+
+@pytest.mark.parametrize('top2', [float('-inf'), float('nan')])
+def test_score_without_runner_up_is_a_miss(top2):
+    assert gate.score('firelock tee', 'FLEX COUPLING', 0.9, top2) == -math.inf
+    # Even a verbatim description needs a runner-up
+    assert gate.score('flex coupling', 'FLEX COUPLING', 0.9, top2) == -math.inf
+
+
+@pytest.mark.parametrize('query', ['...', '.', '?', ''])
+def test_score_never_matches_empty_descriptions(query):
+    assert gate.score(query, '.', 0.5, 0.4) == pytest.approx(0.6)
+
+
+def catalog_fixture():
+    df = pd.DataFrame({'item_id': ['A1', 'B2', 'C3', 'NV'],
+                       'description': ['FIRELOCK TEE', 'FLEX COUPLING', 'OIL BREATHER', '.']})
+    matrix = np.eye(4, dtype=np.float32)
+    vectors = {'firelock tee': [1, 0, 0, 0], 'flex cuppling': [0.1, 0.9, 0, 0], 'oil breathr': [0, 0, 0.6, 0.55],
+               '...': [0, 0, 0.3, 0.8]}
+    cat = SimpleNamespace(exact=ExactIndex.build(df['item_id'], df['description']), rows=RowStore.from_frame(df),
+                          engine=retrieval.ExactEngine(matrix))
+    embed = lambda texts: [vectors[t] for t in texts]
+    return cat, embed
+
+
+def test_gate_scores_skips_exact_hits():
+    cat, embed = catalog_fixture()
+    queries = ['firelock tee', 'flex cuppling', 'A1', 'oil breathr', '...']
+    gated, scores, top_ids = calibrate_gate.gate_scores(cat, embed, queries, margin_weight=1.0, batch=2)
+    assert gated == [1, 3, 4]  # "firelock tee" and "A1" are exact-index hits
+    assert top_ids == ['B2', 'C3', 'NV']
+    # "..." against "." gets no verbatim bonus (it would be 1.8)
+    assert scores == pytest.approx([0.9 + 0.8, 0.6 + 0.05, 0.8 + 0.5])
+
+
+def test_sweep():
+    scores = np.array([1.7, 1.2, 0.9, 0.65, 0.4])
+    correct = np.array([True, True, False, True, False])
+    rows, best = calibrate_gate.sweep(scores, correct, [0.5, 1.0, 1.5, 2.0], target_precision=0.9)
+    assert [(t, accepted) for t, accepted, _, _ in rows] == [(0.5, 4), (1.0, 2), (1.5, 1), (2.0, 0)]
+    assert rows[0][2] == pytest.approx(0.8)
+    assert rows[0][3] == pytest.approx(0.75)
+    assert math.isnan(rows[3][3])
+    assert best == 1.0
+
+
+def test_sweep_needs_every_higher_threshold_to_meet_the_target():
+    scores = np.array([1.6, 1.1, 0.7])
+    correct = np.array([False, True, True])
+    assert calibrate_gate.sweep(scores, correct, [0.5, 1.0, 1.5], target_precision=0.9)[1] is None
@@ -0,0 +1,43 @@
+import threading
+
+import numpy as np
+import pytest
+
+import retrieval
+
+
+def unit_rows(rows, dim, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_only_vectorized_engines_batch_queries():
+    matrix = unit_rows(64, 16)
+    assert retrieval.ExactEngine(matrix).batches_queries
+    assert retrieval.TruncatedEngine(retrieval.truncate(matrix, 8), matrix).batches_queries
+    assert not retrieval.IVFEngine.batches_queries
+    assert not retrieval.QuantizedEngine.batches_queries
+
+
+def test_batching_engine_matches_per_call_search():
+    matrix = unit_rows(500, 32)
+    queries = unit_rows(40, 32, seed=1)
+    exact = retrieval.ExactEngine(matrix)
+    batching = retrieval.BatchingEngine(exact, window_ms=20)
+    assert batching.batches_queries and batching.name == 'exact'
+    results = [None] * len(queries)
+
+    def search(i):
+        results[i] = batching.search(queries[i], k=3 + i % 4)
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(len(queries))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batching.close()
+    for i, (indices, scores) in enumerate(results):
+        expected_ix, expected_scores = exact.search(queries[i:i + 1], 3 + i % 4)
+        assert indices.tolist() == expected_ix.tolist()
+        assert scores == pytest.approx(expected_scores, abs=1e-5)
+    assert batching.batches < len(queries)
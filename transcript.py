@@ -0,0 +1,106 @@
+"""In-memory transcript for the CLI client, persisted by a background writer.
+
+``realtime.py`` used to open ``transcript.txt`` for every transcription
+delta, and the extractor re-read the whole file on every wakeup.
+``TranscriptBuffer`` keeps the call in memory, split into utterances. A
+writer thread appends the new text to the file in batches: once per
+completed utterance, plus every ``flush_interval`` seconds while an utterance
+is in progress. It fsyncs at most every ``fsync_interval`` seconds (0 = after
+every write). The file content is the same as before: deltas, with a newline
+after each completed utterance.
+
+Consumers keep an integer cursor (the number of utterances already handled).
+``since(cursor)`` returns only the utterances after it.
+"""
+import os
+import threading
+import time
+from typing import List, Tuple
+
+
+class TranscriptBuffer:
+    def __init__(self, path: str | None, flush_interval: float = 1.0, fsync_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.utterances = []
+        self._current = []
+        self._unwritten = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._file = None
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        self.writes = 0
+        self.fsyncs = 0
+
+    def start(self):
+        if self.path:
+            self._file = open(self.path, 'a')
+            self._thread = threading.Thread(target=self._write_loop, daemon=True, name='transcript-writer')
+            self._thread.start()
+        return self
+
+    def add_delta(self, delta: str):
+        with self._cond:
+            self._current.append(delta)
+            self._unwritten.append(delta)
+
+    def complete(self):
+        """Close the utterance in progress; wakes the writer and any waiting consumer."""
+        with self._cond:
+            self.utterances.append(''.join(self._current))
+            self._current.clear()
+            self._unwritten.append('\n')
+            self._cond.notify_all()
+
+    def since(self, cursor: int) -> Tuple[List[str], int]:
+        """Completed utterances after ``cursor`` and the new cursor."""
+        with self._cond:
+            return self.utterances[cursor:], len(self.utterances)
+
+    def wait_for(self, cursor: int, timeout: float) -> bool:
+        """Block until an utterance after ``cursor`` completes; False on timeout or close."""
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.utterances) > cursor or self._closed, timeout) \
+                and len(self.utterances) > cursor
+
+    def text(self) -> str:
+        with self._cond:
+            return ''.join(u + '\n' for u in self.utterances) + ''.join(self._current)
+
+    def close(self):
+        """Stop the writer after a final flush and fsync."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._file:
+            self._flush(fsync=True)
+            self._file.close()
+            self._file = None
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self._flush(fsync=time.monotonic() - self._last_fsync >= self.fsync_interval)
+
+    def _flush(self, fsync: bool):
+        with self._cond:
+            pending, self._unwritten = self._unwritten, []
+        if pending:
+            self._file.write(''.join(pending))
+            self._file.flush()
+            self.writes += 1
+            self._unsynced = True
+        if fsync and self._unsynced:
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+            self._unsynced = False
+            self._last_fsync = time.monotonic()
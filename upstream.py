@@ -0,0 +1,184 @@
+"""Asyncio connection to the OpenAI realtime API.
+
+Replaces the per-session ``websocket-client`` connection and daemon thread:
+a session is one ``websockets`` client connection on the server's event loop,
+so hundreds of concurrent calls cost no OS threads and messages are forwarded
+as they arrive instead of being polled from a queue.
+
+Browser audio arrives as raw PCM16 (binary frames, or base64 text from older
+clients). ``AudioCoalescer`` buffers it per session so that each
+``input_audio_buffer.append`` carries about ``target_ms`` of audio. That
+means one base64 encode and one JSON message per chunk, not per frame.
+
+``SessionPool`` keeps sessions that are already connected and configured, so
+a browser connection does not wait for the TLS handshake and session setup
+before its first words are transcribed.
+"""
+import asyncio
+import base64
+import json
+import time
+
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.protocol import State
+
+# pcm16 mono at 24 kHz, the realtime API's input format
+PCM_BYTES_PER_MS = 24000 * 2 // 1000
+
+SESSION_CONFIG = {
+    "type": "session.update",
+    "session": {
+        "turn_detection": {
+            "type": "server_vad",
+            "threshold": 0.5,
+            "prefix_padding_ms": 300,
+            "silence_duration_ms": 500
+        },
+        "input_audio_format": "pcm16",
+        "input_audio_transcription": {
+            "model": "whisper-1"
+        }
+    }
+}
+
+
+async def open_session(url: str, api_key: str) -> ClientConnection:
+    """Connect and configure a transcription session (same config as realtime.py)."""
+    ws = await connect(url, additional_headers={
+        'Authorization': f'Bearer {api_key}',
+        'OpenAI-Beta': 'realtime=v1',
+    }, max_size=None)
+    try:
+        while True:
+            data = json.loads(await ws.recv())
+            if data.get('type') == 'session.created':
+                break
+            if data.get('type') == 'error':
+                raise RuntimeError(f'OpenAI error: {data}')
+        await ws.send(json.dumps(SESSION_CONFIG))
+    except BaseException:
+        await ws.close()
+        raise
+    return ws
+
+
+async def send_audio(ws: ClientConnection, pcm: bytes):
+    """Append one PCM16 chunk to the session's input buffer."""
+    await ws.send(json.dumps({'type': 'input_audio_buffer.append', 'audio': base64.b64encode(pcm).decode('ascii')}))
+
+
+class AudioCoalescer:
+    """Per-session buffer that releases PCM16 in chunks of at least ``target_ms``.
+
+    ``target_ms=0`` releases every frame as is. Frames at least that long
+    (the browser's 4096-sample blocks are ~170 ms) pass straight through.
+    Smaller frames wait for at most ``target_ms`` of audio.
+    """
+
+    def __init__(self, target_ms: int = 100):
+        self.target_bytes = max(1, target_ms * PCM_BYTES_PER_MS)
+        self._buffer = bytearray()
+        self.frames = 0
+        self.chunks = 0
+
+    def add(self, pcm: bytes) -> bytes | None:
+        """Buffer one frame; returns a chunk to send once enough audio is buffered."""
+        self.frames += 1
+        self._buffer += pcm
+        if len(self._buffer) < self.target_bytes:
+            return None
+        return self.flush()
+
+    def flush(self) -> bytes | None:
+        """Whatever is buffered, or None if nothing is."""
+        if not self._buffer:
+            return None
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        self.chunks += 1
+        return chunk
+
+
+class SessionPool:
+    """Pre-warmed upstream sessions, refilled in the background.
+
+    ``acquire`` hands out a warm session, or connects on demand when the pool
+    is empty (or ``size`` is 0). A session that has sat idle for
+    ``max_idle`` seconds, or that the server has closed, is discarded, not
+    handed out. The refill task replaces every session taken or discarded,
+    backing off while connects fail.
+    """
+
+    def __init__(self, url: str, api_key: str, size: int = 0, max_idle: float = 300.0):
+        self.url = url
+        self.api_key = api_key
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = []  # [(opened_at, ws)], oldest first
+        self._wake = asyncio.Event()
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.connect_errors = 0
+
+    def start(self):
+        if self.size and self._task is None:
+            self._task = asyncio.create_task(self._refill())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        idle, self._idle = self._idle, []
+        for _, ws in idle:
+            await ws.close()
+
+    def _usable(self, opened_at: float, ws: ClientConnection) -> bool:
+        return ws.state is State.OPEN and time.monotonic() - opened_at < self.max_idle
+
+    async def acquire(self) -> ClientConnection:
+        while self._idle:
+            opened_at, ws = self._idle.pop()  # newest first
+            self._wake.set()
+            if self._usable(opened_at, ws):
+                self.hits += 1
+                return ws
+            self.expired += 1
+            await ws.close()
+        self.misses += 1
+        return await open_session(self.url, self.api_key)
+
+    async def _refill(self):
+        backoff = 1.0
+        while True:
+            for opened_at, ws in list(self._idle):
+                if not self._usable(opened_at, ws):
+                    self._idle.remove((opened_at, ws))
+                    self.expired += 1
+                    await ws.close()
+            if len(self._idle) < self.size:
+                try:
+                    ws = await open_session(self.url, self.api_key)
+                except Exception as e:
+                    self.connect_errors += 1
+                    print(f'Upstream pool connect failed: {e}; retrying in {backoff:.0f}s')
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+                    continue
+                backoff = 1.0
+                self._idle.append((time.monotonic(), ws))
+                continue
+            self._wake.clear()
+            # Wake when a session is taken, or in time to expire the oldest one
+            timeout = None
+            if self._idle:
+                timeout = max(0.1, self.max_idle - (time.monotonic() - self._idle[0][0]))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {'size': self.size, 'warm': len(self._idle), 'hits': self.hits, 'misses': self.misses,
+                'expired': self.expired, 'connect_errors': self.connect_errors}
@@ -0,0 +1,91 @@
+"""Local voice-activity gate for the PCM16 stream, before it goes upstream.
+
+Long stretches of silence and line noise during phone orders were all sent to
+the realtime API. ``VoiceGate`` splits the stream into short frames and marks
+a frame as voice when its RMS level clears ``energy_db`` (dBFS) and it does
+not look like broadband noise. Noise crosses zero far more often than voiced
+speech, so a frame whose zero-crossing rate exceeds ``zcr_max`` only counts
+as voice if it is ``loud_db`` above the energy threshold (loud fricatives).
+
+Voice is forwarded together with ``preroll_ms`` of the audio before it, so
+word onsets are not clipped. After the last voiced frame, audio keeps flowing
+for ``hangover_ms``. Keep the hangover above the upstream server VAD's
+``silence_duration_ms`` (500), or the API never sees enough trailing silence
+to close the utterance. Everything else is dropped.
+"""
+from collections import deque
+
+import numpy as np
+
+
+def frame_features(frames: np.ndarray):
+    """Per-frame RMS level in dBFS and zero-crossing rate for int16 frames (n, frame_len)."""
+    x = frames.astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(x * x, axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+    return db, zcr
+
+
+class VoiceGate:
+    def __init__(self, rate: int = 24000, frame_ms: int = 20, energy_db: float = -45.0, zcr_max: float = 0.25,
+                 loud_db: float = 15.0, hangover_ms: int = 700, preroll_ms: int = 300):
+        self.frame_bytes = rate * frame_ms // 1000 * 2
+        self.energy_db = energy_db
+        self.zcr_max = zcr_max
+        self.loud_db = loud_db
+        self.hangover_frames = hangover_ms // frame_ms
+        self._preroll = deque(maxlen=preroll_ms // frame_ms)
+        self._hangover = 0
+        self._partial = b''
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames = 0
+        self.voiced_frames = 0
+
+    def is_voiced(self, db: np.ndarray, zcr: np.ndarray) -> np.ndarray:
+        return (db >= self.energy_db) & ((zcr <= self.zcr_max) | (db >= self.energy_db + self.loud_db))
+
+    def process(self, pcm: bytes) -> bytes:
+        """Feed PCM16 of any length; returns the audio to forward (possibly empty)."""
+        return b''.join(frame for _, frame in self.process_frames(pcm))
+
+    def process_frames(self, pcm: bytes) -> list:
+        """Like ``process`` but returns the forwarded frames as (frame number, bytes)."""
+        self.bytes_in += len(pcm)
+        data = self._partial + pcm
+        n = len(data) // self.frame_bytes
+        self._partial = data[n * self.frame_bytes:]
+        if not n:
+            return []
+        frames = np.frombuffer(data, dtype='<i2', count=n * self.frame_bytes // 2).reshape(n, -1)
+        voiced = self.is_voiced(*frame_features(frames))
+
+        out = []
+        for i in range(n):
+            numbered = (self.frames + i, data[i * self.frame_bytes:(i + 1) * self.frame_bytes])
+            if voiced[i]:
+                out.extend(self._preroll)
+                self._preroll.clear()
+                out.append(numbered)
+                self._hangover = self.hangover_frames
+            elif self._hangover > 0:
+                out.append(numbered)
+                self._hangover -= 1
+            else:
+                self._preroll.append(numbered)
+        self.frames += n
+        self.voiced_frames += int(voiced.sum())
+        self.bytes_out += len(out) * self.frame_bytes
+        return out
+
+    def stats(self) -> dict:
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'suppressed': 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0,
+            'voiced_frames': self.voiced_frames,
+            'frames': self.frames,
+        }